@@ -1,3 +1,4 @@
+import asyncio
 import csv
 import os
 
@@ -18,13 +19,15 @@ def file_to_csv(filename: str, output_file: str, is_spam: int, analyzer: SpamAna
     raw_files = get_files_from_dir(filename)
     datalist = []
     for file in track(raw_files, description=f"Analyzing files from {filename} folder"):
-        analysis = analyzer.analyze(file)
+        analysis = asyncio.run(analyzer.analyze(file, full=True))
         list_analysis = analysis.to_list()
         list_analysis.append(is_spam)
         datalist.append(list_analysis)
     list_to_csv(datalist, output_file)
 
 
+# NOTE: `spam-analyzer train` analyzes the folders in parallel and keeps the features
+# in a reusable store, this script is kept as an example of the library API.
 if __name__ == "__main__":
     with open("conf/word_blacklist.txt", "r") as f:
         wordlist = f.readlines()
@@ -1,8 +1,7 @@
-import asyncio
 import os
 import sys
 from io import TextIOWrapper
-from typing import List
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import click
 import click_extra
@@ -11,8 +10,49 @@ from rich.console import Console
 
 import app.files as files
 import spamanalyzer.plugins as plugins
-from app.io import print_output
-from spamanalyzer import SpamAnalyzer
+from app.checkpoint import Checkpoint, CheckpointWriter
+from app.io import (
+    ResultWriter,
+    open_writer,
+    print_campaign_summary,
+    print_cascade_summary,
+    print_memory_report,
+    print_template_summary,
+    print_utilization_report,
+)
+from app.pipeline import GracefulInterrupt, PipelineConfig, run_pipeline
+from spamanalyzer import Cascade, SpamAnalyzer
+from spamanalyzer.blocklist import Blocklist, Blocklists
+from spamanalyzer.campaigns import CampaignIndex
+from spamanalyzer.data_structures import default_model
+from spamanalyzer.ml import content_hash, extraction_fingerprint
+from spamanalyzer.networks import NetworkTable
+from spamanalyzer.parallel import AnalysisPool, memory_usage, plan_chunks
+from spamanalyzer.parser import PARSERS
+from spamanalyzer.resolver import ResolverCache
+from spamanalyzer.templates import TemplateCache
+
+
+def _parse_shard(ctx: Context, param: click.Parameter,
+                 value: Optional[str]) -> Optional[Tuple[int, int]]:
+    if value is None:
+        return None
+    try:
+        shard, shards = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise click.BadParameter("expected K/N, e.g. 2/4") from None
+    if not 1 <= shard <= shards:
+        raise click.BadParameter("K must be between 1 and N")
+    return shard, shards
+
+
+def _load_blocklist(path: Optional[str], option: str) -> Optional[Blocklist]:
+    if path is None:
+        return None
+    try:
+        return Blocklist.load(path)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint=option) from e
 
 
 @click.command()
@@ -26,14 +66,188 @@ from spamanalyzer import SpamAnalyzer
     "-fmt",
     "--output-format",
     help="Format output in a different way",
-    type=click.Choice(["json"]),
+    type=click.Choice(["json", "ndjson", "csv"]),
 )
 @click_extra.option(
     "-o",
     "--output-file",
-    help="Write output to a file (works only for json format)",
+    help="Write output to a file (works only with --output-format)",
     type=click.File("w"),
 )
+@click_extra.option(
+    "--chunk-size",
+    help="Number of emails classified at once",
+    type=click.IntRange(min=1),
+    default=1024,
+    show_default=True,
+)
+@click_extra.option(
+    "--cascade-model",
+    help="A header only model: skip the body analysis when it is confident",
+    type=click.Path(exists=True, dir_okay=False, readable=True),
+)
+@click_extra.option(
+    "--cascade-band",
+    help="Header model spam probabilities that need the complete analysis",
+    type=click.FloatRange(min=0, max=1),
+    nargs=2,
+    default=(0.1, 0.9),
+    show_default=True,
+)
+@click_extra.option(
+    "--campaign-index",
+    help=("An index of the bodies already analyzed, the emails of a campaign reuse "
+          "the analysis of a similar body; it is created if it does not exist"),
+    type=click.Path(dir_okay=False, writable=True),
+)
+@click_extra.option(
+    "--campaign-threshold",
+    help="The minimum similarity of the bodies of a campaign",
+    type=click.FloatRange(min=0, max=1, min_open=True),
+    default=0.9,
+    show_default=True,
+)
+@click_extra.option(
+    "--template-cache",
+    help=("Cache the text checks of up to N bodies, so that the emails of a template "
+          "are analyzed once, and report the hit rate"),
+    type=click.IntRange(min=1),
+    metavar="N",
+)
+@click_extra.option(
+    "--max-message-size",
+    help=("Analyze only the headers, the beginning and the end of the text and the "
+          "first bytes of the attachments of the emails larger than BYTES"),
+    type=click.IntRange(min=1),
+    metavar="BYTES",
+)
+@click_extra.option(
+    "--parser",
+    help=("The email parser: mailparser, or the lighter parser of the standard "
+          "library"),
+    type=click.Choice(list(PARSERS)),
+    default="mailparser",
+    show_default=True,
+)
+@click_extra.option(
+    "--dns-prefetch",
+    help=("Resolve the addresses of the mail servers once per run, up to N at once, "
+          "before the emails are analyzed"),
+    type=click.IntRange(min=1),
+    metavar="N",
+)
+@click_extra.option(
+    "--dns-timeout",
+    help="Give up a DNS lookup after SECONDS (with --dns-prefetch)",
+    type=click.FloatRange(min=0, min_open=True),
+    metavar="SECONDS",
+    default=5.0,
+    show_default=True,
+)
+@click_extra.option(
+    "--dns-cache",
+    help=("A SQLite cache of the DNS lookups, loaded before the analysis and updated "
+          "after it; it is created if it does not exist"),
+    type=click.Path(dir_okay=False, writable=True),
+    metavar="FILE",
+)
+@click_extra.option(
+    "--offline",
+    help=("Never use the network: the addresses not in the --dns-cache have an "
+          "unknown domain"),
+    is_flag=True,
+)
+@click_extra.option(
+    "--networks",
+    help=("A table of IP ranges compiled by the networks command: the autonomous "
+          "systems of the Received hops are added to the headers analysis"),
+    type=click.Path(exists=True, dir_okay=False, readable=True),
+    metavar="FILE",
+)
+@click_extra.option(
+    "--domain-blocklist",
+    help=("A blocklist of domains built by the blocklist command: the mails with a "
+          "link to one of them, or to one of their subdomains, are flagged"),
+    type=click.Path(exists=True, dir_okay=False, readable=True),
+    metavar="FILE",
+)
+@click_extra.option(
+    "--hash-blocklist",
+    help=("A blocklist of SHA-256 hashes built by the blocklist command: the mails "
+          "with an attachment in it are flagged"),
+    type=click.Path(exists=True, dir_okay=False, readable=True),
+    metavar="FILE",
+)
+@click_extra.option(
+    "--full-analysis",
+    help="Perform every check, even the ones not used by the model",
+    is_flag=True,
+)
+@click_extra.option(
+    "-j",
+    "--jobs",
+    help="Number of processes analyzing the emails of a directory",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+)
+@click_extra.option(
+    "--memory-report",
+    help="Print the memory used by each process (with --jobs)",
+    is_flag=True,
+)
+@click_extra.option(
+    "--schedule",
+    help=("How the emails are dispatched to the processes (with --jobs): as they "
+          "are listed, or the largest first and in chunks of decreasing size"),
+    type=click.Choice(["input", "size"]),
+    default="input",
+    show_default=True,
+)
+@click_extra.option(
+    "--parse-workers",
+    help="Number of threads parsing the emails (without --jobs)",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+)
+@click_extra.option(
+    "--extract-workers",
+    help="Number of emails analyzed concurrently (without --jobs)",
+    type=click.IntRange(min=1),
+    default=32,
+    show_default=True,
+)
+@click_extra.option(
+    "--window",
+    help="Maximum number of emails in the pipeline, it bounds the memory used",
+    type=click.IntRange(min=1),
+    default=256,
+    show_default=True,
+)
+@click_extra.option(
+    "--checkpoint",
+    help="A journal of the results, it allows to resume an interrupted analysis",
+    type=click.Path(dir_okay=False, writable=True),
+)
+@click_extra.option(
+    "--resume",
+    help="Skip the emails already in the --checkpoint journal",
+    is_flag=True,
+)
+@click_extra.option(
+    "--shard",
+    help="Analyze only the k-th of N shards of the emails, e.g. 2/4",
+    metavar="K/N",
+    callback=_parse_shard,
+)
+@click_extra.option(
+    "--shard-by",
+    help="Assign the emails to the shards by relative path or by content",
+    type=click.Choice(["path", "content"]),
+    default="path",
+    show_default=True,
+)
 @click_extra.argument(
     "input",
     type=click.Path(exists=True,
@@ -50,6 +264,32 @@ async def analyze(
     wordlist: TextIOWrapper,
     output_format: str,
     output_file: click.File,
+    chunk_size: int,
+    cascade_model: Optional[str],
+    cascade_band: Tuple[float, float],
+    campaign_index: Optional[str],
+    campaign_threshold: float,
+    template_cache: Optional[int],
+    max_message_size: Optional[int],
+    parser: str,
+    dns_prefetch: Optional[int],
+    dns_timeout: float,
+    dns_cache: Optional[str],
+    offline: bool,
+    networks: Optional[str],
+    domain_blocklist: Optional[str],
+    hash_blocklist: Optional[str],
+    full_analysis: bool,
+    jobs: int,
+    memory_report: bool,
+    schedule: str,
+    parse_workers: int,
+    extract_workers: int,
+    window: int,
+    checkpoint: Optional[str],
+    resume: bool,
+    shard: Optional[Tuple[int, int]],
+    shard_by: str,
     input: str,
 ) -> None:
     """Analyze emails from a file or directory."""
@@ -59,36 +299,175 @@ async def analyze(
     # 2. starts the application
 
     wordlist_content: List[str] = wordlist.read().splitlines()
-    data = []
+    verbose = ctx.obj["verbose"]
 
-    console = Console()
+    # the progress is shown on the standard error, the results are streamed on the
+    # standard output
+    console = Console(stderr=True)
 
-    analyzer = SpamAnalyzer(wordlist_content)
+    cascade = None
+    if cascade_model is not None:
+        try:
+            cascade = Cascade(cascade_model, *cascade_band)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--cascade-band") from e
 
-    if os.path.isdir(input):
-        with console.status("[bold]Reading files...", spinner="dots"):
-            file_list = files.get_files_from_dir(input, ctx.obj["verbose"])
-        with console.status("[bold]Analyzing emails...", spinner="dots"):
-            for mail_path in file_list:
-                analysis = analyzer.analyze(mail_path)
-                data.append(analysis)
-            data = await asyncio.gather(*data)
-
-    elif os.path.isfile(input) and files.file_is_valid_email(input):
-        analysis = await analyzer.analyze(input)
-        data.append(analysis)
+    campaigns = None
+    if campaign_index is not None:
+        if jobs > 1:
+            raise click.UsageError("--campaign-index cannot be used with --jobs")
+        # the reused analyses and verdicts must come from the same inputs and model
+        fingerprint = extraction_fingerprint(wordlist_content,
+                                             parser=parser,
+                                             max_bytes=max_message_size,
+                                             model=content_hash(default_model()).hex())
+        campaigns = CampaignIndex.load(campaign_index, campaign_threshold, fingerprint)
 
+    by_size = schedule == "size" and jobs > 1
+    sizes: Dict[str, int] = {}
+    if os.path.isdir(input) and by_size:
+        # every email has to be listed before the largest ones can be dispatched
+        sizes = dict(files.iter_sized_files_from_dir(input))
+        paths: Iterable[str] = list(sizes)
+    elif os.path.isdir(input):
+        paths = files.iter_files_from_dir(input)
+    elif os.path.isfile(input) and files.file_is_valid_email(input, max_message_size,
+                                                             parser):
+        sizes = {input: os.path.getsize(input)}
+        paths = [input]
     else:
-        if ctx.obj["verbose"]:
+        if verbose:
             click.echo("The file is not analyzable")
         sys.exit(1)
 
-    results = analyzer.classify_multiple_input(data)
+    if shard is not None:
+        root = input if os.path.isdir(input) else os.path.dirname(input)
+        paths = files.filter_shard(paths, root, *shard, by=shard_by)
+
+    def on_invalid(path: str) -> None:
+        if verbose:
+            console.print(f"Invalid file found: {path}")
+
+    journal = None
+    if resume and checkpoint is None:
+        raise click.UsageError("--resume needs a --checkpoint file")
+    if checkpoint is not None:
+        try:
+            journal = Checkpoint(checkpoint, resume=resume)
+        except FileExistsError as e:
+            raise click.UsageError(f"{e}, use --resume to continue it") from e
+
+    resolver = None
+    if dns_cache is not None:
+        resolver = ResolverCache.load(dns_cache, dns_prefetch or 64, dns_timeout,
+                                      offline)
+    elif dns_prefetch is not None or offline:
+        resolver = ResolverCache(dns_prefetch or 64, dns_timeout, offline)
+
+    network_table = None
+    if networks is not None:
+        try:
+            network_table = NetworkTable.load(networks)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--networks") from e
+
+    blocklists = Blocklists(_load_blocklist(domain_blocklist, "--domain-blocklist"),
+                            _load_blocklist(hash_blocklist, "--hash-blocklist"))
+
+    analyzer = SpamAnalyzer(wordlist_content,
+                            chunk_size=chunk_size,
+                            cascade=cascade,
+                            campaigns=campaigns,
+                            template_cache=(None if template_cache is None else
+                                            TemplateCache(template_cache)),
+                            max_bytes=max_message_size,
+                            parser=parser,
+                            resolver=resolver,
+                            networks=network_table,
+                            blocklists=blocklists)
+    cascade_stats = analyzer.cascade_stats
+    template_stats = None
+    report = None
+    utilization = None
+
+    has_networks = network_table is not None
+    with open_writer(output_format, verbose, output_file,
+                     has_networks) as output, GracefulInterrupt() as interrupt:
+        writer: ResultWriter = output
+        if journal is not None:
+            # the results of the previous runs come first, as in an uninterrupted run
+            for record in journal.replay():
+                output.write_record(record)
+            writer = CheckpointWriter(output, journal)
+            paths = (path for path in paths if path not in journal)
+        paths = interrupt.guard(paths)
+
+        try:
+            with console.status("[bold]Analyzing emails...", spinner="dots"):
+                if jobs > 1:
+                    with AnalysisPool(wordlist_content,
+                                      jobs=jobs,
+                                      cascade=cascade,
+                                      template_cache=template_cache,
+                                      max_bytes=max_message_size,
+                                      parser=parser,
+                                      resolver=resolver,
+                                      networks=network_table,
+                                      blocklists=blocklists) as pool:
+                        # at most two chunks per worker are in flight
+                        max_chunk = max(1, window // (jobs * 2))
+                        if by_size:
+                            chunks = plan_chunks(((path, sizes[path])
+                                                  for path in paths), jobs, max_chunk)
+                            results = pool.map_chunks(interrupt.guard(chunks),
+                                                      full=full_analysis,
+                                                      on_invalid=on_invalid)
+                        else:
+                            results = pool.map(paths,
+                                               chunksize=max_chunk,
+                                               full=full_analysis,
+                                               on_invalid=on_invalid)
+                        for analysis, is_spam in results:
+                            writer.write(analysis, is_spam)  # type: ignore
+                        cascade_stats = pool.cascade_stats
+                        template_stats = pool.template_stats
+                        report = pool.memory_report()
+                        utilization = pool.utilization_report()
+                else:
+                    config = PipelineConfig(parse_workers, extract_workers, chunk_size,
+                                            window)
+                    await run_pipeline(paths, analyzer, writer, config, full_analysis,
+                                       on_invalid)
+        finally:
+            if journal is not None:
+                journal.close()
+            if campaigns is not None:
+                campaigns.save(campaign_index)  # type: ignore
+            if resolver is not None and dns_cache is not None and not offline:
+                resolver.save(dns_cache)
+
+    if interrupt.requested.is_set():
+        message = "Interrupted, the results written so far are complete"
+        if journal is not None:
+            message += f": {journal.completed} in {checkpoint}, continue with --resume"
+        console.print(f"[bold yellow]{message}")
+
+    if cascade is not None:
+        print_cascade_summary(cascade_stats, to_stderr=output_format is not None)
+
+    if analyzer.template_cache is not None:
+        print_template_summary(template_stats or analyzer.template_cache.stats(),
+                               to_stderr=output_format is not None)
+
+    if campaigns is not None:
+        print_campaign_summary(campaigns.stats(), to_stderr=output_format is not None)
+
+    if memory_report:
+        print_memory_report(report or [memory_usage()],
+                            to_stderr=output_format is not None)
+
+    if by_size and utilization is not None:
+        print_utilization_report(utilization, to_stderr=output_format is not None)
 
-    print_output(
-        data,
-        output_format=output_format,
-        verbose=ctx.obj["verbose"],
-        results=results,
-        output_file=output_file,
-    )
+    if interrupt.requested.is_set():
+        sys.exit(130)
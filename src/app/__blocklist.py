@@ -0,0 +1,41 @@
+import os
+from typing import Optional
+
+import click
+import click_extra
+
+from spamanalyzer.blocklist import DEFAULT_ERROR_RATE, build_blocklist
+
+
+@click.command()
+@click_extra.argument(
+    "entries",
+    type=click.Path(exists=True, dir_okay=False, readable=True),
+)
+@click_extra.option(
+    "-o",
+    "--output-file",
+    help="Where to write the blocklist [default: ENTRIES with .bin extension]",
+    type=click.Path(dir_okay=False, writable=True),
+)
+@click_extra.option(
+    "--error-rate",
+    help="The probability that an entry not in the list is found",
+    type=click.FloatRange(0, 1, min_open=True, max_open=True),
+    default=DEFAULT_ERROR_RATE,
+    show_default=True,
+)
+def blocklist(entries: str, output_file: Optional[str], error_rate: float) -> None:
+    """Build a blocklist of domains or of attachment hashes.
+
+    ENTRIES is a text file with a domain or a SHA-256 hash (hexadecimal) per line,
+    comments start with `#`. The blocklist is memory-mapped by
+    `analyze --domain-blocklist` and `analyze --hash-blocklist`.
+    """
+
+    if output_file is None:
+        output_file = os.path.splitext(entries)[0] + ".bin"
+
+    with open(entries, "r", encoding="utf-8") as f:
+        count = build_blocklist(f, output_file, error_rate)
+    click.echo(f"{count} entries written to {output_file}")
@@ -9,6 +9,10 @@ from click import Context
 import app.files as files
 import spamanalyzer.plugins as plugins
 from app.__analyzer import analyze
+from app.__blocklist import blocklist
+from app.__merge import merge
+from app.__networks import networks
+from app.__trainer import compile_command, train
 
 config_dir = click.get_app_dir("spam-analyzer")
 
@@ -96,4 +100,9 @@ def main():
         show_plugins.add_command(command)
 
     cli.add_command(analyze)
+    cli.add_command(train)
+    cli.add_command(compile_command)
+    cli.add_command(merge)
+    cli.add_command(networks)
+    cli.add_command(blocklist)
     cli()
@@ -0,0 +1,83 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import click
+import click_extra
+from rich.console import Console
+
+from app.io import CsvWriter, detect_format, open_writer, print_summary, read_records
+
+
+def _output_format(formats: List[str], output_format: Optional[str]) -> str:
+    if "csv" in formats and set(formats) != {"csv"}:
+        raise click.UsageError("csv outputs cannot be merged with json or ndjson ones")
+    if output_format is None:
+        return formats[0]
+    if formats[0] == "csv" and output_format != "csv":
+        raise click.UsageError("csv outputs can only be merged to csv")
+    return output_format
+
+
+@click.command()
+@click_extra.option(
+    "-fmt",
+    "--output-format",
+    help="Format of the merged output [default: the format of the inputs]",
+    type=click.Choice(["json", "ndjson", "csv"]),
+)
+@click_extra.option(
+    "-o",
+    "--output-file",
+    help="Write the merged output to a file",
+    type=click.File("w"),
+)
+@click_extra.argument(
+    "inputs",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, dir_okay=False, readable=True),
+)
+def merge(
+    output_format: Optional[str],
+    output_file: Optional[click.File],
+    inputs: Tuple[str, ...],
+) -> None:
+    """Merge the outputs of the shards of an analysis (see `analyze --shard`).
+
+    The json, ndjson or csv outputs are combined in a single output ordered by file
+    name, and a summary of all the shards is printed. The records are held in memory
+    while they are sorted.
+    """
+
+    formats = [detect_format(path) for path in inputs]
+    output_format = _output_format(formats, output_format)
+    console = Console(stderr=True)
+
+    records: Dict[str, Dict[str, Any]] = {}
+    for path, input_format in zip(inputs, formats):
+        for record in read_records(path, input_format):
+            if record["filename"] in records:
+                console.print(f"[yellow]Duplicate result for {record['filename']} "
+                              f"in {path}, skipped[/yellow]")
+                continue
+            records[record["filename"]] = record
+
+    # the shards of an analysis with a networks table have its keys
+    networks = any(
+        "headers.origin_asn" in record or "origin_asn" in record.get("headers", ())
+        for record in records.values())
+    ham = spam = 0
+    with open_writer(output_format, False, output_file,
+                     networks) as writer:  # type: ignore
+        for filename in sorted(records):
+            record = records[filename]
+            if isinstance(writer, CsvWriter) and formats[0] == "csv":
+                writer.write_row(record)
+            else:
+                writer.write_record(record)
+            if record["is_spam"] == "true":
+                spam += 1
+            else:
+                ham += 1
+
+    # the summary does not get mixed with a merged output on the standard output
+    print_summary(ham, spam, to_stderr=output_file is None)
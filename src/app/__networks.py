@@ -0,0 +1,37 @@
+import os
+from typing import Optional
+
+import click
+import click_extra
+
+from spamanalyzer.networks import compile_networks
+
+
+@click.command()
+@click_extra.argument(
+    "table",
+    type=click.Path(exists=True, dir_okay=False, readable=True),
+)
+@click_extra.option(
+    "-o",
+    "--output-file",
+    help="Where to write the compiled table [default: TABLE with .bin extension]",
+    type=click.Path(dir_okay=False, writable=True),
+)
+def networks(table: str, output_file: Optional[str]) -> None:
+    """Compile a csv table of IP ranges and autonomous systems.
+
+    The rows have the first and the last address of a range, or a network in CIDR
+    notation, then the autonomous system number and its name, e.g. the iptoasn dumps
+    or the GeoLite2 ASN csv files. The compiled table is memory-mapped by
+    `analyze --networks`.
+    """
+
+    if output_file is None:
+        output_file = os.path.splitext(table)[0] + ".bin"
+
+    try:
+        count = compile_networks(table, output_file)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="TABLE") from e
+    click.echo(f"{count} ranges written to {output_file}")
@@ -0,0 +1,305 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import TextIOWrapper
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import click
+import click_extra
+import numpy as np
+from click import Context
+from rich.console import Console
+from rich.progress import track
+
+import app.files as files
+from spamanalyzer import SpamAnalyzer
+from spamanalyzer.ml import (
+    FEATURES,
+    HEADER_FEATURES,
+    FeatureStore,
+    SpamClassifier,
+    compile_model,
+    content_hash,
+    extraction_fingerprint,
+    save_model,
+)
+from spamanalyzer.resolver import ResolverCache
+
+# the analyzer of a worker process, see `__init_worker`
+_analyzer: Optional[SpamAnalyzer] = None
+
+
+def __init_worker(wordlist: List[str], resolver: Optional[ResolverCache]) -> None:
+    global _analyzer  # pylint: disable=global-statement
+    _analyzer = SpamAnalyzer(wordlist, resolver=resolver)
+
+
+def _extract(email_path: str) -> Optional[np.ndarray]:
+    assert _analyzer is not None
+    email = SpamAnalyzer.parse(email_path, _analyzer.max_bytes, _analyzer.parser)
+    if not SpamAnalyzer.is_analyzable(email):
+        return None
+    analysis = asyncio.run(_analyzer.analyze_parsed(email, email_path, full=True))
+    return analysis.to_array()
+
+
+def extract_features(
+        paths: Sequence[str],
+        wordlist: List[str],
+        jobs: int,
+        resolver: Optional[ResolverCache] = None) -> Iterator[Optional[np.ndarray]]:
+    """Analyze the mails in parallel and yield their features, in order, or `None`
+    for the files that are not valid mails (see `SpamAnalyzer.is_analyzable`).
+
+    Args:
+        paths (Sequence[str]): the paths of the mails
+        wordlist (list[str]): the spam wordlist
+        jobs (int): the number of worker processes, with `1` the mails are analyzed
+        in the current process
+        resolver (ResolverCache, optional): the cache of the DNS lookups, each worker
+        has its own copy
+
+    """
+    if jobs == 1:
+        __init_worker(wordlist, resolver)
+        yield from map(_extract, paths)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=__init_worker,
+                             initargs=(wordlist, resolver)) as executor:
+        chunksize = max(1, len(paths) // (jobs * 4))
+        yield from executor.map(_extract, paths, chunksize=chunksize)
+
+
+def _labelled_files(directories: Iterable[str], label: int) -> List[Tuple[str, int]]:
+    # the files are validated when they are analyzed, those in the store already are
+    return [(path, label) for directory in directories
+            for path in sorted(files.iter_files_from_dir(directory))]
+
+
+def _build_estimator(n_estimators: int):
+    from sklearn.ensemble import RandomForestClassifier
+
+    return RandomForestClassifier(
+        max_features="log2",
+        n_estimators=n_estimators,
+        random_state=42,
+        n_jobs=-1,
+    )
+
+
+def _columns(X: np.ndarray, features: Sequence[str]):
+    import pandas as pd
+
+    # fitting on a DataFrame stores the feature names in the model
+    return pd.DataFrame(X[:, [FEATURES.index(feature) for feature in features]],
+                        columns=features)
+
+
+@click.command()
+@click_extra.option(
+    "--ham",
+    help="A directory of ham emails, can be repeated",
+    type=click.Path(exists=True, file_okay=False, readable=True),
+    multiple=True,
+)
+@click_extra.option(
+    "--spam",
+    help="A directory of spam emails, can be repeated",
+    type=click.Path(exists=True, file_okay=False, readable=True),
+    multiple=True,
+)
+@click_extra.option(
+    "-l",
+    "--wordlist",
+    help="A file containing the spam wordlist",
+    type=click.File("r"),
+    required=True,
+)
+@click_extra.option(
+    "-s",
+    "--store",
+    help="The feature store, emails already in it are not analyzed again",
+    type=click.Path(dir_okay=False),
+    default="features.npz",
+    show_default=True,
+)
+@click_extra.option(
+    "-o",
+    "--output-file",
+    help="Where to write the trained model",
+    type=click.Path(dir_okay=False, writable=True),
+    default="classifier.pkl",
+    show_default=True,
+)
+@click_extra.option(
+    "--header-model",
+    help="Also train a header only model for the cascade classification",
+    type=click.Path(dir_okay=False, writable=True),
+)
+@click_extra.option(
+    "-f",
+    "--features",
+    help="Train on a subset of the features, can be repeated",
+    type=click.Choice(FEATURES),
+    multiple=True,
+)
+@click_extra.option(
+    "-j",
+    "--jobs",
+    help="Number of processes analyzing the emails",
+    type=click.IntRange(min=1),
+    default=os.cpu_count() or 1,
+)
+@click_extra.option(
+    "--n-estimators",
+    help="Number of trees of the random forest",
+    type=click.IntRange(min=1),
+    default=340,
+    show_default=True,
+)
+@click_extra.option(
+    "--test-size",
+    help="Fraction of the emails held out to evaluate the model",
+    type=click.FloatRange(min=0, max=1, max_open=True),
+    default=0.0,
+)
+@click_extra.option(
+    "--dns-cache",
+    help="A SQLite cache of the DNS lookups, see the analyze command",
+    type=click.Path(exists=True, dir_okay=False, readable=True),
+    metavar="FILE",
+)
+@click_extra.option(
+    "--offline",
+    help=("Never use the network: the addresses not in the --dns-cache have an "
+          "unknown domain"),
+    is_flag=True,
+)
+@click_extra.pass_context
+def train(
+    ctx: Context,
+    ham: Tuple[str, ...],
+    spam: Tuple[str, ...],
+    wordlist: TextIOWrapper,
+    store: str,
+    output_file: str,
+    header_model: Optional[str],
+    features: Tuple[str, ...],
+    jobs: int,
+    n_estimators: int,
+    test_size: float,
+    dns_cache: Optional[str],
+    offline: bool,
+) -> None:
+    """Train a new classifier from directories of labelled emails."""
+
+    if not ham or not spam:
+        raise click.UsageError("At least a --ham and a --spam directory are needed")
+
+    verbose = ctx.obj["verbose"]
+    console = Console()
+    wordlist_content: List[str] = wordlist.read().splitlines()
+
+    with console.status("[bold]Reading files...", spinner="dots"):
+        labelled = _labelled_files(ham, 0) + _labelled_files(spam, 1)
+        digests = [content_hash(path) for path, _ in labelled]
+
+    # the stored features are discarded if they were extracted from other inputs
+    fingerprint = extraction_fingerprint(
+        wordlist_content,
+        dns_cache=None if dns_cache is None else os.path.abspath(dns_cache),
+        offline=offline)
+    feature_store = FeatureStore.load(store, fingerprint)
+    missing = [(path, label, digest)
+               for (path, label), digest in zip(labelled, digests)
+               if digest not in feature_store]
+    console.print(f"{len(labelled) - len(missing)} emails found in the store, "
+                  f"{len(missing)} to analyze")
+
+    resolver = None
+    if dns_cache is not None:
+        resolver = ResolverCache.load(dns_cache, offline=offline)
+    elif offline:
+        resolver = ResolverCache(offline=True)
+
+    rows = extract_features([path for path, _, _ in missing], wordlist_content, jobs,
+                            resolver)
+    invalid = 0
+    for (path, label, digest), row in track(zip(missing, rows),
+                                            total=len(missing),
+                                            description="Analyzing emails",
+                                            console=console):
+        if row is None:
+            invalid += 1
+            if verbose:
+                print(f"Invalid file found: {path}")
+            continue
+        feature_store.add(digest, row, label)
+    feature_store.save(store)
+    if invalid:
+        console.print(f"{invalid} invalid emails skipped")
+
+    # labels follow the directories of this run
+    kept = [(label, digest) for (_, label), digest in zip(labelled, digests)
+            if digest in feature_store]
+    X, _ = feature_store.dataset([digest for _, digest in kept])
+    y = np.array([label for label, _ in kept], dtype=np.int8)
+    columns = list(features) if features else list(FEATURES)
+
+    if test_size > 0:
+        from sklearn.metrics import accuracy_score
+        from sklearn.model_selection import train_test_split
+
+        X_train, X_test, y_train, y_test = train_test_split(X,
+                                                            y,
+                                                            test_size=test_size,
+                                                            random_state=42,
+                                                            stratify=y)
+        estimator = _build_estimator(n_estimators)
+        estimator.fit(_columns(X_train, columns), y_train)
+        accuracy = accuracy_score(y_test, estimator.predict(_columns(X_test, columns)))
+        console.print(f"Accuracy on {len(y_test)} held out emails: {accuracy:.4f}")
+
+    estimator = _build_estimator(n_estimators).fit(_columns(X, columns), y)
+    save_model(estimator, output_file, columns)
+    console.print(f"Model written to {output_file}")
+
+    if header_model is not None:
+        header_columns = [column for column in columns if column in HEADER_FEATURES]
+        if not header_columns:
+            raise click.BadParameter("no header feature selected",
+                                     param_hint="--features")
+        estimator = _build_estimator(n_estimators).fit(_columns(X, header_columns), y)
+        save_model(estimator, header_model, header_columns)
+        console.print(f"Header model written to {header_model}")
+
+
+@click.command(name="compile")
+@click_extra.argument(
+    "model",
+    type=click.Path(exists=True, dir_okay=False, readable=True),
+)
+@click_extra.option(
+    "-o",
+    "--output-file",
+    help="Where to write the compiled model [default: MODEL with .npz extension]",
+    type=click.Path(dir_okay=False, writable=True),
+)
+def compile_command(model: str, output_file: Optional[str]) -> None:
+    """Compile a tree based model to numpy arrays.
+
+    The compiled model is loaded without scikit-learn and without unpickling, and it
+    gives the same predictions of the original one.
+    """
+
+    if output_file is None:
+        output_file = os.path.splitext(model)[0] + ".npz"
+
+    classifier = SpamClassifier(model)
+    try:
+        compile_model(classifier.model, output_file, classifier.features)
+    except TypeError as e:
+        raise click.BadParameter(str(e), param_hint="MODEL") from e
+    click.echo(f"Compiled model written to {output_file}")
@@ -0,0 +1,122 @@
+"""Checkpoints of long analyses, see the `--checkpoint` option of `analyze`.
+
+A checkpoint is a journal of the results written so far, one json record per line
+(the items of the json output, see `app.io.to_json_dict`). The results are written
+in the order the emails are discovered, so the journal always holds a prefix of the
+complete output: a resumed run replays it and then analyzes the remaining emails,
+which gives the same output of an uninterrupted run.
+"""
+
+import hashlib
+import json
+import os
+from typing import Iterator, Set
+
+from app.io import ResultWriter
+
+FSYNC_INTERVAL = 1024
+"""The number of records after which the journal is synced to the disk."""
+
+
+def _key(path: str) -> int:
+    # 64 bits digests instead of the paths keep the set of completed emails small
+    return int.from_bytes(
+        hashlib.blake2b(path.encode(), digest_size=8).digest(), "little")
+
+
+class Checkpoint:
+    """An append-only journal of the results of an analysis.
+
+    Args:
+        path (str): the journal file
+        resume (bool): keep the records of a previous run, otherwise the journal
+        must not exist or be empty
+
+    Raises:
+        FileExistsError: if the journal already has records and `resume` is `False`
+
+    A record cut by a crash at the end of the journal is discarded.
+    """
+
+    path: str
+    completed: int
+    """The number of records in the journal."""
+
+    def __init__(self, path: str, resume: bool = False) -> None:
+        self.path = path
+        self.completed = 0
+        self.__keys: Set[int] = set()
+        self.__unsynced = 0
+
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size > 0 and not resume:
+            raise FileExistsError(f"The checkpoint {path} already exists")
+
+        end = 0
+        if size > 0:
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    if not line.endswith(b"\n"):
+                        break
+                    self.__keys.add(_key(record["filename"]))
+                    self.completed += 1
+                    end += len(line)
+
+        self.__file = open(path, "ab")
+        self.__file.truncate(end)
+        self.__end = end
+
+    def __contains__(self, email_path: str) -> bool:
+        return _key(email_path) in self.__keys
+
+    def replay(self) -> Iterator[dict]:
+        """Read the records of the previous runs, in order."""
+        with open(self.path, "rb") as f:
+            read = 0
+            for line in f:
+                read += len(line)
+                if read > self.__end:
+                    break
+                yield json.loads(line)
+
+    def append(self, record: dict) -> None:
+        """Add the record of a completed email to the journal."""
+        line = (json.dumps(record) + "\n").encode()
+        self.__file.write(line)
+        self.__file.flush()
+        self.__keys.add(_key(record["filename"]))
+        self.completed += 1
+
+        self.__unsynced += 1
+        if self.__unsynced >= FSYNC_INTERVAL:
+            self.sync()
+
+    def sync(self) -> None:
+        """Make sure the records are written to the disk."""
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+        self.__unsynced = 0
+
+    def close(self) -> None:
+        self.sync()
+        self.__file.close()
+
+
+class CheckpointWriter(ResultWriter):
+    """A `ResultWriter` that records each result in a `Checkpoint` once it has been
+    written by `writer`, closing it closes the checkpoint but not `writer`."""
+
+    def __init__(self, writer: ResultWriter, checkpoint: Checkpoint) -> None:
+        self.writer = writer
+        self.checkpoint = checkpoint
+
+    def write_record(self, record: dict) -> None:
+        self.writer.write_record(record)
+        self.checkpoint.append(record)
+
+    def close(self) -> None:
+        self.checkpoint.close()
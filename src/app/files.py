@@ -1,12 +1,15 @@
+import hashlib
 import os
 import shutil
 from importlib.resources import files
 from os import listdir, path
-from typing import Dict, Tuple
+from typing import Dict, Iterable, Iterator, Optional, Tuple
 
 import click
 import yaml
 
+from spamanalyzer.ml import content_hash
+
 
 def get_files_from_dir(directory: str, verbose: bool = False) -> list[str]:
     file_list = []
@@ -22,12 +25,72 @@ def get_files_from_dir(directory: str, verbose: bool = False) -> list[str]:
     return file_list
 
 
-def file_is_valid_email(file_path: str) -> bool:
+def file_is_valid_email(file_path: str,
+                        max_bytes: Optional[int] = None,
+                        parser: str = "mailparser") -> bool:
     from spamanalyzer import SpamAnalyzer
 
-    mail = SpamAnalyzer.parse(file_path)
-    return (path.isfile(file_path) and mail.headers.get("Received") is not None
-            and mail.headers.get("From") is not None)
+    mail = SpamAnalyzer.parse(file_path, max_bytes, parser)
+    return path.isfile(file_path) and SpamAnalyzer.is_analyzable(mail)
+
+
+def iter_files_from_dir(directory: str) -> Iterator[str]:
+    """Yield the regular files of a directory, sorted by path as `get_files_from_dir`
+    does, so that the output of an analysis does not depend on the file system.
+
+    Unlike `get_files_from_dir` the files are not validated: only the listing is
+    held in memory, the caller checks each file when it parses it (see
+    `SpamAnalyzer.is_analyzable`).
+    """
+    with os.scandir(directory) as entries:
+        file_paths = sorted(entry.path for entry in entries if entry.is_file())
+    yield from file_paths
+
+
+def iter_sized_files_from_dir(directory: str) -> Iterator[Tuple[str, int]]:
+    """Like `iter_files_from_dir`, but yield the size in bytes of each file too."""
+    with os.scandir(directory) as entries:
+        sized = sorted(
+            (entry.path, entry.stat().st_size) for entry in entries if entry.is_file())
+    yield from sized
+
+
+def shard_of(key: bytes, shards: int) -> int:
+    """Assign a key to one of `shards` shards, the assignment only depends on the
+    key, so that independent runs agree on it.
+
+    Returns:
+        int: the shard of the key, from `1` to `shards`
+
+    """
+    digest = hashlib.blake2b(key, digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards + 1
+
+
+def filter_shard(paths: Iterable[str],
+                 root: str,
+                 shard: int,
+                 shards: int,
+                 by: str = "path") -> Iterator[str]:
+    """Lazily select the files of a shard.
+
+    Args:
+        paths (Iterable[str]): the files
+        root (str): the directory the files are listed from, the shards of `path`
+        are assigned by the path relative to it, that is the same on every machine
+        shard (int): the shard to select, from `1` to `shards`
+        shards (int): the number of shards
+        by (str): assign the files by `path` or by `content`, the SHA-256 of the
+        file (the same email gets the same shard wherever it is stored)
+
+    """
+    for file_path in paths:
+        if by == "content":
+            key = content_hash(file_path)
+        else:
+            key = os.path.relpath(file_path, root).replace(os.sep, "/").encode()
+        if shard_of(key, shards) == shard:
+            yield file_path
 
 
 def copy_config_file(dst: str) -> None:
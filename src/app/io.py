@@ -1,101 +1,281 @@
+import csv
 import json
-from io import TextIOWrapper
-from typing import Optional, Sequence
+import sys
+import textwrap
+from typing import Any, Dict, Iterator, Optional, Sequence, TextIO, Tuple
 
 from rich.box import ROUNDED
-from rich.columns import Columns
 from rich.console import Console, Group
 from rich.panel import Panel
 from rich.table import Table
 from rich.text import Text
 
-from spamanalyzer.data_structures import MailAnalysis
+from spamanalyzer.campaigns import CampaignStats
+from spamanalyzer.data_structures import AnyMailAnalysis, CascadeStats
+from spamanalyzer.parallel import WorkerMemory, WorkerUtilization
+from spamanalyzer.stats import CacheStats
+from spamanalyzer.utils import ATTACHMENT_KEYS, BODY_KEYS, HEADER_KEYS, NETWORK_KEYS
 
 
 def print_output(
-    data: Sequence[MailAnalysis],
+    data: Sequence[AnyMailAnalysis],
     output_format: str,
     verbose: bool,
     results: Sequence[bool],
     output_file=None,
 ) -> None:
-    """Prints the output of the `MailAnalysis` in the specified format (csv, json
-    or default).
+    """Prints the output of the `MailAnalysis` in the specified format (csv, json,
+    ndjson or default).
 
     Args:
         data (list): a list of data to output
-        output_format (str): the type of output (csv | json | default)
+        output_format (str): the type of output (csv | json | ndjson | default)
         verbose (bool): valid only for `default` output_format, it prints a
         description for each element of the list
 
     Often when we work with data we want to output it in a specific format, this
     function handles the output of the data in the specified format,
-    at the moment it supports only json and default stdout which will print a whit the
-    rich library a card for each email analyzed in the default pager of the terminal;
-    outside the pager the output will be a table with the summary of the analysis where
-    are reported the number of spam and ham emails and the mean score of each class.
+    it supports json, ndjson (one json object per line), csv and default stdout which
+    will print a whit the rich library a card for each email analyzed;
+    the output will be a table with the summary of the analysis where
+    are reported the number of spam and ham emails.
 
-    > Return later: future versions of spamanalyzer will support csv output format
+    """
+    with open_writer(output_format, verbose, output_file) as writer:
+        for analysis, is_spam in zip(data, results):
+            writer.write(analysis, is_spam)
+
+
+def open_writer(output_format: Optional[str],
+                verbose: bool,
+                output_file: Optional[TextIO] = None,
+                networks: bool = False) -> "ResultWriter":
+    """Get a writer of the results in the specified format, see `print_output`.
+
+    Args:
+        output_format (str, optional): the type of output (json | ndjson | csv |
+        default)
+        verbose (bool): valid only for the default output, it prints a card for each
+        email
+        output_file (TextIO, optional): where to write the json, ndjson or csv
+        output, by default the standard output
+        networks (bool): the analyses have the `NETWORK_KEYS`, they are csv columns
+
+    Returns:
+        ResultWriter: the writer, to be closed once every result is written
 
     """
     if output_format == "csv":
-        __print_to_csv(data, output_file)
-    elif output_format == "json":
-        __print_to_json(data, results, output_file)
-    else:
-        __print_default(data, results, verbose)
+        return CsvWriter(output_file, networks)
+    if output_format == "ndjson":
+        return NdjsonWriter(output_file)
+    if output_format == "json":
+        return JsonWriter(output_file)
+    return SummaryWriter(verbose)
 
 
-def __print_to_csv(data, output_file):
-    raise NotImplementedError
+class ResultWriter:
+    """Writes the results of the analysis one at a time, as soon as they are
+    available, so that they are never all kept in memory.
 
+    A result is either an analysis with its verdict (`write`) or a record already
+    converted by `to_json_dict` (`write_record`), e.g. read back from a checkpoint.
+    """
 
-def __print_to_json(
-    data: Sequence[MailAnalysis],
-    results: Sequence[bool],
-    output_file: Optional[TextIOWrapper],
-):
-    dict_data = [analysis.to_dict() for analysis in data]
-    for analysis, origin, is_spam in zip(dict_data, data, results):
-        if analysis["headers"]["send_date"] is not None:
-            analysis["headers"]["send_date"] = analysis["headers"]["send_date"].to_dict(
-            )
-        if analysis["headers"]["received_date"] is not None:
-            analysis["headers"]["received_date"] = analysis["headers"][
-                "received_date"].to_dict()
-        analysis["filename"] = origin.file_path
-        analysis["is_spam"] = str(is_spam).lower()
-    if output_file is not None:
-        json.dump(dict_data, output_file, indent=4)
-    else:
-        print(json.dumps(dict_data, indent=4))
-
-
-def __print_default(data: Sequence[MailAnalysis], labels: Sequence[bool],
-                    verbose: bool):
-    classifier_spam = 0
-    classifier_ham = 0
-
-    console = Console()
-    renderables = []
-
-    for analysis, label in zip(data, labels):
-        if label:
-            classifier_spam += 1
+    def write(self, analysis: AnyMailAnalysis, is_spam: bool) -> None:
+        self.write_record(to_json_dict(analysis, is_spam))
+
+    def write_record(self, record: dict) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "ResultWriter":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+def to_json_dict(analysis: AnyMailAnalysis, is_spam: bool) -> dict:
+    """Convert an analysis and its verdict to the items of the json output."""
+    result = analysis.to_dict()
+    headers = result["headers"]
+    for key in ("send_date", "received_date"):
+        if headers.get(key) is not None:
+            headers[key] = headers[key].to_dict()
+    result["filename"] = analysis.file_path
+    result["is_spam"] = str(is_spam).lower()
+    if getattr(analysis, "truncated", False):
+        result["truncated"] = True
+    return result
+
+
+class JsonWriter(ResultWriter):
+    """Writes a json array, one item at a time, the output is the same of
+    `json.dump(items, indent=4)`."""
+
+    def __init__(self, output_file: Optional[TextIO] = None) -> None:
+        self.__file = output_file if output_file is not None else sys.stdout
+        self.__count = 0
+
+    def write_record(self, record: dict) -> None:
+        item = json.dumps(record, indent=4)
+        self.__file.write("[\n" if self.__count == 0 else ",\n")
+        self.__file.write(textwrap.indent(item, "    "))
+        self.__file.flush()
+        self.__count += 1
+
+    def close(self) -> None:
+        self.__file.write("[]" if self.__count == 0 else "\n]")
+        if self.__file is sys.stdout:
+            self.__file.write("\n")
+        self.__file.flush()
+
+
+class NdjsonWriter(ResultWriter):
+    """Writes one json object per line, the format of the checkpoints."""
+
+    def __init__(self, output_file: Optional[TextIO] = None) -> None:
+        self.__file = output_file if output_file is not None else sys.stdout
+
+    def write_record(self, record: dict) -> None:
+        self.__file.write(json.dumps(record) + "\n")
+        self.__file.flush()
+
+    def close(self) -> None:
+        self.__file.flush()
+
+
+CSV_COLUMNS: Tuple[str,
+                   ...] = (("filename", "is_spam") + tuple(f"headers.{key}"
+                                                           for key in HEADER_KEYS) +
+                           tuple(f"body.{key}" for key in BODY_KEYS) +
+                           tuple(f"attachments.{key}"
+                                 for key in ATTACHMENT_KEYS) + ("truncated", ))
+"""The columns of the csv output, the dates are written in ISO 8601 format."""
+
+NETWORK_CSV_COLUMNS: Tuple[str, ...] = tuple(f"headers.{key}" for key in NETWORK_KEYS)
+"""The columns added after the headers ones when the analyses have a networks
+table, see `utils.NETWORK_KEYS`."""
+
+
+def to_csv_row(record: dict) -> Dict[str, Any]:
+    """Flatten a record of the json output (see `to_json_dict`) to a row of the csv
+    output, the checks skipped by the analysis are empty cells."""
+    row: Dict[str, Any] = {
+        "filename": record["filename"],
+        "is_spam": record["is_spam"],
+        "truncated": record.get("truncated", False),
+    }
+    for section in ("headers", "body", "attachments"):
+        for key, value in record[section].items():
+            if isinstance(value, dict):
+                value = value.get("date")
+            row[f"{section}.{key}"] = value
+    return row
+
+
+class CsvWriter(ResultWriter):
+    """Writes a csv table with the `CSV_COLUMNS`, and the `NETWORK_CSV_COLUMNS` if
+    `networks` is set."""
+
+    def __init__(self,
+                 output_file: Optional[TextIO] = None,
+                 networks: bool = False) -> None:
+        self.__file = output_file if output_file is not None else sys.stdout
+        columns = CSV_COLUMNS
+        if networks:
+            split = 2 + len(HEADER_KEYS)
+            columns = columns[:split] + NETWORK_CSV_COLUMNS + columns[split:]
+        self.__writer = csv.DictWriter(self.__file, columns, lineterminator="\n")
+        self.__writer.writeheader()
+
+    def write_record(self, record: dict) -> None:
+        self.write_row(to_csv_row(record))
+
+    def write_row(self, row: Dict[str, Any]) -> None:
+        """Write a row already flattened, e.g. read from another csv output."""
+        self.__writer.writerow(row)
+        self.__file.flush()
+
+    def close(self) -> None:
+        self.__file.flush()
+
+
+def detect_format(path: str) -> str:
+    """Guess the format of an output written by `open_writer` from its first
+    character: `json`, `ndjson` or `csv`."""
+    with open(path, "r", encoding="utf-8") as f:
+        start = f.read(64).lstrip()
+    if start.startswith("["):
+        return "json"
+    if start.startswith("{"):
+        return "ndjson"
+    return "csv"
+
+
+def read_records(path: str, output_format: str) -> Iterator[Dict[str, Any]]:
+    """Read back an output written by `open_writer`.
+
+    Args:
+        path (str): the output file
+        output_format (str): its format, see `detect_format`
+
+    Yields:
+        dict: the records (see `to_json_dict`), for a csv output the rows
+
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if output_format == "json":
+            yield from json.load(f)
+        elif output_format == "ndjson":
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+class SummaryWriter(ResultWriter):
+    """Counts the spam and ham emails and prints the summary table when closed, in
+    verbose mode a card describing each email is printed as it arrives."""
+
+    def __init__(self, verbose: bool = False) -> None:
+        self.verbose = verbose
+        self.ham = 0
+        self.spam = 0
+        self.__console = Console()
+
+    def write(self, analysis: AnyMailAnalysis, is_spam: bool) -> None:
+        self.__count(analysis.to_dict(), is_spam)
+
+    def write_record(self, record: dict) -> None:
+        self.__count(record, record["is_spam"] == "true")
+
+    def __count(self, mail_dict: dict, is_spam: bool) -> None:
+        if is_spam:
+            self.spam += 1
         else:
-            classifier_ham += 1
+            self.ham += 1
+
+        if self.verbose:
+            self.__console.print(_print_details(mail_dict, is_spam))
 
-        if verbose:
-            renderables.append(__print_details(analysis, label))
+    def close(self) -> None:
+        print_summary(self.ham, self.spam)
 
-    if verbose and len(renderables) > 0:
-        with console.pager(styles=True):
-            console.print(Columns(renderables, equal=True))
 
-    __print_summary(classifier_ham, classifier_spam)
+def print_summary(ok_count, spam_count, to_stderr: bool = False) -> None:
+    """Prints a table with the number of ham and spam emails.
 
+    Args:
+        ok_count (int): the number of ham emails
+        spam_count (int): the number of spam emails
+        to_stderr (bool): print on the standard error
 
-def __print_summary(ok_count, spam_count) -> None:
+    """
     table = Table(title="Summary", box=ROUNDED, highlight=True)
 
     table.add_column("Email class", justify="center")
@@ -104,12 +284,134 @@ def __print_summary(ok_count, spam_count) -> None:
     table.add_row("[green][bold]HAM[/bold][/green]", str(ok_count))
     table.add_row("[red][bold]SPAM[/bold][/red]", str(spam_count))
 
-    console = Console()
+    console = Console(stderr=to_stderr)
+    console.print(table)
+
+
+def print_cascade_summary(stats: CascadeStats, to_stderr: bool = False) -> None:
+    """Prints how many emails have been classified by the header model of the
+    cascade and how many needed the complete analysis.
+
+    Args:
+        stats (CascadeStats): the counters collected by the `SpamAnalyzer`
+        to_stderr (bool): print on the standard error, so that a machine readable
+        output on the standard output is not corrupted
+
+    """
+    table = Table(title="Cascade", box=ROUNDED, highlight=True)
+
+    table.add_column("Path", justify="center")
+    table.add_column("Quantity", justify="center")
+
+    table.add_row("Headers only", str(stats.header_only))
+    table.add_row("Full analysis", str(stats.full))
+
+    console = Console(stderr=to_stderr)
+    console.print(table)
+
+
+def print_campaign_summary(stats: CampaignStats, to_stderr: bool = False) -> None:
+    """Prints how many emails reused the body analysis of a similar one and the
+    clusters of similar emails in the campaign index.
+
+    Args:
+        stats (CampaignStats): the statistics of the `CampaignIndex`
+        to_stderr (bool): print on the standard error, so that a machine readable
+        output on the standard output is not corrupted
+
+    """
+    table = Table(title="Campaigns", box=ROUNDED, highlight=True)
+
+    table.add_column("Metric", justify="center")
+    table.add_column("Quantity", justify="center")
+
+    table.add_row("Bodies looked up", str(stats.lookups))
+    table.add_row("Bodies reused", str(stats.reused))
+    table.add_row("Clusters", str(stats.clusters))
+    table.add_row("Campaigns", str(stats.campaigns))
+    table.add_row("Largest campaign", str(stats.largest))
+
+    console = Console(stderr=to_stderr)
+    console.print(table)
+
+
+def print_template_summary(stats: CacheStats, to_stderr: bool = False) -> None:
+    """Prints the hits and misses of the template cache.
+
+    Args:
+        stats (CacheStats): the lookups of the `TemplateCache`
+        to_stderr (bool): print on the standard error, so that a machine readable
+        output on the standard output is not corrupted
+
+    """
+    table = Table(title="Template cache", box=ROUNDED, highlight=True)
+
+    table.add_column("Lookups", justify="center")
+    table.add_column("Quantity", justify="center")
+
+    table.add_row("Hits", str(stats.hits))
+    table.add_row("Misses", str(stats.misses))
+    table.add_row("Hit rate", f"{stats.hit_rate:.1%}")
+
+    console = Console(stderr=to_stderr)
+    console.print(table)
+
+
+def print_memory_report(report: Sequence[WorkerMemory],
+                        to_stderr: bool = False) -> None:
+    """Prints the memory used by the parent process and by each worker process.
+
+    Args:
+        report (list): the memory of each process, the parent process first
+        to_stderr (bool): print on the standard error, so that a machine readable
+        output on the standard output is not corrupted
+
+    """
+    table = Table(title="Memory", box=ROUNDED, highlight=True)
+
+    table.add_column("Process", justify="center")
+    table.add_column("PID", justify="center")
+    table.add_column("RSS (MiB)", justify="right")
+    table.add_column("PSS (MiB)", justify="right")
+
+    for i, memory in enumerate(report):
+        pss = "-" if memory.pss is None else f"{memory.pss / 2**20:.1f}"
+        table.add_row("main" if i == 0 else f"worker {i}", str(memory.pid),
+                      f"{memory.rss / 2**20:.1f}", pss)
+
+    console = Console(stderr=to_stderr)
+    console.print(table)
+
+
+def print_utilization_report(report: Sequence[WorkerUtilization],
+                             to_stderr: bool = False) -> None:
+    """Prints how long each worker process has been busy during the analysis.
+
+    Args:
+        report (list): the utilization of each worker
+        to_stderr (bool): print on the standard error, so that a machine readable
+        output on the standard output is not corrupted
+
+    """
+    table = Table(title="Utilization", box=ROUNDED, highlight=True)
+
+    table.add_column("Process", justify="center")
+    table.add_column("PID", justify="center")
+    table.add_column("Emails", justify="right")
+    table.add_column("Chunks", justify="right")
+    table.add_column("Busy (s)", justify="right")
+    table.add_column("Utilization", justify="right")
+
+    for i, worker in enumerate(report, start=1):
+        table.add_row(f"worker {i}", str(worker.pid), str(worker.mails),
+                      str(worker.chunks), f"{worker.busy:.2f}",
+                      f"{worker.utilization:.0%}")
+
+    console = Console(stderr=to_stderr)
     console.print(table)
 
 
-def __print_details(email: MailAnalysis, result: bool):
-    mail_dict = email.to_dict()
+def _print_details(mail_dict: dict, result: bool):
     score, headers, body, attachments = __stringify_email(mail_dict, result)
 
     panel_group = Group(
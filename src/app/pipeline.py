@@ -0,0 +1,268 @@
+"""The streaming pipeline of the `analyze` command.
+
+The emails flow through a chain of stages connected by bounded queues:
+
+```
+discover -> parse -> [prefetch] -> extract -> classify -> write
+```
+
+- *discover* lists the files lazily;
+- *parse* parses them in a pool of threads and drops the ones that cannot be
+  analyzed;
+- *prefetch*, if the analyzer has a `resolver`, starts the DNS lookups of the
+  batch of emails parsed so far, each address once (see `SpamAnalyzer.prefetch`),
+  and passes the emails on without waiting for them;
+- *extract* runs the checks of `SpamAnalyzer.analyze_parsed`, concurrently, so that
+  the DNS lookups overlap;
+- *classify* classifies the analyses in micro-batches of at most `chunk_size` emails,
+  a batch is closed as soon as no other analysis is ready, so that results are never
+  held back waiting for a full batch;
+- *write* restores the discovery order and hands the results to the writer.
+
+At most `window` emails are in the pipeline at any time, from their discovery to
+their output, so the memory does not depend on the number of emails and results are
+written while the next emails are analyzed.
+"""
+
+import asyncio
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+from app.io import ResultWriter
+from spamanalyzer import MailAnalysis, SpamAnalyzer
+
+T = TypeVar("T")
+
+_DONE: Any = object()
+"""The end of the stream, sent to each worker of a stage."""
+
+
+@dataclass
+class PipelineConfig:
+    """The concurrency of each stage of the pipeline."""
+
+    parse_workers: int = 4
+    """The threads parsing the emails."""
+    extract_workers: int = 32
+    """The analyses running at the same time."""
+    chunk_size: int = 1024
+    """The maximum number of emails classified at once."""
+    window: int = 256
+    """The maximum number of emails in the pipeline, it bounds the memory used."""
+
+    def __post_init__(self):
+        for name in ("parse_workers", "extract_workers", "chunk_size", "window"):
+            if getattr(self, name) <= 0:
+                raise ValueError(f"{name} must be positive")
+
+
+class GracefulInterrupt:
+    """Turn the first SIGINT (Ctrl-C) into a request to stop.
+
+    While the context is active the first SIGINT sets `requested`: `guard` stops
+    yielding new emails, the ones already in the pipeline are completed and written,
+    and the writers can be closed normally. A second SIGINT raises
+    `KeyboardInterrupt` as usual.
+    """
+
+    def __init__(self) -> None:
+        self.requested = threading.Event()
+        self.__previous: Any = None
+
+    def __handle(self, signum, frame) -> None:
+        if self.requested.is_set():
+            raise KeyboardInterrupt
+        self.requested.set()
+
+    def __enter__(self) -> "GracefulInterrupt":
+        self.__previous = signal.signal(signal.SIGINT, self.__handle)
+        return self
+
+    def __exit__(self, *_) -> None:
+        signal.signal(signal.SIGINT, self.__previous)
+
+    def guard(self, items: Iterable[T]) -> Iterator[T]:
+        """Yield the items (paths or chunks of paths) until an interruption is
+        requested."""
+        for item in items:
+            if self.requested.is_set():
+                return
+            yield item
+
+
+async def run_pipeline(
+    paths: Iterable[str],
+    analyzer: SpamAnalyzer,
+    writer: ResultWriter,
+    config: Optional[PipelineConfig] = None,
+    full: bool = False,
+    on_invalid: Optional[Callable[[str], None]] = None,
+) -> int:
+    """Analyze, classify and write a stream of emails.
+
+    Args:
+        paths (Iterable[str]): the paths of the emails, consumed lazily
+        analyzer (SpamAnalyzer): the analyzer
+        writer (ResultWriter): where the results are written, in the order of `paths`
+        config (PipelineConfig, optional): the concurrency of the stages
+        full (bool): perform every check, see `SpamAnalyzer.analyze`
+        on_invalid (Callable[[str], None], optional): called with the path of each
+        email that cannot be analyzed, the email is skipped
+
+    Returns:
+        int: the number of emails written
+
+    """
+    config = config or PipelineConfig()
+    loop = asyncio.get_running_loop()
+    window = asyncio.Semaphore(config.window)
+
+    parse_queue: asyncio.Queue = asyncio.Queue(config.window)
+    prefetch_queue: asyncio.Queue = asyncio.Queue(config.window)
+    extract_queue: asyncio.Queue = asyncio.Queue(config.window)
+    prefetching = analyzer.resolver is not None
+    parsed_queue = prefetch_queue if prefetching else extract_queue
+    classify_queue: asyncio.Queue = asyncio.Queue(config.window)
+    write_queue: asyncio.Queue = asyncio.Queue(config.window)
+
+    async def discover() -> None:
+        for seq, path in enumerate(paths):
+            await window.acquire()
+            await parse_queue.put((seq, path))
+        for _ in range(config.parse_workers):
+            await parse_queue.put(_DONE)
+
+    async def parse(executor: ThreadPoolExecutor) -> None:
+        while (item := await parse_queue.get()) is not _DONE:
+            seq, path = item
+            email = await loop.run_in_executor(executor, SpamAnalyzer.parse, path,
+                                               analyzer.max_bytes, analyzer.parser)
+            if SpamAnalyzer.is_analyzable(email):
+                await parsed_queue.put((seq, path, email))
+            else:
+                if on_invalid is not None:
+                    on_invalid(path)
+                # the writer still needs the sequence number to keep the order
+                await write_queue.put((seq, None, None))
+
+    async def prefetch() -> None:
+        # the analyses join the lookups in flight, meanwhile their other checks run
+        lookups: Set[asyncio.Future] = set()
+        done = False
+        while not done:
+            batch: List[Tuple[int, str, Any]] = []
+            item = await prefetch_queue.get()
+            while item is not _DONE:
+                batch.append(item)
+                if len(batch) >= config.chunk_size or prefetch_queue.empty():
+                    break
+                item = prefetch_queue.get_nowait()
+            done = item is _DONE
+
+            if batch:
+                lookup = asyncio.ensure_future(
+                    analyzer.prefetch((email for _, _, email in batch), full))
+                lookups.add(lookup)
+                lookup.add_done_callback(lookups.discard)
+            for item in batch:
+                await extract_queue.put(item)
+        await asyncio.gather(*lookups)
+
+    async def extract() -> None:
+        while (item := await extract_queue.get()) is not _DONE:
+            seq, path, email = item
+            analysis = await analyzer.analyze_parsed(email, path, full)
+            await classify_queue.put((seq, analysis))
+
+    async def classify() -> None:
+        done = False
+        while not done:
+            batch: List[Tuple[int, MailAnalysis]] = []
+            item = await classify_queue.get()
+            while item is not _DONE:
+                batch.append(item)
+                if len(batch) >= config.chunk_size or classify_queue.empty():
+                    break
+                item = classify_queue.get_nowait()
+            done = item is _DONE
+
+            verdicts = analyzer.classify_multiple_input(
+                [analysis for _, analysis in batch])
+            for (seq, analysis), is_spam in zip(batch, verdicts):
+                await write_queue.put((seq, analysis, is_spam))
+        await write_queue.put(_DONE)
+
+    async def write() -> int:
+        # results arrive out of order, they wait here for the previous ones
+        pending: Dict[int, Tuple[Optional[MailAnalysis], Optional[bool]]] = {}
+        next_seq = written = 0
+        while (item := await write_queue.get()) is not _DONE:
+            seq, analysis, is_spam = item
+            pending[seq] = (analysis, is_spam)
+            while next_seq in pending:
+                analysis, is_spam = pending.pop(next_seq)
+                if analysis is not None:
+                    writer.write(analysis, is_spam)  # type: ignore
+                    written += 1
+                window.release()
+                next_seq += 1
+        return written
+
+    async def stage(workers: List[asyncio.Future], queue: asyncio.Queue,
+                    consumers: int) -> None:
+        # when every worker of a stage is done, the next stage is told to stop
+        await asyncio.gather(*workers)
+        for _ in range(consumers):
+            await queue.put(_DONE)
+
+    with ThreadPoolExecutor(config.parse_workers,
+                            thread_name_prefix="spam-analyzer-parse") as executor:
+        parsers = [
+            asyncio.ensure_future(parse(executor)) for _ in range(config.parse_workers)
+        ]
+        extractors = [
+            asyncio.ensure_future(extract()) for _ in range(config.extract_workers)
+        ]
+        tasks = [
+            asyncio.ensure_future(discover()),
+            asyncio.ensure_future(stage(extractors, classify_queue, 1)),
+            asyncio.ensure_future(classify()),
+            *parsers,
+            *extractors,
+        ]
+        if prefetching:
+            prefetcher = asyncio.ensure_future(prefetch())
+            tasks += [
+                asyncio.ensure_future(stage(parsers, prefetch_queue, 1)),
+                asyncio.ensure_future(
+                    stage([prefetcher], extract_queue, config.extract_workers)),
+                prefetcher,
+            ]
+        else:
+            tasks.append(
+                asyncio.ensure_future(
+                    stage(parsers, extract_queue, config.extract_workers)))
+        writing = asyncio.ensure_future(write())
+        try:
+            # the first error stops the whole pipeline
+            await asyncio.gather(*tasks, writing)
+        finally:
+            for task in tasks + [writing]:
+                task.cancel()
+            await asyncio.gather(*tasks, writing, return_exceptions=True)
+
+    return writing.result()
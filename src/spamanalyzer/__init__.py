@@ -27,9 +27,16 @@ in this way we can also parallelize the analysis of multiple emails.
 from importlib.metadata import PackageNotFoundError
 from importlib.metadata import version as package_version
 
-from spamanalyzer.data_structures import MailAnalysis, SpamAnalyzer
+from spamanalyzer.aio import AsyncSpamAnalyzer
+from spamanalyzer.data_structures import (
+    Cascade,
+    CompactMailAnalysis,
+    MailAnalysis,
+    SpamAnalyzer,
+)
 from spamanalyzer.date import Date
 from spamanalyzer.domain import Domain
+from spamanalyzer.parallel import AnalysisPool
 
 from . import utils
 
@@ -42,4 +49,14 @@ def __get_package_version__():
                 "Make sure you have installed your package using correctly.")
 
 
-__all__ = ["SpamAnalyzer", "MailAnalysis", "Domain", "Date", "utils"]
+__all__ = [
+    "SpamAnalyzer",
+    "AsyncSpamAnalyzer",
+    "MailAnalysis",
+    "CompactMailAnalysis",
+    "Cascade",
+    "AnalysisPool",
+    "Domain",
+    "Date",
+    "utils",
+]
@@ -0,0 +1,243 @@
+"""Analyze mails from an asyncio application without blocking its event loop.
+
+`SpamAnalyzer.analyze` is a coroutine, but only its DNS lookups are asynchronous: the
+parsing of the mail, the regular expressions, the HTML extraction and the sentiment
+analysis run on the event loop and block it. `AsyncSpamAnalyzer` runs those stages
+in a thread pool, so a server can keep serving other requests while a big mail is
+analyzed:
+
+```python
+analyzer = AsyncSpamAnalyzer(wordlist, max_in_flight=16, timeout=10)
+
+analysis = await analyzer.analyze(email_path)
+
+async for analysis in analyzer.analyze_many(email_paths):
+    print(analysis.file_path, analyzer.is_spam(analysis))
+```
+
+"""
+
+import asyncio
+import itertools
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Optional,
+    Set,
+    TypeVar,
+    Union,
+)
+
+from spamanalyzer import utils
+from spamanalyzer.auth import AuthResults
+from spamanalyzer.blocklist import Blocklists
+from spamanalyzer.campaigns import CampaignIndex
+from spamanalyzer.data_structures import Cascade, MailAnalysis, SpamAnalyzer
+from spamanalyzer.errors import AnalysisError
+from spamanalyzer.ml import SpamClassifier
+from spamanalyzer.networks import NetworkTable
+from spamanalyzer.parser import ParsedMail
+from spamanalyzer.resolver import ResolverCache
+from spamanalyzer.templates import TemplateCache
+
+T = TypeVar("T")
+
+
+class AsyncSpamAnalyzer(SpamAnalyzer):
+    """A `SpamAnalyzer` whose CPU bound stages run in an executor.
+
+    Args:
+        wordlist (Iterable[str]): the spam wordlist
+        model (str | SpamClassifier, optional): the model, see `SpamAnalyzer`
+        executor (Executor, optional): the thread pool where the parsing and the
+        checks run, by default the executor of the event loop; process pools are
+        not supported, the stages share the parsed mail and the analyzer, which
+        cannot be pickled (use `AnalysisPool` to analyze mails in processes)
+        max_in_flight (int): the maximum number of mails analyzed at the same time,
+        the other calls of `analyze` wait for their turn
+        timeout (float, optional): the default timeout of an analysis, in seconds,
+        the time spent waiting for a turn is not counted
+        chunk_size (int): see `SpamAnalyzer`
+        cascade (Cascade, optional): see `SpamAnalyzer`
+        campaigns (CampaignIndex, optional): see `SpamAnalyzer`
+        template_cache (TemplateCache, optional): see `SpamAnalyzer`
+        max_bytes (int, optional): see `SpamAnalyzer`
+        parser (str): see `SpamAnalyzer`
+        resolver (ResolverCache, optional): see `SpamAnalyzer`
+        networks (NetworkTable, optional): see `SpamAnalyzer`
+        blocklists (Blocklists, optional): see `SpamAnalyzer`
+
+    `analyze_parsed` runs its checks in the executor as well, but unlike `analyze` the
+    call is neither bounded by `max_in_flight` nor by a timeout.
+
+    Note: a cancelled or timed out analysis stops at the end of its current stage,
+    the stage itself cannot be interrupted and keeps its executor worker until it
+    finishes.
+
+    """
+
+    executor: Optional[Executor]
+    max_in_flight: int
+    timeout: Optional[float]
+
+    def __init__(
+        self,
+        wordlist: Iterable[str],
+        model: Optional[Union[str, SpamClassifier]] = None,
+        executor: Optional[Executor] = None,
+        max_in_flight: int = 32,
+        timeout: Optional[float] = None,
+        chunk_size: int = 1024,
+        cascade: Optional[Cascade] = None,
+        campaigns: Optional[CampaignIndex] = None,
+        template_cache: Optional[TemplateCache] = None,
+        max_bytes: Optional[int] = None,
+        parser: str = "mailparser",
+        resolver: Optional[ResolverCache] = None,
+        networks: Optional[NetworkTable] = None,
+        blocklists: Optional[Blocklists] = None,
+    ):
+        if max_in_flight <= 0:
+            raise ValueError("max_in_flight must be positive")
+        if isinstance(executor, ProcessPoolExecutor):
+            raise ValueError("the executor must run in threads, not in processes")
+        super().__init__(wordlist,
+                         model,
+                         chunk_size=chunk_size,
+                         cascade=cascade,
+                         campaigns=campaigns,
+                         template_cache=template_cache,
+                         max_bytes=max_bytes,
+                         parser=parser,
+                         resolver=resolver,
+                         networks=networks,
+                         blocklists=blocklists)
+        self.executor = executor
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.__semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def __slots(self) -> asyncio.Semaphore:
+        # created lazily, inside the event loop that uses it
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self.__semaphore
+
+    async def _run_stage(self, func: Callable[..., T], *args) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def _inspect_headers(self, email: ParsedMail, keys: Optional[Set[str]],
+                               auth: AuthResults) -> Dict[str, Any]:
+        local_headers = self._run_stage(utils.inspect_local_headers, email,
+                                        self.wordlist, keys, auth, self.networks,
+                                        self.wordlist_pattern)
+        if keys is not None and "domain_matches" not in keys:
+            return await local_headers
+
+        # the DNS lookups run on the event loop, meanwhile the other checks run in
+        # the executor
+        headers, domain_matches = await asyncio.gather(
+            local_headers, utils.from_domain_matches_received(email, self.resolver))
+        headers["domain_matches"] = domain_matches
+        return headers
+
+    async def analyze(self,
+                      email_path: str,
+                      full: bool = False,
+                      timeout: Optional[float] = None) -> MailAnalysis:
+        """Analyze a mail without blocking the event loop.
+
+        Args:
+            email_path (str): the path of the mail
+            full (bool): perform every check, whatever the models use
+            timeout (float, optional): the timeout in seconds, by default
+            `self.timeout`
+
+        Returns:
+            MailAnalysis: the analysis of the mail
+
+        Raises:
+            asyncio.TimeoutError: if the analysis takes longer than the timeout
+
+        """
+        async with self.__slots:
+            return await asyncio.wait_for(
+                self.__analyze(email_path, full),
+                timeout if timeout is not None else self.timeout)
+
+    async def __analyze(self, email_path: str, full: bool) -> MailAnalysis:
+        email = await self._run_stage(SpamAnalyzer.parse, email_path, self.max_bytes,
+                                      self.parser)
+        # the stages of `analyze_parsed` run in the executor, see `_run_stage`
+        return await self.analyze_parsed(email, email_path, full)
+
+    async def __guarded(self, email_path: str, full: bool,
+                        timeout: Optional[float]) -> MailAnalysis:
+        try:
+            return await self.analyze(email_path, full, timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            raise AnalysisError(email_path) from e
+
+    async def analyze_many(
+        self,
+        email_paths: Iterable[str],
+        full: bool = False,
+        timeout: Optional[float] = None,
+        return_exceptions: bool = False,
+    ) -> AsyncIterator[Union[MailAnalysis, AnalysisError]]:
+        """Analyze mails concurrently and yield the analyses as they complete.
+
+        At most `max_in_flight` mails are scheduled at once: `email_paths` is
+        consumed lazily and can be a generator of any length.
+
+        Args:
+            email_paths (Iterable[str]): the paths of the mails
+            full (bool): perform every check, whatever the models use
+            timeout (float, optional): the timeout of each analysis, by default
+            `self.timeout`
+            return_exceptions (bool): yield the failed and timed out analyses as
+            `AnalysisError`s instead of raising the first one
+
+        Yields:
+            MailAnalysis | AnalysisError: the analyses, in completion order; use
+            `file_path` (or `email_path` for an error) to match them with the input
+
+        Raises:
+            AnalysisError: if an analysis fails and `return_exceptions` is `False`,
+            the remaining analyses are cancelled
+
+        """
+        paths = iter(email_paths)
+        pending: Set[asyncio.Future] = set()
+        try:
+            while True:
+                for email_path in itertools.islice(paths,
+                                                   self.max_in_flight - len(pending)):
+                    pending.add(
+                        asyncio.ensure_future(self.__guarded(email_path, full,
+                                                             timeout)))
+                if not pending:
+                    return
+
+                done, pending = await asyncio.wait(pending,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    error = task.exception()
+                    if error is None:
+                        yield task.result()
+                    elif return_exceptions and isinstance(error, AnalysisError):
+                        yield error
+                    else:
+                        raise error
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
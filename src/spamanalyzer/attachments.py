@@ -0,0 +1,223 @@
+"""Inspect the attachments of a mail without decoding their payloads.
+
+An attachment can be tens of megabytes, but whether it is executable is told by its
+MIME headers and by the first bytes of its content (the *magic bytes* of its format).
+`inspect_attachment` reads the content type, the file name and the transfer encoding
+of an attachment parsed by mailparser and decodes only its first `SNIFF_SIZE` bytes:
+
+```python
+for attachment in email.attachments:
+    info = inspect_attachment(attachment)
+    print(info.filename, info.kind, info.is_executable)
+```
+
+mailparser keeps the base64 payloads encoded, so the payloads are never decoded
+in full.
+"""
+
+import base64
+import binascii
+import hashlib
+import os
+import quopri
+from dataclasses import dataclass
+from typing import Any, Mapping, Optional
+
+SNIFF_SIZE = 4096
+"""The number of bytes of a payload decoded to recognize its format."""
+
+HASH_CHUNK = 1 << 20
+"""The number of characters of a payload decoded at once by `payload_sha256`."""
+
+EXECUTABLE_KINDS = frozenset(("pe", "elf", "mach-o", "script"))
+"""The formats of the executables, see `sniff`."""
+
+EXECUTABLE_TYPES = frozenset((
+    "application/x-msdownload",
+    "application/x-msdos-program",
+    "application/x-dosexec",
+    "application/x-executable",
+    "application/x-elf",
+    "application/x-sharedlib",
+    "application/x-mach-binary",
+    "application/vnd.microsoft.portable-executable",
+    "application/x-msi",
+    "application/x-ms-installer",
+    "application/x-sh",
+    "application/x-shellscript",
+    "application/x-bat",
+    "application/java-archive",
+    "application/x-java-archive",
+    "application/javascript",
+    "application/x-javascript",
+    "text/javascript",
+    "application/x-vbscript",
+    "text/vbscript",
+    "application/hta",
+))
+"""The content types of the executables."""
+
+EXECUTABLE_EXTENSIONS = frozenset(
+    (".exe", ".dll", ".scr", ".com", ".pif", ".cpl", ".msi", ".msp", ".bat", ".cmd",
+     ".ps1", ".vbs", ".vbe", ".js", ".jse", ".wsf", ".wsh", ".hta", ".jar", ".sh",
+     ".app", ".lnk", ".reg"))
+"""The file extensions of the executables, most scripts have no magic bytes."""
+
+_MAGIC = (
+    (b"\x7fELF", "elf"),
+    (b"\xfe\xed\xfa\xce", "mach-o"),
+    (b"\xfe\xed\xfa\xcf", "mach-o"),
+    (b"\xce\xfa\xed\xfe", "mach-o"),
+    (b"\xcf\xfa\xed\xfe", "mach-o"),
+    (b"\xca\xfe\xba\xbe", "mach-o"),
+    (b"#!", "script"),
+    (b"%PDF-", "pdf"),
+    (b"PK\x03\x04", "zip"),
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "ole"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF8", "gif"),
+)
+
+
+@dataclass
+class AttachmentInfo:
+    """What is known of an attachment from its headers and its first bytes."""
+
+    filename: Optional[str]
+    content_type: str
+    size: int
+    """The size of the decoded payload, estimated from the encoded one."""
+    kind: Optional[str]
+    """The format recognized by `sniff`, `None` if unknown."""
+    is_executable: bool
+
+
+def sniff(data: bytes) -> Optional[str]:
+    """Recognize the format of a file from its first bytes.
+
+    Args:
+        data (bytes): the beginning of the file, `SNIFF_SIZE` bytes are enough
+
+    Returns:
+        str | None: the format, one of `EXECUTABLE_KINDS` for the executables (a
+        Windows PE, an ELF, a Mach-O binary or a script with a shebang) or `"pdf"`,
+        `"zip"`, `"ole"`, `"jpeg"`, `"png"`, `"gif"`, `None` if unknown
+
+    """
+    if data.startswith(b"MZ"):
+        # the DOS header points to the PE signature, within the first KB in practice,
+        # a text may start with MZ as well
+        offset = int.from_bytes(data[0x3c:0x40], "little")
+        if len(data) >= 0x40 and data[offset:offset + 4] == b"PE\0\0":
+            return "pe"
+        return None
+    for magic, kind in _MAGIC:
+        if data.startswith(magic):
+            return kind
+    return None
+
+
+def payload_prefix(attachment: Mapping[str, Any], size: int = SNIFF_SIZE) -> bytes:
+    """Decode the first bytes of the payload of an attachment.
+
+    Args:
+        attachment (Mapping): an attachment of `MailParser.attachments`
+        size (int): the number of bytes to decode
+
+    Returns:
+        bytes: at most `size` bytes, fewer if the payload is shorter or malformed
+
+    """
+    payload = attachment.get("payload") or ""
+    encoding = attachment.get("content_transfer_encoding", "")
+    if not attachment.get("binary"):
+        # mailparser has already decoded the text attachments
+        return payload[:size].encode("utf-8", errors="replace")
+    if encoding == "base64":
+        return _b64_prefix(payload, size)
+    return quopri.decodestring(payload[:size * 3].encode("latin-1",
+                                                         errors="replace"))[:size]
+
+
+def payload_sha256(attachment: Mapping[str, Any]) -> str:
+    """Compute the SHA-256 hash of the decoded payload of an attachment, a base64
+    payload is decoded `HASH_CHUNK` characters at a time.
+
+    Args:
+        attachment (Mapping): an attachment of `MailParser.attachments`
+
+    Returns:
+        str: the hexadecimal digest, the text attachments decoded by mailparser are
+        hashed in UTF-8
+
+    """
+    payload = attachment.get("payload") or ""
+    digest = hashlib.sha256()
+    if not attachment.get("binary"):
+        digest.update(payload.encode("utf-8", errors="replace"))
+    elif attachment.get("content_transfer_encoding", "") == "base64":
+        rest = ""
+        for start in range(0, len(payload), HASH_CHUNK):
+            compact = rest + "".join(payload[start:start + HASH_CHUNK].split())
+            end = len(compact) - len(compact) % 4
+            try:
+                digest.update(base64.b64decode(compact[:end]))
+            except binascii.Error:
+                break
+            rest = compact[end:]
+    else:
+        digest.update(quopri.decodestring(payload.encode("latin-1", errors="replace")))
+    return digest.hexdigest()
+
+
+def inspect_attachment(attachment: Mapping[str, Any]) -> AttachmentInfo:
+    """Inspect an attachment from its headers and its first `SNIFF_SIZE` bytes.
+
+    An attachment is executable if its content is an executable, or if its content
+    type or its file name say so. An `application/octet-stream` attachment whose
+    format is unknown is deemed executable too.
+
+    Args:
+        attachment (Mapping): an attachment of `MailParser.attachments`
+
+    Returns:
+        AttachmentInfo: the attachment information
+
+    """
+    content_type = (attachment.get("mail_content_type") or "").lower()
+    filename = attachment.get("filename")
+    kind = sniff(payload_prefix(attachment))
+    extension = os.path.splitext(filename or "")[1].lower()
+    is_executable = (kind in EXECUTABLE_KINDS or content_type in EXECUTABLE_TYPES
+                     or extension in EXECUTABLE_EXTENSIONS
+                     or (kind is None and content_type == "application/octet-stream"))
+    return AttachmentInfo(filename, content_type, _decoded_size(attachment), kind,
+                          is_executable)
+
+
+def _b64_prefix(payload: str, size: int) -> bytes:
+    needed = -(-size // 3) * 4
+    end = needed
+    # the line breaks are dropped from a slice that grows until it is long enough
+    while True:
+        compact = "".join(payload[:end].split())
+        if len(compact) >= needed or end >= len(payload):
+            break
+        end *= 2
+    compact = compact[:needed]
+    try:
+        return base64.b64decode(compact[:len(compact) - len(compact) % 4])[:size]
+    except binascii.Error:
+        return b""
+
+
+def _decoded_size(attachment: Mapping[str, Any]) -> int:
+    payload = attachment.get("payload") or ""
+    if not attachment.get("binary"):
+        return len(payload)
+    if attachment.get("content_transfer_encoding") == "base64":
+        whitespace = sum(payload.count(c) for c in "\r\n\t ")
+        length = len(payload) - whitespace
+        return length * 3 // 4 - payload.rstrip()[-2:].count("=")
+    return len(payload)
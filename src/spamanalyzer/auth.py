@@ -0,0 +1,153 @@
+"""Parse the authentication results of a mail.
+
+The receiving servers record the SPF, DKIM, DMARC and ARC checks they performed in
+the `Authentication-Results` headers (RFC 8601), in the `ARC-Authentication-Results`
+headers of the ARC chain (RFC 8617) and in the `Received-SPF` headers (RFC 7208).
+A mail relayed a few times carries one such header per hop, and a header carries the
+results of several methods:
+
+```
+Authentication-Results: mx.example.com;
+    spf=pass smtp.mailfrom=example.org;
+    dkim=pass (2048-bit key) header.d=example.org;
+    dmarc=pass (p=NONE) header.from=example.org
+```
+
+`parse_auth_results` reads all of them at once and indexes the results by method,
+the other headers are skipped by name without being decoded:
+
+```python
+auth = parse_auth_results(email.message)
+auth.passed("dkim")
+[result.authserv_id for result in auth.get("spf")]
+```
+"""
+
+import re
+from dataclasses import dataclass, field
+from email.message import Message
+from typing import Any, Dict, List, Optional, Tuple
+
+METHODS = ("spf", "dkim", "dmarc", "arc")
+"""The authentication methods used by the analysis, the others are parsed as well."""
+
+_RESULT_HEADERS = ("authentication-results", "arc-authentication-results",
+                   "received-spf")
+
+_COMMENT = re.compile(r"\([^()]*\)")
+_RESULT = re.compile(r"([\w.-]+)\s*=\s*([\w-]+)")
+_PROPERTY = re.compile(r"([\w-]+\.[\w.-]+)\s*=\s*(\S+)")
+_INSTANCE = re.compile(r"i\s*=\s*(\d+)$")
+
+
+@dataclass
+class AuthResult:
+    """The result of an authentication method recorded in a header."""
+
+    method: str
+    """The method, e.g. `spf`, `dkim`, `dmarc` or `arc`, in lowercase."""
+    result: str
+    """The result, e.g. `pass`, `fail`, `softfail` or `none`, in lowercase."""
+    header: str
+    """The name of the header, e.g. `Authentication-Results`."""
+    hop: int
+    """The position of the header among the headers of the same name, 0 is the
+    topmost one, i.e. the one added by the last server."""
+    authserv_id: Optional[str] = None
+    """The server that performed the check, if the header names it."""
+    instance: Optional[int] = None
+    """The instance (`i=`) of an `ARC-Authentication-Results` header."""
+    properties: Dict[str, str] = field(default_factory=dict)
+    """The properties of the check, e.g. `{"smtp.mailfrom": "example.org"}`."""
+
+
+@dataclass
+class AuthResults:
+    """The authentication results of a mail, indexed by method."""
+
+    by_method: Dict[str, List[AuthResult]] = field(default_factory=dict)
+    """The results of each method: those of the `Authentication-Results` headers,
+    then those of the `ARC-Authentication-Results` and `Received-SPF` headers, each
+    in the order of the headers."""
+    dkim_signed: bool = False
+    """`True` if the mail has a `DKIM-Signature` header."""
+    warning: bool = False
+    """`True` if the mail has a `X-Authentication-Warning` header."""
+    last_values: Dict[str, str] = field(default_factory=dict)
+    """The raw value of the last instance of each authentication header, by name as
+    written in the mail, as in `MailParser.headers`: the `has_spf`, `has_dkim` and
+    `has_dmarc` features are computed from them (see `utils.spf_pass`), as the
+    shipped model expects, not from the results of every hop."""
+
+    def get(self, method: str) -> List[AuthResult]:
+        """The results of a method, of every hop."""
+        return self.by_method.get(method, [])
+
+    def passed(self, method: str) -> bool:
+        """Check if any hop recorded a `pass` for a method."""
+        return any(result.result == "pass" for result in self.get(method))
+
+    def add(self, result: AuthResult) -> None:
+        self.by_method.setdefault(result.method, []).append(result)
+
+
+def parse_auth_results(headers: Any) -> AuthResults:
+    """Parse the authentication headers of a mail.
+
+    Args:
+        headers (Message | Mapping): the parsed message, whose repeated headers are
+        all parsed, or a dictionary of headers such as `MailParser.headers`
+
+    Returns:
+        AuthResults: the results of every method, of every hop
+
+    """
+    auth = AuthResults()
+    # the values of a message are decoded when fetched, only the needed ones are
+    names = {name.lower() for name in headers.keys()}
+    auth.dkim_signed = "dkim-signature" in names
+    auth.warning = "x-authentication-warning" in names
+    for key in _RESULT_HEADERS:
+        if key not in names:
+            continue
+        for hop, (name, value) in enumerate(_instances(headers, key)):
+            raw = " ".join(str(value).split())
+            auth.last_values[name] = raw
+            text = _COMMENT.sub(" ", _COMMENT.sub(" ", raw))
+            if key == "received-spf":
+                words = text.split(None, 1)
+                if words:
+                    auth.add(AuthResult("spf", words[0].lower(), name, hop))
+            else:
+                _parse_results(text, name, hop, auth)
+    return auth
+
+
+def _instances(headers: Any, key: str) -> List[Tuple[str, Any]]:
+    if isinstance(headers, Message):
+        names = [name for name in headers.keys() if name.lower() == key]
+        return list(zip(names, headers.get_all(key, [])))
+    return [(name, value) for name, value in headers.items() if name.lower() == key]
+
+
+def _parse_results(text: str, name: str, hop: int, auth: AuthResults) -> None:
+    fields = [item.strip() for item in text.split(";")]
+    instance = None
+    if name.lower() == "arc-authentication-results" and fields:
+        match = _INSTANCE.match(fields[0])
+        if match is not None:
+            instance = int(match.group(1))
+            fields = fields[1:]
+    authserv_id = None
+    if fields and "=" not in fields[0]:
+        # the header may omit the server, e.g. `spf=pass; dkim=none`
+        authserv_id = fields[0].split()[0] if fields[0] else None
+        fields = fields[1:]
+    for item in fields:
+        match = _RESULT.match(item)
+        if match is None:
+            continue
+        method, result = match.group(1).lower(), match.group(2).lower()
+        properties = dict(_PROPERTY.findall(item[match.end():]))
+        auth.add(
+            AuthResult(method, result, name, hop, authserv_id, instance, properties))
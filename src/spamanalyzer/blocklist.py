@@ -0,0 +1,205 @@
+"""Check the links and the attachments of a mail against large blocklists.
+
+A blocklist of tens of millions of domains or of attachment hashes is too large to
+be loaded in a `set` by every run: it is built once by `build_blocklist` into a
+[Bloom filter](https://en.wikipedia.org/wiki/Bloom_filter), an array of bits where
+each entry sets the bits chosen by `hashes` hash functions, saved in a file that is
+memory-mapped when it is loaded (see `spamanalyzer.mapped`). Loading takes no time
+whatever the size of the list, and checking an entry reads `hashes` bits:
+
+```python
+build_blocklist(["evil.example", "malware.example"], "domains.bin")
+domains = Blocklist.load("domains.bin")
+"evil.example" in domains  # True
+```
+
+A Bloom filter has no false negatives, but an entry that is not in the list is found
+with a probability of about `error_rate`, 1 in 10000 by default, for about 19 bits
+(2.4 bytes) per entry.
+"""
+
+import hashlib
+import itertools
+import math
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from spamanalyzer import publicsuffix
+from spamanalyzer.mapped import map_arrays, save_arrays
+
+BLOCKLIST_FORMAT_VERSION = 1
+"""The version of the layout of the arrays written by `build_blocklist`."""
+
+DEFAULT_ERROR_RATE = 1e-4
+"""The default probability that an entry not in the list is found."""
+
+_BATCH = 1 << 20
+"""The entries hashed at once by `build_blocklist`."""
+
+
+def normalize(entry: str) -> str:
+    """The form of the entries of a blocklist: without spaces, in lowercase and
+    without the final dot of a domain."""
+    return entry.strip().lower().rstrip(".")
+
+
+def build_blocklist(entries: Iterable[str],
+                    path: str,
+                    error_rate: float = DEFAULT_ERROR_RATE) -> int:
+    """Build the Bloom filter of a blocklist.
+
+    Args:
+        entries (Iterable[str]): the domains or the SHA-256 hashes (hexadecimal) of
+        the list, the blank lines and the comments starting with `#` are skipped
+        path (str): where to write the blocklist, it is overwritten
+        error_rate (float): the probability of a false positive
+
+    Returns:
+        int: the number of entries of the list
+
+    Raises:
+        ValueError: if the error rate is not between 0 and 1
+
+    """
+    if not 0 < error_rate < 1:
+        raise ValueError("error_rate must be between 0 and 1")
+    # 16 bytes per entry: the two hashes of each entry, see `_hash`
+    batches = []
+    normalized = (entry for entry in map(normalize, entries)
+                  if entry and not entry.startswith("#"))
+    while True:
+        batch = list(itertools.islice(normalized, _BATCH))
+        if not batch:
+            break
+        digests = b"".join(_digest(entry) for entry in batch)
+        batches.append(np.frombuffer(digests, dtype="<u8").reshape(-1, 2))
+    pairs = np.concatenate(batches) if batches else np.empty((0, 2), dtype="<u8")
+
+    count = len(pairs)
+    # the optimal number of hashes depends on the error rate only; the positions
+    # combined from two hashes cover the whole filter only if its size is prime, and
+    # two entries have the same positions with a probability of 1 / size**2
+    hashes = max(1, round(-math.log2(error_rate)))
+    minimum = math.ceil(10 / math.sqrt(error_rate))
+    size = _next_prime(max(minimum, math.ceil(count * hashes / math.log(2))))
+
+    bits = np.zeros(-(-size // 8), dtype=np.uint8)
+    modulus = np.uint64(size)
+    for start in range(0, count, _BATCH):
+        # the same positions as `Blocklist.__contains__`
+        positions = pairs[start:start + _BATCH, 0].astype(np.uint64) % modulus
+        step = pairs[start:start + _BATCH, 1].astype(np.uint64) % modulus
+        for i in range(hashes):
+            masks = np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+            np.bitwise_or.at(bits, positions >> np.uint64(3), masks)
+            positions = (positions + step) % modulus
+            step = (step + np.uint64(i)) % modulus
+
+    save_arrays(path, "blocklist", BLOCKLIST_FORMAT_VERSION, {
+        "parameters": np.array([size, hashes, count], dtype=np.uint64),
+        "bits": bits
+    })
+    return count
+
+
+class Blocklist:
+    """A blocklist built by `build_blocklist` and memory-mapped.
+
+    A blocklist can be pickled, e.g. to be sent to the workers of `AnalysisPool`:
+    the file is mapped again by the process that unpickles it.
+
+    """
+
+    path: str
+    """The path of the blocklist."""
+
+    def __init__(self, path: str, arrays: Dict[str, np.ndarray]) -> None:
+        self.path = path
+        self.__size, self.__hashes, self.__count = arrays["parameters"].tolist()
+        # indexing a memoryview is faster than indexing an array
+        self.__bits = memoryview(arrays["bits"])
+
+    @classmethod
+    def load(cls, path: str) -> "Blocklist":
+        """Map a blocklist written by `build_blocklist`.
+
+        Raises:
+            ValueError: if the file is not a blocklist of this version
+
+        """
+        return cls(path, map_arrays(path, "blocklist", BLOCKLIST_FORMAT_VERSION))
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {"path": self.path}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(  # type: ignore
+            state["path"],
+            map_arrays(state["path"], "blocklist", BLOCKLIST_FORMAT_VERSION))
+
+    def __len__(self) -> int:
+        return self.__count
+
+    def __contains__(self, entry: str) -> bool:
+        first, second = _hash(normalize(entry))
+        bits, size = self.__bits, self.__size
+        position, step = first % size, second % size
+        for i in range(self.__hashes):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+            position = (position + step) % size
+            step = (step + i) % size
+        return True
+
+    def blocks_domain(self, host: str) -> bool:
+        """Check if a host or one of its parent domains is in the list, down to its
+        organizational domain (see `spamanalyzer.publicsuffix`): a list with
+        `example.co.uk` blocks `mail.example.co.uk` but not `co.uk`.
+
+        Args:
+            host (str): a host name, e.g. the host of a link
+
+        Returns:
+            bool: `True` if the host is blocked
+
+        """
+        host = normalize(host)
+        organization = publicsuffix.organizational_domain(host) or host
+        while True:
+            if host in self:
+                return True
+            if len(host) <= len(organization) or "." not in host:
+                return False
+            host = host.split(".", 1)[1]
+
+
+@dataclass
+class Blocklists:
+    """The blocklists checked by the analysis, each one is optional."""
+
+    domains: Optional[Blocklist] = None
+    """The domains of the links, see `utils.blocked_links`."""
+    attachments: Optional[Blocklist] = None
+    """The SHA-256 hashes of the attachments, see `utils.blocked_attachments`."""
+
+
+def _next_prime(number: int) -> int:
+    candidate = number | 1
+    while any(candidate % divisor == 0
+              for divisor in range(3,
+                                   math.isqrt(candidate) + 1, 2)):
+        candidate += 2
+    return candidate
+
+
+def _digest(entry: str) -> bytes:
+    return hashlib.blake2b(entry.encode("utf-8"), digest_size=16).digest()
+
+
+def _hash(entry: str) -> Tuple[int, int]:
+    # two independent hashes, the positions are combined from them by enhanced
+    # double hashing (Dillinger and Manolios)
+    digest = _digest(entry)
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
@@ -0,0 +1,327 @@
+"""Recognize the mails of a spam campaign and reuse the analysis of their body.
+
+The mails of a campaign are sent by the thousands with almost the same body, only a
+name, a link or a tracking code change. `CampaignIndex` keeps a MinHash signature of
+the body of every analyzed mail in a locality-sensitive hashing (LSH) index: when a
+new body is similar enough to an indexed one, its body analysis and its verdict are
+reused instead of running the HTML extraction and the sentiment analysis again.
+
+```python
+index = CampaignIndex.load("campaigns.npz", threshold=0.9, fingerprint=fingerprint)
+analyzer = SpamAnalyzer(wordlist, campaigns=index)
+...
+index.save("campaigns.npz")
+print(index.stats())
+```
+
+The similarity of two bodies is the Jaccard similarity of their sets of shingles
+(sequences of `SHINGLE_SIZE` words), estimated from signatures of `NUM_PERM` hashes.
+"""
+
+import os
+import re
+import threading
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from spamanalyzer.utils import BODY_KEYS
+
+NUM_PERM = 128
+"""The number of hash functions of a signature."""
+
+SHINGLE_SIZE = 5
+"""The number of words of a shingle."""
+
+_SEED = 42
+_PRIME = np.uint64(4294967311)  # the first prime greater than 2**32
+_FLOAT_KEYS = frozenset(
+    ("forbidden_words_percentage", "text_polarity", "text_subjectivity"))
+_WORD = re.compile(r"\w+")
+
+_rng = np.random.default_rng(_SEED)
+_A = _rng.integers(1, 1 << 32, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, 1 << 32, NUM_PERM, dtype=np.uint64)
+
+
+def signature(text: str) -> Optional[np.ndarray]:
+    """Compute the MinHash signature of a text.
+
+    Args:
+        text (str): the text, e.g. the body of a mail
+
+    Returns:
+        np.ndarray | None: `NUM_PERM` unsigned integers, `None` if the text has no
+        words
+
+    """
+    words = _WORD.findall(text.lower())
+    if not words:
+        return None
+    shingles = {
+        zlib.crc32(" ".join(words[i:i + SHINGLE_SIZE]).encode())
+        for i in range(max(1,
+                           len(words) - SHINGLE_SIZE + 1))
+    }
+    hashes = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+    # a universal hash per permutation, the products fit in 64 bits
+    permuted = (np.outer(_A, hashes) + _B[:, None]) % _PRIME
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def _bands(threshold: float) -> Tuple[int, int]:
+    # the (bands, rows) whose S-curve steps closest to the threshold
+    candidates = [(NUM_PERM // rows, rows) for rows in range(1, NUM_PERM + 1)
+                  if NUM_PERM % rows == 0]
+    return min(candidates, key=lambda c: abs((1 / c[0])**(1 / c[1]) - threshold))
+
+
+@dataclass
+class CampaignStats:
+    """How many mails were recognized as part of a campaign."""
+
+    lookups: int = 0
+    """The bodies looked up in the index."""
+    reused: int = 0
+    """The bodies whose analysis was reused from a similar one."""
+    clusters: int = 0
+    """The groups of similar bodies in the index, each with its analysis."""
+    campaigns: int = 0
+    """The clusters with at least two mails."""
+    largest: int = 0
+    """The number of mails of the largest cluster."""
+
+
+class CampaignIndex:
+    """A persistent LSH index of the bodies already analyzed.
+
+    Each cluster of similar bodies keeps the analysis of its first body, the verdict
+    of its first classified mail and the number of mails that belong to it; clusters
+    and counts are kept across runs by `save` and `load`. It can be shared by the
+    threads of an analyzer.
+
+    The analyses and the verdicts depend on the wordlist, the parser and the model of
+    the run that computed them: `load` discards an index whose `fingerprint` differs,
+    see `spamanalyzer.ml.extraction_fingerprint`.
+
+    Args:
+        threshold (float): the minimum estimated Jaccard similarity of two bodies of
+        the same cluster, between 0 and 1
+        fingerprint (str): the fingerprint of the inputs of the analyses
+
+    """
+
+    threshold: float
+    fingerprint: str
+
+    def __init__(self, threshold: float = 0.9, fingerprint: str = "") -> None:
+        if not 0 < threshold <= 1:
+            raise ValueError("The threshold must be in (0, 1]")
+        self.threshold = threshold
+        self.fingerprint = fingerprint
+        self.__bands, self.__rows = _bands(threshold)
+        self.__buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(self.__bands)]
+        self.__signatures: List[np.ndarray] = []
+        self.__bodies: List[Dict[str, Any]] = []
+        self.__verdicts: List[Optional[bool]] = []
+        self.__members: List[int] = []
+        # clusters waiting for the verdict of their first mail
+        self.__unclassified: Dict[str, int] = {}
+        self.__lookups = self.__reused = 0
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def load(cls,
+             path: str,
+             threshold: float = 0.9,
+             fingerprint: str = "") -> "CampaignIndex":
+        """Load an index, if the file does not exist, or it was saved with other
+        parameters, other `BODY_KEYS` or another fingerprint, an empty index is
+        returned.
+
+        Args:
+            path (str): the path of the `.npz` file
+            threshold (float): see `CampaignIndex`, it can differ from the one of the
+            run that saved the index
+            fingerprint (str): the fingerprint of the inputs of this run, see
+            `CampaignIndex`
+
+        Returns:
+            CampaignIndex: the loaded index
+
+        """
+        index = cls(threshold, fingerprint)
+        if not os.path.exists(path):
+            return index
+
+        with np.load(path) as data:
+            if data["parameters"].tolist() != [NUM_PERM, SHINGLE_SIZE, _SEED]:
+                return index
+            if data["bodies"].shape[1:] != (len(BODY_KEYS), ):
+                return index
+            saved = str(data["fingerprint"]) if "fingerprint" in data.files else None
+            if saved != fingerprint:
+                return index
+            for row, body, verdict, members in zip(data["signatures"], data["bodies"],
+                                                   data["verdicts"], data["members"]):
+                cluster = index.__add(row, _decode_body(body))
+                index.__verdicts[cluster] = None if verdict < 0 else bool(verdict)
+                index.__members[cluster] = int(members)
+        return index
+
+    def save(self, path: str) -> None:
+        """Write the index to a compressed `.npz` file.
+
+        Args:
+            path (str): the path of the file, it is overwritten
+
+        """
+        with self.__lock:
+            signatures = (np.stack(self.__signatures) if self.__signatures else
+                          np.empty((0, NUM_PERM), dtype=np.uint32))
+            bodies = np.array([_encode_body(body) for body in self.__bodies],
+                              dtype=np.float64).reshape(-1, len(BODY_KEYS))
+            verdicts = np.array([
+                -1 if verdict is None else int(verdict) for verdict in self.__verdicts
+            ],
+                                dtype=np.int8)
+            members = np.array(self.__members, dtype=np.int64)
+
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                parameters=np.array([NUM_PERM, SHINGLE_SIZE, _SEED]),
+                fingerprint=np.array(self.fingerprint),
+                signatures=signatures,
+                bodies=bodies,
+                verdicts=verdicts,
+                members=members,
+            )
+
+    def lookup(
+        self,
+        email_path: str,
+        sig: np.ndarray,
+        keys: Optional[set[str]],
+        overrides: Optional[Dict[str, Any]] = None
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[bool]]:
+        """Find the cluster of a body and count the mail as one of its members.
+
+        Args:
+            email_path (str): the path of the mail
+            sig (np.ndarray): the signature of its body, see `signature`
+            keys (set[str], optional): the keys of the body analysis needed, a
+            cluster whose analysis lacks them is not reused, by default all of them
+            overrides (dict, optional): the values of the body analysis already
+            computed for this mail, they replace those of the cluster; if they differ
+            the verdict of the cluster is not reused, e.g. a member of a campaign
+            that links to a blocked domain
+
+        Returns:
+            tuple: a copy of the body analysis of the cluster and its verdict, if
+            known, or `(None, None)` if the body has to be analyzed
+
+        """
+        with self.__lock:
+            self.__lookups += 1
+            cluster = self.__find(sig)
+            if cluster is None:
+                return None, None
+
+            body = self.__bodies[cluster]
+            wanted = BODY_KEYS if keys is None else keys
+            if any(body[key] is None for key in wanted):
+                return None, None
+
+            self.__members[cluster] += 1
+            self.__reused += 1
+            copy = dict(body)
+            if overrides:
+                copy.update(overrides)
+                if any(body[key] != value for key, value in overrides.items()):
+                    # the verdict of another analysis, this mail is classified alone
+                    return copy, None
+            verdict = self.__verdicts[cluster]
+            if verdict is None:
+                self.__unclassified.setdefault(email_path, cluster)
+            return copy, verdict
+
+    def add(self, email_path: str, sig: np.ndarray, body: Dict[str, Any]) -> None:
+        """Index the analysis of a body that has not been found by `lookup`.
+
+        A cluster of the same body whose analysis lacked some keys is updated.
+        """
+        with self.__lock:
+            cluster = self.__find(sig)
+            if cluster is None:
+                cluster = self.__add(sig, dict(body))
+            else:
+                self.__bodies[cluster] = dict(body)
+            self.__members[cluster] += 1
+            if self.__verdicts[cluster] is None:
+                self.__unclassified[email_path] = cluster
+
+    def set_verdict(self, email_path: str, verdict: bool) -> None:
+        """Record the verdict of a classified mail for its cluster, if it has none
+        yet."""
+        with self.__lock:
+            cluster = self.__unclassified.pop(email_path, None)
+            if cluster is not None and self.__verdicts[cluster] is None:
+                self.__verdicts[cluster] = bool(verdict)
+
+    def stats(self) -> CampaignStats:
+        """Get the statistics of the index and of the lookups of this run."""
+        with self.__lock:
+            return CampaignStats(
+                lookups=self.__lookups,
+                reused=self.__reused,
+                clusters=len(self.__members),
+                campaigns=sum(members >= 2 for members in self.__members),
+                largest=max(self.__members, default=0),
+            )
+
+    def __len__(self) -> int:
+        return len(self.__signatures)
+
+    def __band_keys(self, sig: np.ndarray) -> List[bytes]:
+        rows = self.__rows
+        return [sig[i * rows:(i + 1) * rows].tobytes() for i in range(self.__bands)]
+
+    def __find(self, sig: np.ndarray) -> Optional[int]:
+        best, similarity = None, self.threshold
+        candidates = {
+            cluster
+            for buckets, key in zip(self.__buckets, self.__band_keys(sig))
+            for cluster in buckets.get(key, ())
+        }
+        for cluster in candidates:
+            estimate = float(np.mean(self.__signatures[cluster] == sig))
+            if estimate >= similarity:
+                best, similarity = cluster, estimate
+        return best
+
+    def __add(self, sig: np.ndarray, body: Dict[str, Any]) -> int:
+        cluster = len(self.__signatures)
+        for buckets, key in zip(self.__buckets, self.__band_keys(sig)):
+            buckets.setdefault(key, []).append(cluster)
+        self.__signatures.append(np.asarray(sig, dtype=np.uint32))
+        self.__bodies.append(body)
+        self.__verdicts.append(None)
+        self.__members.append(0)
+        return cluster
+
+
+def _encode_body(body: Dict[str, Any]) -> List[float]:
+    return [np.nan if body.get(key) is None else float(body[key]) for key in BODY_KEYS]
+
+
+def _decode_body(row: np.ndarray) -> Dict[str, Any]:
+    body: Dict[str, Any] = {}
+    for key, value in zip(BODY_KEYS, row.tolist()):
+        if np.isnan(value):
+            body[key] = None
+        else:
+            body[key] = value if key in _FLOAT_KEYS else bool(value)
+    return body
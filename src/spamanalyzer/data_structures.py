@@ -1,37 +1,200 @@
-import io
-import sys
-from dataclasses import dataclass
+import logging
+import math
+import re
+from contextvars import ContextVar
+from dataclasses import dataclass, field
 from functools import wraps
 from importlib import resources
-from typing import Any, Iterable, List, Optional
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
-import mailparser
 import numpy as np
 
 from spamanalyzer import utils
+from spamanalyzer.auth import AuthResults, parse_auth_results
+from spamanalyzer.blocklist import Blocklist, Blocklists
+from spamanalyzer.campaigns import CampaignIndex, signature
 from spamanalyzer.domain import Domain
-from spamanalyzer.ml import SpamClassifier
+from spamanalyzer.large import is_truncated, parse_large
+from spamanalyzer.ml import (
+    FEATURE_DTYPE,
+    FEATURES,
+    HEADER_FEATURES,
+    FeatureMatrix,
+    SpamClassifier,
+)
+from spamanalyzer.networks import NetworkTable
+from spamanalyzer.parser import PARSERS, ParsedMail, parse_file
+from spamanalyzer.resolver import ResolverCache
+from spamanalyzer.templates import TemplateCache
+
+FEATURE_LAYOUT: tuple[tuple[str, str], ...] = (
+    ("headers", "has_spf"),
+    ("headers", "has_dkim"),
+    ("headers", "has_dmarc"),
+    ("headers", "domain_matches"),
+    ("headers", "auth_warn"),
+    ("headers", "has_suspect_subject"),
+    ("headers", "subject_is_uppercase"),
+    ("headers", "send_date_is_RFC2822_compliant"),
+    ("headers", "send_date_tz_is_valid"),
+    ("headers", "has_received_date"),
+    ("body", "is_uppercase"),
+    ("body", "contains_script"),
+    ("body", "has_images"),
+    ("body", "https_only"),
+    ("body", "has_mailto"),
+    ("body", "has_links"),
+    ("body", "forbidden_words_percentage"),
+    ("body", "contains_html"),
+    ("body", "contains_form"),
+    ("body", "text_polarity"),
+    ("body", "text_subjectivity"),
+    ("attachments", "has_attachments"),
+    ("attachments", "attachment_is_executable"),
+)
+"""The position of every `MailAnalysis` field in a feature row, it is aligned with
+`spamanalyzer.ml.FEATURES`: the i-th entry is the `(section, key)` pair of the i-th
+column."""
+
+_ANALYSIS_KEYS = {
+    "send_date_is_RFC2822_compliant": "send_date",
+    "send_date_tz_is_valid": "send_date",
+    "has_received_date": "received_date",
+}
+
+
+def analysis_keys(features: Iterable[str]) -> Dict[str, set[str]]:
+    """Map feature columns to the keys of the analysis they are computed from.
+
+    Args:
+        features (Iterable[str]): columns of `spamanalyzer.ml.FEATURES`
+
+    Returns:
+        dict: the keys of `MailAnalysis.headers`, `MailAnalysis.body` and
+        `MailAnalysis.attachments` needed to compute the features
+
+    """
+    features = set(features)
+    keys: Dict[str, set[str]] = {"headers": set(), "body": set(), "attachments": set()}
+    for feature, (section, key) in zip(FEATURES, FEATURE_LAYOUT):
+        if feature in features:
+            keys[section].add(_ANALYSIS_KEYS.get(key, key))
+    return keys
+
+
+_FLOAT_FEATURES = frozenset(
+    ("forbidden_words_percentage", "text_polarity", "text_subjectivity"))
+
+_silenced: ContextVar[bool] = ContextVar("silenced", default=False)
+
+
+class _SilencedFilter(logging.Filter):
+    """Drop the records emitted while `silent` functions run in the same context."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not _silenced.get()
+
+
+_SILENCED_LOGGERS = ("mailparser", "mailparser.mailparser", "mailparser.utils")
+for _name in _SILENCED_LOGGERS:
+    logging.getLogger(_name).addFilter(_SilencedFilter())
 
 
 def silent(func):
+    """Silence the logs of mailparser while `func` runs.
+
+    Only the records emitted by the calling thread (or asyncio task) are dropped:
+    the flag lives in a `ContextVar`, so concurrent calls from a thread pool do not
+    interfere with each other, nor with the logs and the output of other threads.
+    """
 
     @wraps(func)
     def wrapper(*args, **kwargs):
-        # Redirect stdout to a StringIO object
-        original_stdout = sys.stdout
-        sys.stdout = io.StringIO()
-
+        token = _silenced.set(True)
         try:
-            result = func(*args, **kwargs)
+            return func(*args, **kwargs)
         finally:
-            # Reset stdout to its original value after the function call
-            sys.stdout = original_stdout
-
-        return result
+            _silenced.reset(token)
 
     return wrapper
 
 
+def default_model() -> str:
+    """Get the path of the model shipped with the package, the compiled version
+    (`classifier.npz`) is preferred to the pickled one (`classifier.pkl`) if
+    available."""
+    package = resources.files("spamanalyzer.ml")
+    compiled = package.joinpath("classifier.npz")
+    if compiled.is_file():
+        return str(compiled)
+    return str(package.joinpath("classifier.pkl"))
+
+
+def header_features(headers: Dict[str, Any]) -> List[Any]:
+    """Get the features of the headers analysis, in the order of
+    `spamanalyzer.ml.HEADER_FEATURES`."""
+    send_date = headers["send_date"]
+    return [
+        headers["has_spf"],
+        headers["has_dkim"],
+        headers["has_dmarc"],
+        headers["domain_matches"],
+        headers["auth_warn"],
+        headers["has_suspect_subject"],
+        headers["subject_is_uppercase"],
+        send_date.is_RFC2822_formatted() if send_date is not None else False,
+        send_date.is_tz_valid() if send_date is not None else False,
+        headers["received_date"] is not None,
+    ]
+
+
+@dataclass
+class Cascade:
+    """The configuration of a cascade classification.
+
+    A cheap model, trained on `spamanalyzer.ml.HEADER_FEATURES` only, scores each mail
+    as soon as its headers are analyzed: if the probability of being spam is outside
+    the uncertain band `(lower, upper)` the verdict is taken from the header model and
+    the expensive body and attachments analysis is skipped, otherwise the mail is
+    fully analyzed and classified by the complete model.
+    """
+
+    model: str
+    """The path to the header model."""
+
+    lower: float = 0.1
+    """Mails with a spam probability lower or equal than this are ham."""
+
+    upper: float = 0.9
+    """Mails with a spam probability greater or equal than this are spam."""
+
+    def __post_init__(self):
+        if not 0 <= self.lower <= self.upper <= 1:
+            raise ValueError("The cascade band must satisfy 0 <= lower <= upper <= 1")
+
+
+@dataclass
+class CascadeStats:
+    """How many mails took each path of the cascade."""
+
+    header_only: int = 0
+    """Mails classified by the header model."""
+
+    full: int = 0
+    """Mails that needed the complete analysis."""
+
+
 @dataclass
 class MailAnalysis:
     """A summary of the analysis of a mail."""
@@ -59,6 +222,9 @@ class MailAnalysis:
     | `send_date` | Date | the date when the mail was sent, if the mail has no `Date` header, it is `None` |
     | `received_date` | Date | the date when the mail was received, if the mail hasn't a date
     in `Received` header, it is `None` |
+    | `origin_asn` | int | the autonomous system of the first public address of the `Received` hops |
+    | `origin_network` | str | the name of that autonomous system |
+    | `received_asns` | int | the number of autonomous systems of the `Received` hops |
 
     - `has_spf`, it is `True` if the mail has a SPF header (Sender Policy Framework),
       it is a standard to prevent email spoofing.
@@ -84,6 +250,8 @@ class MailAnalysis:
       if the mail has no `Date` header, it is `None`
     - `received_date`, it is the date when the mail was received in a `Date` object,
       if the mail hasn't a date in `Received` header, it is `None`
+    - `origin_asn`, `origin_network` and `received_asns` are read from the
+      `SpamAnalyzer.networks` table, they are missing without it
     """
 
     # data from body
@@ -105,6 +273,7 @@ class MailAnalysis:
     | `is_uppercase` | bool | flag that indicates if the body is in uppercase more than $60$% of its length |
     | `text_polarity` | float | the polarity of the body, it is a float between -1 and 1 |
     | `text_subjectivity` | float | the subjectivity of the body, it is a float between 0 and 1 |
+    | `has_blocked_links` | bool | flag that indicates if the domain of a link is in the `SpamAnalyzer.blocklists`, `None` without a domain blocklist |
     """
 
     # attachments
@@ -117,8 +286,31 @@ class MailAnalysis:
     | --- | --- | --- |
     | `has_attachments` | bool | flag that indicates if the mail has attachments |
     | `attachment_is_executable` | bool | flag that indicates if the mail has an attachment in executable format |
+    | `has_blocked_attachments` | bool | flag that indicates if the SHA-256 hash of an attachment is in the `SpamAnalyzer.blocklists`, `None` without a hash blocklist or if the mail is truncated |
+    """
+
+    verdict: Optional[bool] = None
+    """
+    The verdict of the header model when the mail has been classified by the cascade
+    (see `Cascade`) without analyzing its body and attachments, in this case `body`
+    and `attachments` are empty. It is also the verdict of a similar mail whose body
+    analysis has been reused (see `spamanalyzer.campaigns.CampaignIndex`). It is
+    `None` for a mail that still has to be classified.
     """
 
+    parts: List[utils.BodyPart] = field(default_factory=list)
+    """The text parts of the body with their size and the time spent analyzing them
+    (see `utils.inspect_parts`), empty if the body has not been analyzed."""
+
+    truncated: bool = False
+    """`True` if the mail was larger than the budget of the large-message mode and
+    only a part of its body has been analyzed, see `spamanalyzer.large`."""
+
+    auth: AuthResults = field(default_factory=AuthResults)
+    """The SPF, DKIM, DMARC and ARC results of every hop (see `spamanalyzer.auth`),
+    `has_spf`, `has_dkim` and `has_dmarc` read the last header of each kind only
+    (see `AuthResults.last_values`)."""
+
     def to_dict(self) -> dict[str, Any]:
         return {
             "headers": self.headers,
@@ -127,19 +319,7 @@ class MailAnalysis:
         }
 
     def to_list(self) -> List[Any]:
-        return [
-            self.headers["has_spf"],
-            self.headers["has_dkim"],
-            self.headers["has_dmarc"],
-            self.headers["domain_matches"],
-            self.headers["auth_warn"],
-            self.headers["has_suspect_subject"],
-            self.headers["subject_is_uppercase"],
-            self.headers["send_date"].is_RFC2822_formatted()
-            if self.headers["send_date"] is not None else False,
-            self.headers["send_date"].is_tz_valid()
-            if self.headers["send_date"] is not None else False,
-            self.headers["received_date"] is not None,
+        return header_features(self.headers) + [
             self.body["is_uppercase"],
             self.body["contains_script"],
             self.body["has_images"],
@@ -155,6 +335,129 @@ class MailAnalysis:
             self.attachments["attachment_is_executable"],
         ]
 
+    def to_array(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Write the features of the analysis in a numpy row.
+
+        Args:
+            out (np.ndarray, optional): a preallocated row of `len(FEATURES)` elements
+            where the features are written in place, if it is `None` a new row is
+            allocated
+
+        Returns:
+            np.ndarray: the row containing the features, in the same order of
+            `to_list`
+
+        Raises:
+            ValueError: if the body of the mail has not been analyzed (see `verdict`)
+
+        """
+        if self.verdict is not None and not self.body:
+            raise ValueError(
+                f"{self.file_path} has been classified by its headers only")
+        if out is None:
+            out = np.empty(len(FEATURES), dtype=FEATURE_DTYPE)
+        out[:] = self.to_list()
+        return out
+
+    def compact(self, out: Optional[np.ndarray] = None) -> "CompactMailAnalysis":
+        """Get a memory efficient copy of the analysis, see `CompactMailAnalysis`."""
+        return CompactMailAnalysis(self.file_path, self.to_array(out))
+
+
+class CompactMailAnalysis:
+    """A memory efficient representation of a `MailAnalysis`.
+
+    A `MailAnalysis` holds three dictionaries and two `Date` objects per mail, which
+    is convenient while inspecting a single mail but expensive when we keep millions
+    of analyses in memory. A `CompactMailAnalysis` stores only the file path and a
+    fixed dtype numpy row aligned with `spamanalyzer.ml.FEATURES`, the `headers`,
+    `body` and `attachments` dictionaries are built lazily from that row on access.
+
+    The row can be a view on a larger matrix (see the `out` argument of
+    `MailAnalysis.compact`), in this way a batch of compact analyses can be
+    classified without copying its features.
+
+    The checks skipped by the analysis (see `SpamAnalyzer.required_keys`) are stored
+    as NaN and read back as `None`, as in the `MailAnalysis`.
+
+    !!! note
+        `Date` objects are not retained: the `headers` view reports the same date
+        flags the classifier uses (`send_date_is_RFC2822_compliant`,
+        `send_date_tz_is_valid` and `has_received_date`) in place of `send_date` and
+        `received_date`.
+
+    """
+
+    __slots__ = ("file_path", "features")
+
+    file_path: str
+    features: np.ndarray
+
+    def __init__(self, file_path: str, features: np.ndarray) -> None:
+        if features.shape != (len(FEATURES), ):
+            raise ValueError(f"Expected {len(FEATURES)} features, "
+                             f"got an array of shape {features.shape}")
+        self.file_path = file_path
+        self.features = features
+
+    def __section(self, name: str) -> Dict[str, Union[bool, float, None]]:
+        return {
+            key: _feature_value(key, value)
+            for (section, key), value in zip(FEATURE_LAYOUT, self.features.tolist())
+            if section == name
+        }
+
+    @property
+    def headers(self) -> Dict[str, Union[bool, float, None]]:
+        return self.__section("headers")
+
+    @property
+    def body(self) -> Dict[str, Union[bool, float, None]]:
+        return self.__section("body")
+
+    @property
+    def attachments(self) -> Dict[str, Union[bool, float, None]]:
+        return self.__section("attachments")
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "headers": self.headers,
+            "body": self.body,
+            "attachments": self.attachments,
+        }
+
+    def to_list(self) -> List[Any]:
+        return [
+            _feature_value(key, value)
+            for (_, key), value in zip(FEATURE_LAYOUT, self.features.tolist())
+        ]
+
+    def to_array(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        if out is None:
+            return self.features
+        out[:] = self.features
+        return out
+
+    def compact(self, out: Optional[np.ndarray] = None) -> "CompactMailAnalysis":
+        if out is None:
+            return self
+        return CompactMailAnalysis(self.file_path, self.to_array(out))
+
+    def __repr__(self) -> str:
+        return f"<CompactMailAnalysis(file_path={self.file_path!r})>"
+
+
+AnyMailAnalysis = Union[MailAnalysis, CompactMailAnalysis]
+
+T = TypeVar("T")
+
+
+def _feature_value(key: str, value: float) -> Union[bool, float, None]:
+    # the checks skipped by the analysis are stored as NaN, see `MailAnalysis.to_array`
+    if math.isnan(value):
+        return None
+    return value if key in _FLOAT_FEATURES else bool(value)
+
 
 class SpamAnalyzer:
     """Analyze a mail and return a `MailAnalysis` object, essentially it is a
@@ -168,59 +471,378 @@ class SpamAnalyzer:
       it returns a `Domain` object
 
     The core of the analysis is the `analyze` method, it uses the `MailParser` class
-    (from `mailparser` library) to parse the mail.
+    (from `mailparser` library) to parse the mail, or the lighter `StdlibMail` (see
+    `spamanalyzer.parser`).
     The analysis is based on separated checks for the headers, body and attachments and
     each check is implemented in a separated function: this make the analysis modular
     and easy to extend in future versions.
 
     """
 
-    __model: str
+    __model: Optional[str]
     __wordlist: Iterable[str]
-
-    def __init__(self, wordlist: Iterable[str], model: Optional[str] = None):
+    __classifier: Optional[SpamClassifier]
+    __header_classifier: Optional[SpamClassifier]
+    __required_keys: Optional[Dict[str, set[str]]]
+
+    chunk_size: int
+    """The number of mails classified at once by `classify_multiple_input`."""
+
+    cascade: Optional[Cascade]
+    """The cascade configuration, if `None` every mail is fully analyzed."""
+
+    cascade_stats: CascadeStats
+    """How many of the analyzed mails took each path of the cascade."""
+
+    campaigns: Optional[CampaignIndex]
+    """The index of the bodies already analyzed, if `None` every body is analyzed."""
+
+    template_cache: Optional[TemplateCache]
+    """The cache of the text checks of the bodies, see `TemplateCache`."""
+
+    max_bytes: Optional[int]
+    """The budget of the large-message mode, see `parse`, if `None` the mails are
+    parsed whole."""
+
+    parser: str
+    """The parser backend, see `parse`."""
+
+    resolver: Optional[ResolverCache]
+    """The cache of the DNS lookups, see `prefetch`, if `None` every mail resolves
+    its addresses."""
+
+    networks: Optional[NetworkTable]
+    """The table of the IP ranges of the `Received` hops, see
+    `utils.received_networks`, if `None` the network keys of the headers are
+    `None`."""
+
+    blocklists: Blocklists
+    """The blocklists of the link domains and of the attachment hashes, see
+    `spamanalyzer.blocklist`, the keys of a missing list are `None`."""
+
+    def __init__(
+        self,
+        wordlist: Iterable[str],
+        model: Optional[Union[str, SpamClassifier]] = None,
+        chunk_size: int = 1024,
+        cascade: Optional[Cascade] = None,
+        campaigns: Optional[CampaignIndex] = None,
+        template_cache: Optional[TemplateCache] = None,
+        max_bytes: Optional[int] = None,
+        parser: str = "mailparser",
+        resolver: Optional[ResolverCache] = None,
+        networks: Optional[NetworkTable] = None,
+        blocklists: Optional[Blocklists] = None,
+    ):
+        if parser not in PARSERS:
+            raise ValueError(f"Unknown parser {parser}, expected one of {PARSERS}")
         self.__wordlist = wordlist
+        self.__wordlist_pattern = utils.wordlist_pattern(wordlist)
 
         if model is None:
-            model = str(resources.files("spamanalyzer.ml").joinpath("classifier.pkl"))
-
-        self.__model = model  # type: ignore
+            model = default_model()
+
+        self.__model = None
+        self.__classifier = None
+        if isinstance(model, SpamClassifier):
+            self.__classifier = model
+        else:
+            self.__model = model
+        self.__header_classifier = None
+        self.__required_keys = None
+        self.chunk_size = chunk_size
+        self.cascade = cascade
+        self.cascade_stats = CascadeStats()
+        self.campaigns = campaigns
+        self.template_cache = template_cache
+        self.max_bytes = max_bytes
+        self.parser = parser
+        self.resolver = resolver
+        self.networks = networks
+        self.blocklists = Blocklists() if blocklists is None else blocklists
+
+    @property
+    def wordlist(self) -> Iterable[str]:
+        """The spam wordlist searched in the subject and in the body."""
+        return self.__wordlist
+
+    @property
+    def wordlist_pattern(self) -> "re.Pattern[str]":
+        """The wordlist compiled once by `utils.wordlist_pattern`, it is searched in
+        the subject."""
+        return self.__wordlist_pattern
+
+    @property
+    def classifier(self) -> SpamClassifier:
+        """The classifier, it is loaded on first use and then reused."""
+        if self.__classifier is None:
+            self.__classifier = SpamClassifier(self.__model)  # type: ignore
+        return self.__classifier
+
+    @property
+    def header_classifier(self) -> Optional[SpamClassifier]:
+        """The header model of the cascade, `None` if the cascade is disabled."""
+        if self.cascade is None:
+            return None
+        if self.__header_classifier is None:
+            self.__header_classifier = SpamClassifier(self.cascade.model,
+                                                      default_features=HEADER_FEATURES)
+        return self.__header_classifier
+
+    @property
+    def required_keys(self) -> Dict[str, set[str]]:
+        """The keys of the `headers`, `body` and `attachments` analyses needed by
+        the models, and the network and blocklist keys if there are `networks` and
+        `blocklists`, the others are skipped by `analyze` unless a full analysis is
+        requested."""
+        if self.__required_keys is None:
+            features = set(self.classifier.features)
+            if self.header_classifier is not None:
+                features.update(self.header_classifier.features)
+            self.__required_keys = analysis_keys(features)
+            if self.networks is not None:
+                self.__required_keys["headers"].update(utils.NETWORK_KEYS)
+            if self.blocklists.domains is not None:
+                self.__required_keys["body"].add("has_blocked_links")
+            if self.blocklists.attachments is not None:
+                self.__required_keys["attachments"].add("has_blocked_attachments")
+        return self.__required_keys
 
     @staticmethod
     @silent
-    def parse(email_path: str) -> mailparser.MailParser:
-        return mailparser.parse_from_file(email_path)
+    def parse(email_path: str,
+              max_bytes: Optional[int] = None,
+              parser: str = "mailparser") -> ParsedMail:
+        """Parse a mail file.
+
+        Args:
+            email_path (str): the path of the mail
+            max_bytes (int, optional): the budget of the large-message mode: a larger
+            mail is reduced to its headers, the beginning and the end of its text
+            parts and the first bytes of its attachments before it is parsed, see
+            `spamanalyzer.large.parse_large`
+            parser (str): the parser backend, `mailparser` or the lighter `stdlib`,
+            see `spamanalyzer.parser`
+
+        Returns:
+            MailParser | StdlibMail: the parsed mail
+
+        """
+        if max_bytes is None:
+            return parse_file(email_path, parser)
+        return parse_large(email_path, max_bytes, parser)
 
-    async def analyze(self, email_path: str) -> MailAnalysis:
-        email = SpamAnalyzer.parse(email_path)
+    @staticmethod
+    def is_analyzable(email: ParsedMail) -> bool:
+        """Check that a parsed mail has the `Received` and `From` headers needed by
+        the analysis."""
+        return (email.headers.get("Received") is not None
+                and email.headers.get("From") is not None)
+
+    async def analyze(self, email_path: str, full: bool = False) -> MailAnalysis:
+        """Analyze a mail.
+
+        Only the checks needed by the models are performed (see `required_keys`),
+        the skipped values are `None`.
+
+        Args:
+            email_path (str): the path of the mail
+            full (bool): perform every check, whatever the models use
+
+        Returns:
+            MailAnalysis: the analysis of the mail
+
+        """
+        return await self.analyze_parsed(
+            SpamAnalyzer.parse(email_path, self.max_bytes, self.parser), email_path,
+            full)
 
-        headers = await utils.inspect_headers(email, self.__wordlist)
-        body = utils.inspect_body(email.body, self.__wordlist,
-                                  (await self.get_domain(email_path)))
-        attachments = utils.inspect_attachments(email.attachments)
+    async def analyze_parsed(self,
+                             email: ParsedMail,
+                             email_path: str,
+                             full: bool = False) -> MailAnalysis:
+        """Analyze a mail already parsed with `parse`, see `analyze`.
+
+        Args:
+            email (MailParser | StdlibMail): the parsed mail
+            email_path (str): the path of the mail, it is stored in the analysis
+            full (bool): perform every check, whatever the models use
+
+        Returns:
+            MailAnalysis: the analysis of the mail
+
+        """
+        keys = None if full else self.required_keys
+        auth = parse_auth_results(email.message)
+
+        headers = await self._inspect_headers(email,
+                                              None if keys is None else keys["headers"],
+                                              auth)
+
+        verdict = self.header_verdict(headers)
+        if verdict is not None:
+            return MailAnalysis(file_path=email_path,
+                                headers=headers,
+                                body={},
+                                attachments={},
+                                verdict=verdict,
+                                truncated=is_truncated(email),
+                                auth=auth)
+
+        body, verdict, parts = await self._run_stage(
+            self.analyze_body, email, email_path,
+            None if keys is None else keys["body"])
+        if keys is None or keys["attachments"]:
+            blocklist = self.attachment_blocklist(email)
+            if blocklist is None:
+                attachments = utils.inspect_attachments(email.attachments)
+            else:
+                # hashing the attachments reads them whole
+                attachments = await self._run_stage(utils.inspect_attachments,
+                                                    email.attachments, blocklist)
+        else:
+            attachments = dict.fromkeys(utils.ATTACHMENT_KEYS)
 
         return MailAnalysis(file_path=email_path,
                             headers=headers,
                             body=body,
-                            attachments=attachments)
+                            attachments=attachments,
+                            verdict=verdict,
+                            parts=parts,
+                            truncated=is_truncated(email),
+                            auth=auth)
+
+    async def _run_stage(self, func: Callable[..., T], *args) -> T:
+        """Run a CPU bound stage of `analyze_parsed`, here in the calling thread;
+        `AsyncSpamAnalyzer` runs it in its executor."""
+        return func(*args)
+
+    async def _inspect_headers(self, email: ParsedMail, keys: Optional[set[str]],
+                               auth: AuthResults) -> Dict[str, Any]:
+        """The headers stage of `analyze_parsed`, see `utils.inspect_headers`."""
+        return await utils.inspect_headers(email, self.__wordlist, keys, auth,
+                                           self.resolver, self.networks,
+                                           self.__wordlist_pattern)
+
+    def analyze_body(
+        self,
+        email: ParsedMail,
+        email_path: str,
+        keys: Optional[set[str]] = None
+    ) -> Tuple[Dict[str, Any], Optional[bool], List[utils.BodyPart]]:
+        """Analyze the body of a parsed mail part by part (see `utils.inspect_parts`),
+        reusing the analysis of a similar body if the `campaigns` index has one; the
+        links of a reused body are still checked against the domain blocklist.
+
+        Args:
+            email (MailParser | StdlibMail): the parsed mail
+            email_path (str): the path of the mail
+            keys (set[str], optional): the keys of the body analysis to compute, see
+            `utils.inspect_body`
+
+        Returns:
+            tuple: the body analysis, the verdict of the similar mail (`None` if the
+            body has been analyzed or the similar mail is not classified yet) and the
+            parts analyzed, none if the analysis has been reused
+
+        """
+        sig = None
+        if self.campaigns is not None:
+            sig = signature(email.body)
+        if sig is not None:
+            # the links are checked for every mail, the members of a campaign differ
+            # in their links, and they are not checked without a blocklist
+            wanted = set(utils.BODY_KEYS if keys is None else keys)
+            wanted.discard("has_blocked_links")
+            blocked = None
+            if self.blocklists.domains is not None:
+                links = utils.get_links_from_str(email.body)
+                blocked = utils.blocked_links(links, self.blocklists.domains) != []
+            overrides = None if blocked is None else {"has_blocked_links": blocked}
+            body, verdict = self.campaigns.lookup(  # type: ignore
+                email_path, sig, wanted, overrides)
+            if body is not None:
+                body["has_blocked_links"] = blocked
+                return body, verdict, []
+
+        body, parts = utils.inspect_parts(email, self.__wordlist, keys,
+                                          self.template_cache, self.blocklists.domains)
+        if sig is not None:
+            self.campaigns.add(email_path, sig, body)  # type: ignore
+        return body, None, parts
+
+    def attachment_blocklist(self, email: ParsedMail) -> Optional[Blocklist]:
+        """The blocklist of the attachment hashes to check for a parsed mail, `None`
+        if the mail is truncated (see `parse`): the hash of a cut attachment is never
+        in the list, `has_blocked_attachments` is unknown."""
+        if is_truncated(email):
+            return None
+        return self.blocklists.attachments
+
+    def header_verdict(self, headers: Dict[str, Any]) -> Optional[bool]:
+        """Classify a mail from its headers analysis with the cascade header model.
+
+        Args:
+            headers (dict): the headers analysis, see `MailAnalysis.headers`
+
+        Returns:
+            bool | None: the verdict if the header model is confident, `None` if the
+            mail needs the complete analysis or the cascade is disabled
+
+        """
+        if self.cascade is None or self.header_classifier is None:
+            return None
+
+        row = np.array([header_features(headers)], dtype=FEATURE_DTYPE)
+        score = self.header_classifier.predict_proba(row, HEADER_FEATURES)[0]
+        if self.cascade.lower < score < self.cascade.upper:
+            self.cascade_stats.full += 1
+            return None
+
+        self.cascade_stats.header_only += 1
+        return bool(score >= self.cascade.upper)
 
     async def get_domain(self, email_path: str) -> Domain:
-        email = SpamAnalyzer.parse(email_path)
+        email = SpamAnalyzer.parse(email_path, self.max_bytes, self.parser)
         received = email.headers.get("Received")
-        return await utils.get_domain("unknown" if received is None else received)
+        return await utils.get_domain("unknown" if received is None else received,
+                                      self.resolver)
+
+    async def prefetch(self, emails: Iterable[ParsedMail], full: bool = False) -> int:
+        """Resolve concurrently the addresses of a batch of mails in the `resolver`,
+        before they are analyzed; each address is resolved once.
+
+        Args:
+            emails (Iterable[MailParser | StdlibMail]): the parsed mails
+            full (bool): the mails will be fully analyzed, see `analyze`
 
-    def is_spam(self, email: MailAnalysis) -> bool:
+        Returns:
+            int: the number of addresses resolved, none without a `resolver` or if
+            the models do not use `domain_matches`
+
+        """
+        if self.resolver is None:
+            return 0
+        if not full and "domain_matches" not in self.required_keys["headers"]:
+            return 0
+        return await self.resolver.prefetch(ip_addr for email in emails
+                                            for ip_addr in utils.reverse_lookups(email))
+
+    def is_spam(self, email: AnyMailAnalysis) -> bool:
         """Determine if the email is spam based on the analysis of the mail."""
 
-        model = SpamClassifier(self.__model)
-        array = np.array(email.to_list())
-        return True if model.predict(array.reshape(1, -1)) == 1 else False
+        verdict = getattr(email, "verdict", None)
+        if verdict is not None:
+            return verdict
+        array = email.to_array()
+        return True if self.classifier.predict(array.reshape(1, -1)) == 1 else False
 
-    def classify_multiple_input(self, mails: Iterable[MailAnalysis]) -> List[bool]:
+    def classify_multiple_input(self, mails: Iterable[AnyMailAnalysis]) -> List[bool]:
         """Classify a list of mails.
 
         Args:
-            mails (list[MailAnalysis]): a list of mails to be classified
+            mails (list[MailAnalysis | CompactMailAnalysis]): a list of mails to be
+            classified
 
         Returns:
             list: a list of boolean values, `True` if the mail is spam, `False`
@@ -228,12 +850,89 @@ class SpamAnalyzer:
 
         """
 
-        model = SpamClassifier(self.__model)
+        return list(self.iter_classify(mails))
+
+    def iter_classify(self,
+                      mails: Iterable[AnyMailAnalysis],
+                      chunk_size: Optional[int] = None) -> Iterator[bool]:
+        """Classify mails as they arrive, in chunks of `chunk_size` mails.
+
+        The features are written in place in a single preallocated `FeatureMatrix`
+        that is reused for every chunk, so the memory needed does not grow with the
+        number of mails.
+
+        Args:
+            mails (Iterable[MailAnalysis | CompactMailAnalysis]): the mails to be
+            classified, it can be a lazy iterable
+            chunk_size (int, optional): the number of mails classified at once,
+            defaults to `self.chunk_size`
+
+        Yields:
+            bool: `True` if the mail is spam, `False` otherwise, in the same order of
+            the input
+
+        Note: mails already classified by the cascade header model keep their
+        `verdict` and do not take a row of the matrix.
+
+        """
+
+        matrix = FeatureMatrix(chunk_size or self.chunk_size)
+        # verdicts waiting for the classification of the matrix, `None` is a
+        # placeholder for a row of the matrix
+        pending: List[Optional[bool]] = []
+        paths: List[str] = []
+
+        for mail in mails:
+            verdict = getattr(mail, "verdict", None)
+            if verdict is not None and len(matrix) == 0:
+                yield verdict
+                continue
+
+            pending.append(verdict)
+            if verdict is None:
+                matrix.append(mail)
+                paths.append(mail.file_path)
+                if matrix.full:
+                    yield from _merge(pending, self.__classify_rows(matrix, paths))
+                    pending.clear()
+                    paths.clear()
+                    matrix.clear()
+
+        if len(pending) > 0:
+            yield from _merge(pending, self.__classify_rows(matrix, paths))
+
+    def __classify_rows(self, matrix: FeatureMatrix, paths: List[str]) -> List[bool]:
+        verdicts = self.classify_features(matrix.features)
+        if self.campaigns is not None:
+            # the first classified mail of a cluster gives the verdict to the others
+            for path, verdict in zip(paths, verdicts):
+                self.campaigns.set_verdict(path, verdict)
+        return verdicts
+
+    def classify_features(self, features: np.ndarray) -> List[bool]:
+        """Classify a matrix of features, one row per mail.
+
+        Args:
+            features (np.ndarray): a `(n, len(FEATURES))` matrix, e.g. the rows shared
+            by a batch of `CompactMailAnalysis`, it is passed to the model as is
+
+        Returns:
+            list: a list of boolean values, `True` if the mail is spam, `False`
+            otherwise
 
-        # rearrange input
-        adapted_mails = [np.array(mail.to_list()) for mail in mails]
-        predictions = model.predict(adapted_mails)
+        """
+
+        if len(features) == 0:
+            return []
+        predictions = self.classifier.predict(features)
         return [prediction == 1 for prediction in predictions]
 
     def __repr__(self):
         return f"<MailAnalyzer(wordlist={self.__wordlist})>"
+
+
+def _merge(pending: Iterable[Optional[bool]],
+           predictions: Iterable[bool]) -> Iterator[bool]:
+    predictions = iter(predictions)
+    for verdict in pending:
+        yield next(predictions) if verdict is None else verdict
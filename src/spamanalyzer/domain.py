@@ -2,11 +2,20 @@ import asyncio
 import socket
 from dataclasses import dataclass
 from enum import Enum
+from functools import lru_cache
+from typing import Optional
 
 import dns.name
 import dns.resolver
 from typing_extensions import Self
 
+from spamanalyzer import publicsuffix
+from spamanalyzer.networks import Network, NetworkTable
+from spamanalyzer.resolver import ResolverCache
+
+INTERNED_DOMAINS = 65536
+"""The number of domains kept by `Domain.intern`."""
+
 
 class DomainRelation(Enum):
     """An enum representing the relation between two domains."""
@@ -33,13 +42,16 @@ class Domain:
     """
 
     name: dns.name.Name
+    address: Optional[str] = None
+    """The IP address the domain has been resolved from, see `from_ip`."""
 
     @property
     def length(self) -> int:
         return len(self.name.to_text())
 
-    def __init__(self, name: str) -> None:
+    def __init__(self, name: str, address: Optional[str] = None) -> None:
         self.name = dns.name.from_text(name)
+        self.address = address
 
     @classmethod
     def from_string(cls, domain_str: str) -> Self:
@@ -56,22 +68,81 @@ class Domain:
         return cls(domain_str)
 
     @classmethod
-    async def from_ip(cls, ip_addr: str) -> Self:
+    def intern(cls, domain_str: str) -> "Domain":
+        """Get the same Domain object for the same string, the last
+        `INTERNED_DOMAINS` domains are kept, so that a name is parsed once.
+
+        Args:
+            domain_str (str): a string containing a domain to be parsed
+
+        Returns:
+            Domain: the domain obtained from the string, it must not be modified
+
+        """
+        return _intern(domain_str)
+
+    def organizational_domain(self) -> "Domain":
+        """Get the organizational domain, the public suffix of the domain (see
+        `spamanalyzer.publicsuffix`) plus one label, e.g. `example.co.uk` for
+        `mail.example.co.uk`.
+
+        Two domains of the same organization have the same (interned) organizational
+        domain, it is found in as many steps as the labels of the name.
+
+        Returns:
+            Domain: the organizational domain, the domain itself if it is a public
+            suffix, e.g. `unknown`
+
+        """
+        # the interned domains are checked for every hop, their result is kept
+        cached = self.__dict__.get("_organization")
+        if cached is not None:
+            return cached
+        text = self.name.to_text(omit_final_dot=True)
+        organization = publicsuffix.organizational_domain(text)
+        cached = Domain.intern(text.lower() if organization is None else organization)
+        self.__dict__["_organization"] = cached
+        return cached
+
+    @classmethod
+    async def from_ip(cls,
+                      ip_addr: str,
+                      resolver: Optional[ResolverCache] = None) -> Self:
         """Create a Domain object from an ip address. It translate the ip address
         to its domain name via the `socket.gethostbyaddr` method.
 
         Args:
             ip_addr (str): the targetted ip address
+            resolver (ResolverCache, optional): a cache of the lookups, the address
+            is resolved once
 
         Returns:
-            Domain: the domain obtained from the ip address
+            Domain: the domain obtained from the ip address, with the `address`, the
+            name is `unknown` if the address cannot be resolved
 
         """
         try:
+            if resolver is not None:
+                domain_name = await resolver.reverse(ip_addr)
+                return cls("unknown" if domain_name is None else domain_name, ip_addr)
             domain_name, _, _ = await asyncio.to_thread(socket.gethostbyaddr, ip_addr)
-            return cls(domain_name)
+            return cls(domain_name, ip_addr)
         except Exception:
-            return cls("unknown")
+            return cls("unknown", ip_addr)
+
+    def network(self, table: NetworkTable) -> Optional[Network]:
+        """Find the network of the `address` of the domain in an offline table, see
+        `spamanalyzer.networks`; the domain may be unknown.
+
+        Args:
+            table (NetworkTable): the table of the IP ranges
+
+        Returns:
+            Network | None: the range and its autonomous system, `None` if the domain
+            has no address or it is not in the table
+
+        """
+        return None if self.address is None else table.lookup(self.address)
 
     async def get_ip_address(self) -> str:
         """Translate the domain name to its ip address querying the DNS server.
@@ -152,3 +223,8 @@ class Domain:
         if self.is_superdomain(domain):
             return DomainRelation.SUPERDOMAIN
         return DomainRelation.DIFFERENT
+
+
+@lru_cache(maxsize=INTERNED_DOMAINS)
+def _intern(domain_str: str) -> Domain:
+    return Domain(domain_str)
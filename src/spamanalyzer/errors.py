@@ -8,3 +8,12 @@ class EmailFormatError(EmailError):
     def __init__(self, message="The email format is not valid"):
         self.message = message
         super().__init__(self.message)
+
+
+class AnalysisError(EmailError):
+    """Exception raised when the analysis of an email fails or times out, the
+    original exception is its `__cause__`."""
+
+    def __init__(self, email_path: str):
+        self.email_path = email_path
+        super().__init__(f"The analysis of {email_path} failed")
@@ -0,0 +1,214 @@
+"""Parse very large mails in a bounded amount of memory.
+
+mailparser reads a whole mail in memory and decodes every part, and the body checks
+copy the text a few more times: a mail of hundreds of megabytes with embedded media
+takes gigabytes. In the large-message mode a mail bigger than a byte budget is
+reduced before it is parsed:
+
+- the headers of the mail and of its parts are kept whole;
+- a text part keeps its beginning and its end, the budget is shared among the text
+  parts;
+- a binary part keeps only its first `BINARY_PREFIX` bytes, enough to recognize its
+  format (see `spamanalyzer.attachments`).
+
+The file is memory-mapped, only the kept bytes are read. The analysis of a reduced
+mail is marked as truncated (see `is_truncated`):
+
+```python
+email = parse_large(email_path, max_bytes=16 * 2**20)
+```
+"""
+
+import mmap
+import os
+from dataclasses import dataclass, field
+from email.message import Message
+from email.parser import BytesHeaderParser
+from email.policy import compat32
+from typing import Any, List, Tuple
+
+import mailparser
+
+from spamanalyzer.parser import StdlibMail, parse_file
+
+BINARY_PREFIX = 8192
+"""The bytes of the (encoded) payload kept of a binary part."""
+
+MAX_DEPTH = 16
+"""The deepest nested multipart that is split into its parts, a deeper one is
+reduced as a binary part."""
+
+_HEADER_PARSER = BytesHeaderParser(policy=compat32)
+
+
+class TruncatedMail(mailparser.MailParser):
+    """A mail parsed from a reduced copy of a mail too large for the budget, see
+    `parse_large`."""
+
+    original_size: int = 0
+    """The size of the mail file, in bytes."""
+
+
+@dataclass
+class _Part:
+    start: int
+    body: int
+    end: int
+    message: Message
+    children: List["_Part"] = field(default_factory=list)
+
+    @property
+    def is_text(self) -> bool:
+        # text attachments are reduced as binary parts
+        return (self.message.get_content_maintype() == "text"
+                and self.message.get_filename() is None)
+
+    def text_parts(self) -> int:
+        if self.children:
+            return sum(child.text_parts() for child in self.children)
+        return int(self.is_text)
+
+
+def parse_large(email_path: str, max_bytes: int, parser: str = "mailparser") -> Any:
+    """Parse a mail, reducing it first if it is larger than `max_bytes`.
+
+    Args:
+        email_path (str): the path of the mail
+        max_bytes (int): the budget, the text parts of a larger mail keep at most
+        `max_bytes` bytes overall
+        parser (str): the parser backend, see `spamanalyzer.parser.PARSERS`
+
+    Returns:
+        MailParser | StdlibMail: the parsed mail, a `TruncatedMail` or a truncated
+        `StdlibMail` if it has been reduced
+
+    """
+    size = os.path.getsize(email_path)
+    if size <= max_bytes:
+        return parse_file(email_path, parser)
+
+    with open(email_path, "rb") as f, mmap.mmap(f.fileno(), 0,
+                                                access=mmap.ACCESS_READ) as data:
+        reduced = reduce_message(data, max_bytes)
+    email: Any
+    if parser == "stdlib":
+        email = StdlibMail.from_bytes(reduced)
+        email.truncated = True
+    else:
+        email = TruncatedMail.from_bytes(reduced)
+    email.original_size = size
+    return email
+
+
+def is_truncated(email: Any) -> bool:
+    """Check if a parsed mail has been reduced by `parse_large`."""
+    if isinstance(email, StdlibMail):
+        return email.truncated
+    return isinstance(email, TruncatedMail)
+
+
+def reduce_message(data: bytes, max_bytes: int) -> bytes:
+    """Reduce a raw mail to its headers, the beginning and the end of its text parts
+    and the first bytes of its binary parts.
+
+    Args:
+        data (bytes): the raw mail, e.g. a memory-mapped file
+        max_bytes (int): the budget shared by the text parts
+
+    Returns:
+        bytes: a mail with the same structure, parts and headers
+
+    """
+    newline = b"\r\n" if data.find(b"\r\n", 0, 4096) != -1 else b"\n"
+    root = _scan(data, 0, len(data), 0)
+    budget = max_bytes // max(1, root.text_parts())
+    out: List[bytes] = []
+    _rebuild(data, root, budget, newline, out)
+    return b"".join(out)
+
+
+def _scan(data: bytes, start: int, end: int, depth: int) -> _Part:
+    body = _body_start(data, start, end)
+    part = _Part(start, body, end, _HEADER_PARSER.parsebytes(data[start:body]))
+    boundary = part.message.get_boundary()
+    if (part.message.get_content_maintype() == "multipart" and boundary is not None
+            and depth < MAX_DEPTH):
+        part.children = [
+            _scan(data, child_start, child_end, depth + 1)
+            for child_start, child_end in _split(data, body, end, boundary.encode())
+        ]
+    return part
+
+
+def _body_start(data: bytes, start: int, end: int) -> int:
+    # the headers end at the first empty line, a part may have no headers at all
+    if data[start:start + 1] == b"\n":
+        return start + 1
+    if data[start:start + 2] == b"\r\n":
+        return start + 2
+    ends = [(data.find(sep, start, end), len(sep)) for sep in (b"\n\n", b"\r\n\r\n")]
+    found = [index + length for index, length in ends if index != -1]
+    return min(found) if found else end
+
+
+def _split(data: bytes, start: int, end: int, boundary: bytes) -> List[Tuple[int, int]]:
+    marker = b"\n--" + boundary
+    spans = []
+    if data[start:start + len(marker) - 1] == marker[1:]:
+        position = start - 1
+    else:
+        position = data.find(marker, start, end)
+    while position != -1:
+        after = position + len(marker)
+        if data[after:after + 2] == b"--":
+            break
+        line_end = data.find(b"\n", after, end)
+        if line_end == -1:
+            break
+        following = data.find(marker, line_end, end)
+        part_end = end if following == -1 else following
+        if data[part_end - 1:part_end] == b"\r":
+            part_end -= 1
+        spans.append((line_end + 1, part_end))
+        position = following
+    return spans
+
+
+def _rebuild(data: bytes, part: _Part, budget: int, newline: bytes,
+             out: List[bytes]) -> None:
+    out.append(data[part.start:part.body])
+    if part.children:
+        delimiter = b"--" + part.message.get_boundary().encode()  # type: ignore
+        for child in part.children:
+            out.append(delimiter + newline)
+            _rebuild(data, child, budget, newline, out)
+            out.append(newline)
+        out.append(delimiter + b"--" + newline)
+    elif part.is_text:
+        out.append(_head_and_tail(data, part.body, part.end, budget))
+    else:
+        out.append(_head(data, part.body, part.end, BINARY_PREFIX))
+
+
+def _head(data: bytes, start: int, end: int, size: int) -> bytes:
+    # whole lines, so that an encoded payload can still be decoded
+    if end - start <= size:
+        return data[start:end]
+    cut = data.rfind(b"\n", start, start + size)
+    return data[start:start + size if cut == -1 else cut + 1]
+
+
+def _tail(data: bytes, start: int, end: int, size: int) -> bytes:
+    if end - start <= size:
+        return data[start:end]
+    cut = data.find(b"\n", end - size, end)
+    return data[end - size if cut == -1 else cut + 1:end]
+
+
+def _head_and_tail(data: bytes, start: int, end: int, size: int) -> bytes:
+    if end - start <= size:
+        return data[start:end]
+    head = _head(data, start, end, size // 2)
+    if not head.endswith(b"\n"):
+        head += b"\n"
+    return head + _tail(data, start, end, size - size // 2)
@@ -0,0 +1,114 @@
+"""Save numpy arrays in a file that is memory-mapped when it is loaded.
+
+`np.load` reads the arrays of a `.npz` file whole: the tables built offline with
+millions of entries (see `spamanalyzer.networks`) are saved instead in a file made of
+a small JSON header followed by the raw arrays, each aligned to `ALIGNMENT` bytes.
+Loading the file maps it and reads the header only, the pages of an array are read
+by the system when they are first accessed and they are shared by all the processes
+that map the same file:
+
+```python
+save_arrays("table.bin", "networks", 1, {"first": first, "last": last})
+arrays = map_arrays("table.bin", "networks", 1)
+```
+"""
+
+import json
+import mmap
+import os
+import struct
+from typing import Any, Dict, Mapping
+
+import numpy as np
+
+MAGIC = b"SPAMARRS"
+"""The first bytes of a file written by `save_arrays`."""
+
+ALIGNMENT = 64
+"""The alignment in bytes of the arrays in the file."""
+
+_LENGTH = struct.Struct("<Q")
+
+
+def save_arrays(path: str, kind: str, version: int,
+                arrays: Mapping[str, np.ndarray]) -> None:
+    """Write arrays to a file that can be mapped by `map_arrays`.
+
+    The file is written next to `path` and then renamed, so that the processes that
+    mapped the previous version of the file keep reading it.
+
+    Args:
+        path (str): the path of the file, it is overwritten
+        kind (str): what the arrays are, checked by `map_arrays`
+        version (int): the version of the layout of the arrays
+        arrays (Mapping[str, np.ndarray]): the arrays by name
+
+    """
+    contiguous = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout: Dict[str, Any] = {}
+    offset = 0
+    for name, array in contiguous.items():
+        layout[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset
+        }
+        offset = _align(offset + array.nbytes)
+    header = json.dumps({"kind": kind, "version": version, "arrays": layout}).encode()
+    start = _align(len(MAGIC) + _LENGTH.size + len(header))
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary, "wb") as f:
+            f.write(MAGIC + _LENGTH.pack(len(header)) + header)
+            for name, array in contiguous.items():
+                f.seek(start + layout[name]["offset"])
+                f.write(array.tobytes())
+            # the last array may be empty, the file must cover its offset
+            f.truncate(start + offset)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def map_arrays(path: str, kind: str, version: int) -> Dict[str, np.ndarray]:
+    """Map the arrays of a file written by `save_arrays`.
+
+    Args:
+        path (str): the path of the file
+        kind (str): the expected kind of the arrays
+        version (int): the expected version of their layout
+
+    Returns:
+        dict: the read-only arrays by name, they are valid as long as they are
+        referenced, the file can be replaced meanwhile
+
+    Raises:
+        ValueError: if the file is not a file of arrays of this kind and version
+
+    """
+    with open(path, "rb") as f:
+        prefix = f.read(len(MAGIC) + _LENGTH.size)
+        if len(prefix) < len(MAGIC) + _LENGTH.size or not prefix.startswith(MAGIC):
+            raise ValueError(f"{path} is not a file of arrays")
+        (length, ) = _LENGTH.unpack(prefix[len(MAGIC):])
+        header = json.loads(f.read(length))
+        if header["kind"] != kind or header["version"] != version:
+            raise ValueError(f"{path} contains {header['kind']} version "
+                             f"{header['version']}, expected {kind} version {version}")
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    start = _align(len(MAGIC) + _LENGTH.size + length)
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        array = np.frombuffer(data, dtype, count, start + spec["offset"])
+        arrays[name] = array.reshape(spec["shape"])
+    return arrays
+
+
+def _align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
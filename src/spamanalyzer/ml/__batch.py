@@ -0,0 +1,78 @@
+from typing import Protocol
+
+import numpy as np
+
+from .__classifier import FEATURE_DTYPE, FEATURES
+
+
+class SupportsFeatures(Protocol):
+
+    def to_array(self, out: np.ndarray) -> np.ndarray:
+        ...
+
+
+class FeatureMatrix:
+    """A preallocated `(capacity, len(FEATURES))` matrix of features.
+
+    Analyses are written in place, one row each, as soon as they are appended: no
+    intermediate list or array is created per mail. When the matrix is full it can
+    be classified and cleared, so the memory used to classify a batch depends only on
+    the capacity of the matrix and not on the number of mails.
+
+    ```python
+    matrix = FeatureMatrix(capacity=1024)
+    for analysis in analyses:
+        matrix.append(analysis)
+        if matrix.full:
+            predictions = classifier.predict(matrix.features)
+            matrix.clear()
+    ```
+
+    """
+
+    __slots__ = ("_data", "_size")
+
+    def __init__(self, capacity: int = 1024) -> None:
+        if capacity <= 0:
+            raise ValueError("The capacity of the matrix must be positive")
+        self._data = np.empty((capacity, len(FEATURES)), dtype=FEATURE_DTYPE)
+        self._size = 0
+
+    @property
+    def capacity(self) -> int:
+        return self._data.shape[0]
+
+    @property
+    def full(self) -> bool:
+        return self._size == self.capacity
+
+    @property
+    def features(self) -> np.ndarray:
+        """A view on the rows filled so far."""
+        return self._data[:self._size]
+
+    def append(self, analysis: SupportsFeatures) -> np.ndarray:
+        """Write the features of an analysis in the next free row.
+
+        Args:
+            analysis (MailAnalysis | CompactMailAnalysis): the analysis to add
+
+        Returns:
+            np.ndarray: the row where the features have been written
+
+        Raises:
+            OverflowError: if the matrix is full
+
+        """
+        if self.full:
+            raise OverflowError("The feature matrix is full")
+        row = analysis.to_array(self._data[self._size])
+        self._size += 1
+        return row
+
+    def clear(self) -> None:
+        """Forget the rows written so far, the memory is reused."""
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
@@ -1,6 +1,12 @@
+import json
+import os
 import pickle
+import zipfile
+from typing import Optional, Sequence
 
-import pandas as pd
+import numpy as np
+
+from .__compiled import CompiledForest
 
 HEADERS = [
     "has_spf",
@@ -29,18 +35,173 @@ HEADERS = [
     "is_spam",
 ]
 
+FEATURES = HEADERS[:-1]
+"""The columns used as input by the classifier, `HEADERS` without the label."""
+
+HEADER_FEATURES = FEATURES[:10]
+"""The columns computed from the headers of a mail only, they are the input of the
+header model used by the cascade classification."""
+
+FEATURE_DTYPE = np.float32
+"""The dtype of a feature row: tree based models evaluate their splits in single
+precision, so storing the features as `float32` halves the memory without changing
+the predictions."""
+
+
+def metadata_path(path_to_model: str) -> str:
+    """Get the path of the metadata stored next to a model, e.g. `classifier.json`
+    for `classifier.pkl`."""
+    return os.path.splitext(path_to_model)[0] + ".json"
+
+
+def load_features(path_to_model: str) -> Optional[list[str]]:
+    """Read the feature columns declared in the metadata of a model.
+
+    Args:
+        path_to_model (str): the path to the model
+
+    Returns:
+        list | None: the columns used by the model, `None` if the model has no
+        metadata
+
+    """
+    try:
+        with open(metadata_path(path_to_model), "r", encoding="utf-8") as f:
+            return json.load(f)["features"]
+    except FileNotFoundError:
+        return None
+
 
 class SpamClassifier:
+    """A wrapper of the model used to classify the mails.
+
+    The model declares the feature columns it needs, so that the analyzer can skip
+    the checks whose results are not used. In order of priority they are taken from:
+
+    1. the `features` argument
+    2. the metadata stored next to the model (see `save_model`)
+    3. the `feature_names_in_` attribute of scikit-learn models fitted on a DataFrame
+    4. the `default_features` argument, all the columns of `FEATURES` by default
+
+    The input of `predict` and `predict_proba` can contain more columns than the
+    model needs: they are named by the `columns` argument and the needed ones are
+    selected.
+
+    The format of the model is detected automatically: a `.npz` file written by
+    `compile_model` is evaluated by `CompiledForest` without importing scikit-learn
+    or pandas, and without unpickling; any other file is unpickled.
+
+    """
+
+    features: tuple[str, ...]
+    """The columns expected by the model, in order."""
+
+    def __init__(
+        self,
+        path_to_model: str,
+        features: Optional[Sequence[str]] = None,
+        default_features: Sequence[str] = FEATURES,
+    ) -> None:
+        if zipfile.is_zipfile(path_to_model):
+            model = CompiledForest.load(path_to_model)
+        else:
+            with open(path_to_model, "rb") as f:
+                model = pickle.load(f)
 
-    def __init__(self, path_to_model: str) -> None:
-        with open(path_to_model, "rb") as f:
-            self.model = pickle.load(f)
+        if features is None:
+            features = load_features(path_to_model)
+        self.__setup(model, features, default_features)
 
-    def predict(self, X_test):
-        X = pd.DataFrame(X_test, columns=HEADERS[:-1])
+    @classmethod
+    def from_model(
+        cls,
+        model,
+        features: Optional[Sequence[str]] = None,
+        default_features: Sequence[str] = FEATURES,
+    ) -> "SpamClassifier":
+        """Wrap a model that is already loaded, e.g. a `CompiledForest` attached to
+        shared memory.
+
+        Args:
+            model: the model, it must implement the scikit-learn `predict` and
+            `predict_proba` methods
+            features (Sequence[str], optional): the columns used by the model
+            default_features (Sequence[str]): the columns used if the model does
+            not declare them
+
+        Returns:
+            SpamClassifier: the classifier
+
+        """
+        classifier = cls.__new__(cls)
+        classifier.__setup(model, features, default_features)
+        return classifier
+
+    def __setup(self, model, features: Optional[Sequence[str]],
+                default_features: Sequence[str]) -> None:
+        if features is None:
+            features = getattr(model, "feature_names_in_", None)
+        if features is None:
+            features = default_features
+
+        unknown = set(features) - set(FEATURES)
+        if unknown:
+            raise ValueError(f"The model uses unknown features: {sorted(unknown)}")
+        self.model = model
+        self.features = tuple(features)
+
+    def __select(self, X_test, columns: Sequence[str]):
+        if tuple(columns) != self.features:
+            try:
+                indices = [list(columns).index(feature) for feature in self.features]
+            except ValueError as e:
+                raise ValueError("The input does not contain all the features "
+                                 f"used by the model: {self.features}") from e
+            X_test = np.asarray(X_test)[:, indices]
+
+        if isinstance(self.model, CompiledForest):
+            return X_test
+
+        import pandas as pd
+
+        return pd.DataFrame(X_test, columns=self.features, copy=False)
+
+    def predict(self, X_test, columns: Sequence[str] = FEATURES):
+        X = self.__select(X_test, columns)
         return self.model.predict(X)
 
+    def predict_proba(self, X_test, columns: Sequence[str] = FEATURES) -> np.ndarray:
+        """Get the probability of each mail to be spam.
+
+        Args:
+            X_test: a matrix with a row for each mail and a column for each feature
+            columns (Sequence[str]): the names of the columns of `X_test`
+
+        Returns:
+            np.ndarray: the probabilities, one for each row of `X_test`
+
+        """
+        X = self.__select(X_test, columns)
+        probabilities = self.model.predict_proba(X)
+        return probabilities[:, list(self.model.classes_).index(1)]
 
-def save_model(model: SpamClassifier, path: str) -> None:
+
+def save_model(model, path: str, features: Optional[Sequence[str]] = None) -> None:
+    """Save a model, and the feature columns it uses, to be loaded by
+    `SpamClassifier`.
+
+    Args:
+        model: the model to save, it must implement the scikit-learn `predict` and
+        `predict_proba` methods
+        path (str): where to save the model
+        features (Sequence[str], optional): the columns the model has been trained
+        on, they are stored in a metadata file next to the model (see
+        `metadata_path`)
+
+    """
     with open(path, "wb") as f:
         pickle.dump(model, f)
+
+    if features is not None:
+        with open(metadata_path(path), "w", encoding="utf-8") as f:
+            json.dump({"features": list(features)}, f, indent=4)
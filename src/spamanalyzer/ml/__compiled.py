@@ -0,0 +1,140 @@
+from typing import Mapping, Sequence
+
+import numpy as np
+
+COMPILED_FORMAT_VERSION = 1
+"""The version of the layout of the arrays saved by `compile_model`."""
+
+
+def _trees(model) -> list:
+    if getattr(model, "n_outputs_", 1) != 1:
+        raise TypeError("Multi-output models cannot be compiled")
+    if hasattr(model, "estimators_"):
+        return [estimator.tree_ for estimator in model.estimators_]
+    if hasattr(model, "tree_"):
+        return [model.tree_]
+    raise TypeError(f"Cannot compile {type(model).__name__}, only decision trees and "
+                    "forests of decision trees are supported")
+
+
+def compile_model(model, path: str, features: Sequence[str]) -> None:
+    """Convert a tree based scikit-learn classifier to flat numpy arrays saved in a
+    `.npz` file, that can be evaluated by `CompiledForest` without scikit-learn.
+
+    The nodes of all the trees are concatenated, the file contains:
+
+    - `feature`, `threshold`: the split of each node
+    - `left`, `right`: the indices of the children of each node, `-1` for leaves
+    - `value`: the class probabilities of each node
+    - `roots`: the index of the root of each tree
+    - `classes`, `features`: the labels and the input columns of the model
+
+    Args:
+        model: a fitted `DecisionTreeClassifier`, `RandomForestClassifier` or
+        `ExtraTreesClassifier`
+        path (str): where to save the compiled model
+        features (Sequence[str]): the columns the model has been trained on
+
+    Raises:
+        TypeError: if the model is not a tree based classifier
+
+    """
+    trees = _trees(model)
+
+    offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+    feature, threshold, left, right, value = [], [], [], [], []
+    for tree, offset in zip(trees, offsets):
+        is_leaf = tree.children_left == -1
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(tree.threshold)
+        left.append(np.where(is_leaf, -1, tree.children_left + offset))
+        right.append(np.where(is_leaf, -1, tree.children_right + offset))
+        # scikit-learn normalizes the (weighted) class counts of the leaves
+        counts = tree.value[:, 0, :]
+        value.append(counts / counts.sum(axis=1, keepdims=True))
+
+    with open(path, "wb") as f:
+        np.savez(
+            f,
+            version=np.array(COMPILED_FORMAT_VERSION),
+            feature=np.concatenate(feature).astype(np.int32),
+            threshold=np.concatenate(threshold).astype(np.float64),
+            left=np.concatenate(left).astype(np.int32),
+            right=np.concatenate(right).astype(np.int32),
+            value=np.concatenate(value).astype(np.float64),
+            roots=offsets[:-1].astype(np.int32),
+            max_depth=np.array(max(tree.max_depth for tree in trees)),
+            classes=np.asarray(model.classes_),
+            features=np.array(features),
+        )
+
+
+class CompiledForest:
+    """A forest of decision trees evaluated with numpy only.
+
+    It is built from the arrays written by `compile_model` and exposes the subset of the
+    scikit-learn API used by `SpamClassifier` (`classes_`, `feature_names_in_`,
+    `predict` and `predict_proba`), with identical results: like scikit-learn the
+    inputs are cast to `float32` before being compared with the thresholds and the
+    probabilities of the trees are averaged in order.
+
+    The whole batch is evaluated at once: at each step every (mail, tree) pair moves
+    one level down its tree, so the number of numpy operations depends on the depth of
+    the trees and not on the number of mails.
+
+    """
+
+    def __init__(self, arrays: Mapping[str, np.ndarray]) -> None:
+        version = int(arrays["version"])
+        if version != COMPILED_FORMAT_VERSION:
+            raise ValueError(f"Unsupported compiled model version: {version}")
+        self.arrays = dict(arrays)
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.value = arrays["value"]
+        self.roots = arrays["roots"]
+        self.max_depth = int(arrays["max_depth"])
+        self.classes_ = arrays["classes"]
+        self.feature_names_in_ = arrays["features"].tolist()
+
+    @classmethod
+    def load(cls, path: str) -> "CompiledForest":
+        """Load a model written by `compile_model`."""
+        with np.load(path) as data:
+            return cls({name: data[name] for name in data.files})
+
+    def apply(self, X) -> np.ndarray:
+        """Get the leaf reached by each mail in each tree.
+
+        Args:
+            X: a `(n, len(feature_names_in_))` matrix
+
+        Returns:
+            np.ndarray: a `(n, n_trees)` matrix of node indices
+
+        """
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(X.shape[0])[:, np.newaxis]
+        nodes = np.repeat(self.roots[np.newaxis, :], X.shape[0], axis=0)
+
+        for _ in range(self.max_depth):
+            left = self.left[nodes]
+            is_leaf = left == -1
+            if is_leaf.all():
+                break
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(is_leaf, nodes, np.where(go_left, left, self.right[nodes]))
+
+        return nodes
+
+    def predict_proba(self, X) -> np.ndarray:
+        leaves = self.apply(X)
+        proba = np.zeros((leaves.shape[0], len(self.classes_)), dtype=np.float64)
+        for tree in range(leaves.shape[1]):
+            proba += self.value[leaves[:, tree]]
+        return proba / leaves.shape[1]
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
@@ -1,3 +1,36 @@
-from .__classifier import SpamClassifier, save_model
+from .__batch import FeatureMatrix
+from .__classifier import (
+    FEATURE_DTYPE,
+    FEATURES,
+    HEADER_FEATURES,
+    HEADERS,
+    SpamClassifier,
+    load_features,
+    metadata_path,
+    save_model,
+)
+from .__compiled import CompiledForest, compile_model
+from .__store import (
+    EXTRACTION_VERSION,
+    FeatureStore,
+    content_hash,
+    extraction_fingerprint,
+)
 
-__all__ = ["SpamClassifier", "save_model"]
+__all__ = [
+    "SpamClassifier",
+    "FeatureMatrix",
+    "FeatureStore",
+    "CompiledForest",
+    "compile_model",
+    "content_hash",
+    "extraction_fingerprint",
+    "EXTRACTION_VERSION",
+    "save_model",
+    "load_features",
+    "metadata_path",
+    "HEADERS",
+    "FEATURES",
+    "HEADER_FEATURES",
+    "FEATURE_DTYPE",
+]
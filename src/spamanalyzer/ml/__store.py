@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+from importlib.metadata import PackageNotFoundError, version
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .__classifier import FEATURE_DTYPE, FEATURES
+
+DIGEST_SIZE = 32
+"""The size in bytes of the content hash (SHA-256) identifying a mail."""
+
+EXTRACTION_VERSION = 1
+"""The version of the feature extraction, part of `extraction_fingerprint`: bump it
+when a check computes different values, so that the stored features are extracted
+again."""
+
+
+def content_hash(path: str) -> bytes:
+    """Get the SHA-256 digest of the content of a file.
+
+    Args:
+        path (str): the path of the file
+
+    Returns:
+        bytes: the digest, `DIGEST_SIZE` bytes long
+
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def extraction_fingerprint(wordlist: Iterable[str], **options: Any) -> str:
+    """Fingerprint the inputs of the feature extraction that are not in the mails.
+
+    Args:
+        wordlist (Iterable[str]): the spam wordlist, it changes the bad words
+        percentage and the subject checks
+        options: the other inputs, e.g. how the domains are resolved, they must be
+        serializable to JSON
+
+    Returns:
+        str: a hexadecimal digest of the inputs, of `EXTRACTION_VERSION` and of the
+        version of the package
+
+    """
+    try:
+        package = version("spam-analyzer")
+    except PackageNotFoundError:
+        package = None
+    inputs = {
+        "extraction": EXTRACTION_VERSION,
+        "package": package,
+        "wordlist": hashlib.sha256("\n".join(wordlist).encode()).hexdigest(),
+        "options": options,
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+class FeatureStore:
+    """A columnar store of the features extracted from labelled mails.
+
+    The store is saved as a `.npz` file with three aligned columns: the content
+    hash of each mail, its features (see `spamanalyzer.ml.FEATURES`) and its label
+    (`1` for spam, `0` for ham). Mails are identified by the hash of their content,
+    so a mail that is moved or renamed is not analyzed again while a modified one is.
+
+    The names of the feature columns are saved too: a store written with different
+    features is discarded when loaded, since its rows cannot be reused. So is a store
+    whose `fingerprint` differs, e.g. its features were extracted with another
+    wordlist (see `extraction_fingerprint`).
+
+    ```python
+    store = FeatureStore.load("features.npz", extraction_fingerprint(wordlist))
+    for path in paths:
+        digest = content_hash(path)
+        if digest not in store:
+            store.add(digest, extract(path), label)
+    store.save("features.npz")
+    ```
+
+    """
+
+    fingerprint: str
+    """The fingerprint of the inputs of the extraction of the stored features."""
+
+    __index: Dict[bytes, int]
+    __features: List[np.ndarray]
+    __labels: List[int]
+
+    def __init__(self, fingerprint: str = "") -> None:
+        self.fingerprint = fingerprint
+        self.__index = {}
+        self.__features = []
+        self.__labels = []
+
+    @classmethod
+    def load(cls, path: str, fingerprint: str = "") -> "FeatureStore":
+        """Load a store, if the file does not exist, or it was written with other
+        features or another fingerprint, an empty store is returned.
+
+        Args:
+            path (str): the path of the `.npz` file
+            fingerprint (str): the fingerprint of the inputs of the extraction of
+            this run, see `extraction_fingerprint`
+
+        Returns:
+            FeatureStore: the loaded store
+
+        """
+        store = cls(fingerprint)
+        if not os.path.exists(path):
+            return store
+
+        with np.load(path) as data:
+            if data["columns"].tolist() != list(FEATURES):
+                return store
+            saved = str(data["fingerprint"]) if "fingerprint" in data.files else None
+            if saved != fingerprint:
+                return store
+            rows = zip(data["digests"], data["features"], data["labels"])
+            for digest, row, label in rows:
+                store.add(digest.tobytes(), row, int(label))
+        return store
+
+    def save(self, path: str) -> None:
+        """Write the store to a compressed `.npz` file.
+
+        Args:
+            path (str): the path of the file, it is overwritten
+
+        """
+        digests = np.frombuffer(b"".join(self.__index), dtype=np.uint8)
+        features = (np.stack(self.__features) if self.__features else np.empty(
+            (0, len(FEATURES)), dtype=FEATURE_DTYPE))
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                columns=np.array(FEATURES),
+                fingerprint=np.array(self.fingerprint),
+                digests=digests.reshape(-1, DIGEST_SIZE),
+                features=features.astype(FEATURE_DTYPE),
+                labels=np.array(self.__labels, dtype=np.int8),
+            )
+
+    def add(self, digest: bytes, features: np.ndarray, label: int) -> None:
+        """Add the features of a mail, replacing them if the mail is in the store.
+
+        Args:
+            digest (bytes): the content hash of the mail, see `content_hash`
+            features (np.ndarray): the features of the mail
+            label (int): `1` if the mail is spam, `0` otherwise
+
+        """
+        if len(digest) != DIGEST_SIZE:
+            raise ValueError(f"A digest must be {DIGEST_SIZE} bytes long")
+
+        index = self.__index.get(digest)
+        row = np.asarray(features, dtype=FEATURE_DTYPE)
+        if index is None:
+            self.__index[digest] = len(self.__features)
+            self.__features.append(row)
+            self.__labels.append(label)
+        else:
+            self.__features[index] = row
+            self.__labels[index] = label
+
+    def get(self, digest: bytes) -> Optional[Tuple[np.ndarray, int]]:
+        """Get the features and the label of a mail, `None` if it is not stored."""
+        index = self.__index.get(digest)
+        if index is None:
+            return None
+        return self.__features[index], self.__labels[index]
+
+    def dataset(
+            self,
+            digests: Optional[Iterable[bytes]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Get a training set from the store.
+
+        Args:
+            digests (Iterable[bytes], optional): the mails to include, by default all
+            the stored mails
+
+        Returns:
+            tuple: the `(n, len(FEATURES))` matrix of features and the `n` labels
+
+        Raises:
+            KeyError: if a digest is not in the store
+
+        """
+        indices = (range(len(self))
+                   if digests is None else [self.__index[digest] for digest in digests])
+        X = np.empty((len(indices), len(FEATURES)), dtype=FEATURE_DTYPE)
+        y = np.empty(len(indices), dtype=np.int8)
+        for i, index in enumerate(indices):
+            X[i] = self.__features[index]
+            y[i] = self.__labels[index]
+        return X, y
+
+    def __contains__(self, digest: object) -> bool:
+        return digest in self.__index
+
+    def __len__(self) -> int:
+        return len(self.__features)
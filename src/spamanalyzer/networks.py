@@ -0,0 +1,263 @@
+"""Find the autonomous system (AS) of an IP address without the network.
+
+The addresses of the `Received` hops tell which networks relayed a mail, their
+autonomous system numbers are read from a table of IP ranges supplied by the
+operator, e.g. the [iptoasn](https://iptoasn.com/) dump or the GeoLite2 ASN csv
+files. The table is compiled once by `compile_networks` into sorted numpy arrays
+(see `spamanalyzer.mapped`): loading it maps the file, whatever its size, and an
+address is found by a binary search on the starts of the ranges:
+
+```python
+compile_networks("ip2asn-v4.tsv", "networks.bin")
+networks = NetworkTable.load("networks.bin")
+networks.lookup("192.0.2.1")  # Network(asn=64496, name="EXAMPLE-AS", ...)
+```
+
+The IPv6 ranges are indexed by their first 64 bits, the length of the smallest
+prefixes routed on the Internet.
+"""
+
+import csv
+import ipaddress
+import socket
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from spamanalyzer.mapped import map_arrays, save_arrays
+
+NETWORKS_FORMAT_VERSION = 1
+"""The version of the layout of the arrays written by `compile_networks`."""
+
+_FAMILIES = {4: ("ipv4", np.uint32, 0), 6: ("ipv6", np.uint64, 64)}
+"""The prefix of the arrays, their type and the bits dropped from the addresses of
+each IP version."""
+
+
+@dataclass(frozen=True)
+class Network:
+    """A range of addresses announced by an autonomous system."""
+
+    asn: int
+    """The autonomous system number."""
+    name: Optional[str]
+    """The name of the autonomous system or of its organization, if the table has
+    one."""
+    first: str
+    """The first address of the range."""
+    last: str
+    """The last address of the range."""
+
+
+def compile_networks(csv_path: str, path: str) -> int:
+    """Compile a csv file of IP ranges to a table loaded by `NetworkTable.load`.
+
+    The rows have either the first and the last address of a range or a network in
+    CIDR notation, then the autonomous system number and, last, its name:
+
+    - `first,last,asn[,...,name]`, e.g. the iptoasn dumps, tab separated as well
+    - `network,asn[,...,name]`, e.g. the GeoLite2 ASN csv files
+
+    Comments, blank lines, headers and the ranges of AS 0 (not routed) are skipped.
+    Where ranges overlap the range starting later wins, e.g. a /24 inside a /8: the
+    /8 is split around it, and `NetworkTable.lookup` returns the part of the /8 that
+    holds the address.
+
+    Args:
+        csv_path (str): the path of the csv file
+        path (str): where to write the table, it is overwritten
+
+    Returns:
+        int: the number of ranges of the table
+
+    Raises:
+        ValueError: if a row has an invalid address or autonomous system number
+
+    """
+    # the first and last keys, the number and the name of each range, by version
+    ranges: Dict[int, List[Tuple[int, int, int, int]]] = {4: [], 6: []}
+    names: Dict[str, int] = {}
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        for line_number, row in enumerate(_rows(f), 1):
+            parsed = _parse_row(row)
+            if parsed is None:
+                if line_number == 1:
+                    continue  # the header
+                raise ValueError(f"Invalid row {line_number} of {csv_path}: {row}")
+            first, last, asn, name = parsed
+            if asn == 0:
+                continue
+            shift = _FAMILIES[first.version][2]
+            name_id = names.setdefault(name, len(names)) if name else -1
+            ranges[first.version].append(
+                (int(first) >> shift, int(last) >> shift, asn, name_id))
+
+    arrays: Dict[str, np.ndarray] = {}
+    total = 0
+    for version, version_ranges in ranges.items():
+        prefix, dtype, _ = _FAMILIES[version]
+        version_ranges.sort(key=lambda item: item[0])
+        firsts, lasts, asns, name_ids = _split_overlaps(version_ranges)
+        arrays[f"{prefix}.first"] = np.array(firsts, dtype=dtype)
+        arrays[f"{prefix}.last"] = np.array(lasts, dtype=dtype)
+        arrays[f"{prefix}.asn"] = np.array(asns, dtype=np.uint32)
+        arrays[f"{prefix}.name"] = np.array(name_ids, dtype=np.int32)
+        total += len(firsts)
+
+    encoded = [name.encode("utf-8") for name in names]
+    arrays["names"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    arrays["name_offsets"] = np.cumsum([0] + [len(name) for name in encoded],
+                                       dtype=np.int64)
+    save_arrays(path, "networks", NETWORKS_FORMAT_VERSION, arrays)
+    return total
+
+
+def _split_overlaps(ranges: List[Tuple[int, int, int, int]]) -> Tuple[List[int], ...]:
+    # the ranges are sorted by their first key, the open ones are stacked with the
+    # latest started on top: it owns the keys until it ends, then the range below
+    # it takes over again, from the end of the top one to its own end
+    columns: Tuple[List[int], ...] = ([], [], [], [])
+    stack: List[Tuple[int, int, int, int]] = []
+    cursor = 0
+
+    def emit(until: Optional[int]) -> None:
+        nonlocal cursor
+        while stack and (until is None or cursor <= until):
+            last, asn, name_id = stack[-1][1:]
+            if last < cursor:
+                stack.pop()  # ended inside a range started later
+                continue
+            end = last if until is None else min(last, until)
+            for column, value in zip(columns, (cursor, end, asn, name_id)):
+                column.append(value)
+            cursor = end + 1
+            if end == last:
+                stack.pop()
+
+    for item in ranges:
+        emit(item[0] - 1)
+        stack.append(item)
+        cursor = item[0]
+    emit(None)
+    return columns
+
+
+class NetworkTable:
+    """A table of IP ranges and of their autonomous systems, compiled by
+    `compile_networks` and memory-mapped.
+
+    A table can be pickled, e.g. to be sent to the workers of `AnalysisPool`: the
+    file is mapped again by the process that unpickles it.
+
+    """
+
+    path: str
+    """The path of the compiled table."""
+
+    def __init__(self, path: str, arrays: Dict[str, np.ndarray]) -> None:
+        self.path = path
+        self.__arrays = arrays
+
+    @classmethod
+    def load(cls, path: str) -> "NetworkTable":
+        """Map a table written by `compile_networks`.
+
+        Raises:
+            ValueError: if the file is not a table of networks of this version
+
+        """
+        return cls(path, map_arrays(path, "networks", NETWORKS_FORMAT_VERSION))
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {"path": self.path}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.path = state["path"]
+        self.__arrays = map_arrays(self.path, "networks", NETWORKS_FORMAT_VERSION)
+
+    def __len__(self) -> int:
+        return len(self.__arrays["ipv4.first"]) + len(self.__arrays["ipv6.first"])
+
+    def lookup(self, ip_addr: str) -> Optional[Network]:
+        """Find the range of an address.
+
+        Args:
+            ip_addr (str): an IPv4 or IPv6 address
+
+        Returns:
+            Network | None: the range and its autonomous system, `None` if the
+            address is invalid or in no range of the table
+
+        """
+        found = self.__find(ip_addr)
+        if found is None:
+            return None
+        prefix, index = found
+        name_id = int(self.__arrays[f"{prefix}.name"][index])
+        name = None
+        if name_id >= 0:
+            start, end = self.__arrays["name_offsets"][name_id:name_id + 2]
+            name = self.__arrays["names"][start:end].tobytes().decode("utf-8")
+        address_class = ipaddress.IPv6Address if prefix == "ipv6" else ipaddress.IPv4Address
+        shift = _FAMILIES[6 if prefix == "ipv6" else 4][2]
+        low = int(self.__arrays[f"{prefix}.first"][index]) << shift
+        high = ((int(self.__arrays[f"{prefix}.last"][index]) + 1) << shift) - 1
+        return Network(int(self.__arrays[f"{prefix}.asn"][index]), name,
+                       str(address_class(low)), str(address_class(high)))
+
+    def asn(self, ip_addr: str) -> Optional[int]:
+        """The autonomous system number of an address, see `lookup`."""
+        found = self.__find(ip_addr)
+        if found is None:
+            return None
+        prefix, index = found
+        return int(self.__arrays[f"{prefix}.asn"][index])
+
+    def __find(self, ip_addr: str) -> Optional[Tuple[str, int]]:
+        # `socket` parses an address several times faster than `ipaddress`
+        try:
+            if ":" in ip_addr:
+                packed = socket.inet_pton(socket.AF_INET6, ip_addr)
+                prefix, key = "ipv6", int.from_bytes(packed[:8], "big")
+            else:
+                packed = socket.inet_pton(socket.AF_INET, ip_addr)
+                prefix, key = "ipv4", int.from_bytes(packed, "big")
+        except (OSError, TypeError, ValueError):
+            return None
+        first = self.__arrays[f"{prefix}.first"]
+        # a Python int would cast the whole array to a common type
+        index = int(first.searchsorted(first.dtype.type(key), "right")) - 1
+        if index < 0 or key > self.__arrays[f"{prefix}.last"][index]:
+            return None
+        return prefix, index
+
+
+def _rows(lines: Iterable[str]) -> Iterable[List[str]]:
+    # the tab separated dumps have names with commas, the csv files quote them
+    data = (line for line in lines if line.strip() and not line.startswith("#"))
+    first = next(data, None)
+    if first is None:
+        return
+    delimiter = "\t" if "\t" in first else ","
+    yield next(csv.reader([first], delimiter=delimiter))
+    yield from csv.reader(data, delimiter=delimiter)
+
+
+def _parse_row(row: List[str]) -> Optional[Tuple[Any, Any, int, Optional[str]]]:
+    try:
+        if "/" in row[0]:
+            network = ipaddress.ip_network(row[0].strip(), strict=False)
+            first, last = network.network_address, network.broadcast_address
+            rest = row[1:]
+        else:
+            first = ipaddress.ip_address(row[0].strip())
+            last = ipaddress.ip_address(row[1].strip())
+            rest = row[2:]
+        asn = int(rest[0].strip().upper().removeprefix("AS"))
+    except (ValueError, IndexError):
+        return None
+    if first.version != last.version or int(last) < int(first):
+        return None
+    name = rest[-1].strip() if len(rest) > 1 else None
+    return first, last, asn, name
@@ -0,0 +1,619 @@
+"""Analyze mails in worker processes that share a single copy of the model.
+
+Every worker of a naive process pool loads its own copy of the classifier, of the
+wordlist and of the sentiment lexicon, so the resident memory grows with the number
+of cores. `AnalysisPool` loads them once in the parent process and shares them:
+
+- with the `fork` start method the workers inherit the already loaded objects and
+  the operating system shares their pages until they are written (copy-on-write);
+- with the other start methods a compiled model (see
+  `spamanalyzer.ml.CompiledForest`) is published in a `SharedMemory` block
+  (`SharedArrays`) and the workers attach to it instead of loading the model.
+
+```python
+with AnalysisPool(wordlist, jobs=8) as pool:
+    for analysis, is_spam in pool.map(paths):
+        ...
+    report = pool.memory_report()
+```
+
+Mails of very different sizes are better dispatched the largest first, in chunks
+of decreasing size (see `plan_chunks` and `AnalysisPool.map_chunks`), and
+`AnalysisPool.utilization_report` tells how long each worker has been busy.
+
+"""
+
+import asyncio
+import itertools
+import multiprocessing
+import os
+import resource
+import signal
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass, replace
+from multiprocessing.shared_memory import SharedMemory
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Sized,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+
+from spamanalyzer.blocklist import Blocklists
+from spamanalyzer.data_structures import (
+    Cascade,
+    CascadeStats,
+    MailAnalysis,
+    SpamAnalyzer,
+    default_model,
+)
+from spamanalyzer.ml import CompiledForest, SpamClassifier
+from spamanalyzer.networks import NetworkTable
+from spamanalyzer.publicsuffix import default_trie
+from spamanalyzer.resolver import Lookup, ResolverCache
+from spamanalyzer.stats import CacheStats
+from spamanalyzer.templates import TemplateCache
+
+Layout = Dict[str, Tuple[int, str, Tuple[int, ...]]]
+
+
+class SharedArrays:
+    """A set of numpy arrays stored in a single shared memory block.
+
+    The process that publishes the arrays owns the block and must `close` it, the
+    other processes `attach` to it through its `handle` and get read-only views,
+    without copying the data.
+    """
+
+    __shm: SharedMemory
+    __layout: Layout
+    __owner: bool
+
+    def __init__(self, shm: SharedMemory, layout: Layout, owner: bool) -> None:
+        self.__shm = shm
+        self.__layout = layout
+        self.__owner = owner
+
+    @classmethod
+    def publish(cls, arrays: Mapping[str, np.ndarray]) -> "SharedArrays":
+        """Copy the arrays in a new shared memory block.
+
+        Args:
+            arrays (Mapping[str, np.ndarray]): the arrays to share, by name
+
+        Returns:
+            SharedArrays: the owner of the block
+
+        """
+        layout: Layout = {}
+        size = 0
+        for name, array in arrays.items():
+            size += -size % 16  # align every array on 16 bytes
+            layout[name] = (size, array.dtype.str, array.shape)
+            size += array.nbytes
+
+        shm = SharedMemory(create=True, size=max(size, 1))
+        shared = cls(shm, layout, owner=True)
+        for name, array in arrays.items():
+            shared.__view(name, writeable=True)[...] = array
+        return shared
+
+    @classmethod
+    def attach(cls, handle: Tuple[str, Layout]) -> "SharedArrays":
+        """Attach to a block published by another process.
+
+        Args:
+            handle (tuple): the `handle` of the published arrays
+
+        Returns:
+            SharedArrays: a reader of the block
+
+        """
+        name, layout = handle
+        # worker processes share the resource tracker of the publisher, so the
+        # block is registered once and unlinked by the publisher only
+        shm = SharedMemory(name=name)
+        return cls(shm, layout, owner=False)
+
+    @property
+    def handle(self) -> Tuple[str, Layout]:
+        """A picklable reference to the block, to be passed to `attach`."""
+        return self.__shm.name, self.__layout
+
+    def __view(self, name: str, writeable: bool = False) -> np.ndarray:
+        offset, dtype, shape = self.__layout[name]
+        array = np.ndarray(shape,
+                           dtype=np.dtype(dtype),
+                           buffer=self.__shm.buf,
+                           offset=offset)
+        array.flags.writeable = writeable
+        return array
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """Get read-only views on the shared arrays."""
+        return {name: self.__view(name) for name in self.__layout}
+
+    def close(self) -> None:
+        """Release the block, it is destroyed if this process owns it.
+
+        The views returned by `arrays` must not be used afterwards.
+        """
+        self.__shm.close()
+        if self.__owner:
+            self.__shm.unlink()
+
+
+@dataclass
+class WorkerMemory:
+    """The memory used by a process, in bytes."""
+
+    pid: int
+    rss: int
+    """The resident set size: pages shared with other processes are counted."""
+    pss: Optional[int] = None
+    """The proportional set size: shared pages are divided among the processes
+    sharing them, it is `None` where it is not available (non Linux systems)."""
+
+
+def memory_usage() -> WorkerMemory:
+    """Get the memory used by the current process."""
+    try:
+        usage = {}
+        with open("/proc/self/smaps_rollup", "r", encoding="utf-8") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    usage[key] = int(value.split()[0]) * 1024
+        return WorkerMemory(os.getpid(), usage["Rss"], usage.get("Pss"))
+    except (OSError, KeyError):
+        # peak RSS, in kilobytes on Linux and in bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return WorkerMemory(os.getpid(),
+                            max_rss if sys.platform == "darwin" else max_rss * 1024)
+
+
+@dataclass
+class WorkerUtilization:
+    """How long a worker process has been busy analyzing mails."""
+
+    pid: int
+    chunks: int = 0
+    """The chunks of mails analyzed."""
+    mails: int = 0
+    """The mails analyzed, including the ones that could not be analyzed."""
+    busy: float = 0.0
+    """The seconds spent analyzing mails."""
+    elapsed: float = 0.0
+    """The seconds since the pool received the first chunk."""
+
+    @property
+    def utilization(self) -> float:
+        """The fraction of the elapsed time the worker has been busy."""
+        return self.busy / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def plan_chunks(sized: Iterable[Tuple[str, int]],
+                jobs: int,
+                max_chunk: int = 64) -> Iterator[List[str]]:
+    """Split mails in chunks for a pool of `jobs` workers, the largest mails first.
+
+    A mail is analyzed in a time roughly proportional to its size: dispatching the
+    largest mails first leaves the small ones to fill the gaps at the end, instead of
+    a worker analyzing a huge mail while the others are idle. Each chunk holds about
+    half of the bytes left divided by `jobs` (guided self-scheduling): the first
+    chunks are large and cheap to dispatch, the last ones are small and balance the
+    load.
+
+    Args:
+        sized (Iterable[Tuple[str, int]]): the paths of the mails and their size in
+        bytes, consumed and sorted when the first chunk is requested
+        jobs (int): the number of workers
+        max_chunk (int): the maximum number of mails in a chunk
+
+    Yields:
+        list[str]: the paths of the mails of each chunk
+
+    """
+    ordered = sorted(sized, key=lambda item: (-item[1], item[0]))
+    remaining = sum(size for _, size in ordered)
+
+    chunk: List[str] = []
+    chunk_bytes = target = 0
+    for path, size in ordered:
+        if not chunk:
+            target = remaining // (jobs * 2)
+        chunk.append(path)
+        chunk_bytes += size
+        remaining -= size
+        if chunk_bytes >= target or len(chunk) >= max_chunk:
+            yield chunk
+            chunk, chunk_bytes = [], 0
+    if chunk:
+        yield chunk
+
+
+def preload_sentiment() -> None:
+    """Load the sentiment lexicon of TextBlob, it is otherwise loaded lazily by
+    every process on its first analysis."""
+    from textblob import TextBlob
+
+    _ = TextBlob("preload").sentiment
+
+
+@dataclass
+class _SpawnConfig:
+    wordlist: List[str]
+    model: Union[str, Tuple[str, Layout]]
+    features: Sequence[str]
+    cascade: Optional[Cascade]
+    template_cache: Optional[int]
+    max_bytes: Optional[int]
+    parser: str
+    resolver: Optional[ResolverCache]
+    networks: Optional[NetworkTable]
+    blocklists: Optional[Blocklists]
+
+
+@dataclass
+class _ChunkResult:
+    analyses: List[MailAnalysis]
+    verdicts: Optional[List[bool]]
+    invalid: List[str]
+    cascade: CascadeStats
+    templates: CacheStats
+    memory: WorkerMemory
+    busy: float
+    lookups: Dict[str, Lookup]
+
+
+# the state of a worker process, see `_init_worker`
+_analyzer: Optional[SpamAnalyzer] = None
+_shared: Optional[SharedArrays] = None
+
+
+def _init_worker(analyzer: Optional[SpamAnalyzer],
+                 config: Optional[_SpawnConfig]) -> None:
+    global _analyzer, _shared  # pylint: disable=global-statement
+
+    # interruptions are handled by the parent process, which stops submitting mails
+    # and then shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if analyzer is not None:
+        # forked: the analyzer loaded by the parent is inherited, not copied
+        _analyzer = analyzer
+        return
+
+    assert config is not None
+    if isinstance(config.model, str):
+        classifier = SpamClassifier(config.model, config.features)
+    else:
+        _shared = SharedArrays.attach(config.model)
+        classifier = SpamClassifier.from_model(CompiledForest(_shared.arrays()),
+                                               config.features)
+    _analyzer = SpamAnalyzer(config.wordlist,
+                             classifier,
+                             cascade=config.cascade,
+                             template_cache=_template_cache(config.template_cache),
+                             max_bytes=config.max_bytes,
+                             parser=config.parser,
+                             resolver=config.resolver,
+                             networks=config.networks,
+                             blocklists=config.blocklists)
+    preload_sentiment()
+
+
+async def _analyze_all(paths: Sequence[str], full: bool,
+                       skip_invalid: bool) -> Tuple[List[MailAnalysis], List[str]]:
+    assert _analyzer is not None
+    if not skip_invalid:
+        analyses = [_analyzer.analyze(path, full) for path in paths]
+        return await asyncio.gather(*analyses), []
+
+    emails, invalid = [], []
+    for path in paths:
+        email = SpamAnalyzer.parse(path, _analyzer.max_bytes, _analyzer.parser)
+        if SpamAnalyzer.is_analyzable(email):
+            emails.append((path, email))
+        else:
+            invalid.append(path)
+    await _analyzer.prefetch((email for _, email in emails), full)
+    analyses = [_analyzer.analyze_parsed(email, path, full) for path, email in emails]
+    return await asyncio.gather(*analyses), invalid
+
+
+def _template_cache(maxsize: Optional[int]) -> Optional[TemplateCache]:
+    return None if maxsize is None else TemplateCache(maxsize)
+
+
+def _analyze_chunk(paths: Sequence[str], classify: bool, full: bool,
+                   skip_invalid: bool) -> _ChunkResult:
+    assert _analyzer is not None
+    start = time.perf_counter()
+    stats = _analyzer.cascade_stats
+    header_only, complete = stats.header_only, stats.full
+    cache = _analyzer.template_cache
+    before = cache.stats() if cache is not None else CacheStats()
+
+    analyses, invalid = asyncio.run(_analyze_all(paths, full, skip_invalid))
+    verdicts = _analyzer.classify_multiple_input(analyses) if classify else None
+    after = cache.stats() if cache is not None else CacheStats()
+    resolver = _analyzer.resolver
+
+    return _ChunkResult(
+        analyses,
+        verdicts,
+        invalid,
+        CascadeStats(stats.header_only - header_only, stats.full - complete),
+        CacheStats(after.hits - before.hits, after.misses - before.misses),
+        memory_usage(),
+        time.perf_counter() - start,
+        resolver.pop_resolved() if resolver is not None else {},
+    )
+
+
+class AnalysisPool:
+    """A pool of processes analyzing and classifying mails, the model, the
+    wordlist and the sentiment lexicon are loaded once by the parent process and
+    shared with the workers.
+
+    Args:
+        wordlist (Iterable[str]): the spam wordlist
+        model (str, optional): the path of the model, by default the model shipped
+        with the package
+        jobs (int, optional): the number of worker processes, by default the number
+        of CPUs
+        cascade (Cascade, optional): the cascade configuration, see `Cascade`
+        start_method (str, optional): the `multiprocessing` start method, by default
+        `fork` where it is available
+        template_cache (int, optional): the size of the `TemplateCache` of each
+        worker, by default the workers do not cache the text checks
+        max_bytes (int, optional): the budget of the large-message mode, see
+        `SpamAnalyzer.parse`
+        parser (str): the parser backend, see `SpamAnalyzer.parse`
+        resolver (ResolverCache, optional): the cache of the DNS lookups, see
+        `SpamAnalyzer.prefetch`, each worker fills its own copy and its lookups are
+        merged into `resolver`
+        networks (NetworkTable, optional): the table of the IP ranges of the hops,
+        the workers share the pages of its file
+        blocklists (Blocklists, optional): the blocklists of the links and of the
+        attachments, the workers share the pages of their files
+
+    """
+
+    jobs: int
+    cascade_stats: CascadeStats
+    """How many of the analyzed mails took each path of the cascade."""
+    template_stats: CacheStats
+    """The lookups of the template caches of all the workers."""
+
+    def __init__(
+        self,
+        wordlist: Sequence[str],
+        model: Optional[str] = None,
+        jobs: Optional[int] = None,
+        cascade: Optional[Cascade] = None,
+        start_method: Optional[str] = None,
+        template_cache: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        parser: str = "mailparser",
+        resolver: Optional[ResolverCache] = None,
+        networks: Optional[NetworkTable] = None,
+        blocklists: Optional[Blocklists] = None,
+    ) -> None:
+        self.jobs = jobs or os.cpu_count() or 1
+        self.cascade_stats = CascadeStats()
+        self.template_stats = CacheStats()
+        self.__memory: Dict[int, WorkerMemory] = {}
+        self.__utilization: Dict[int, WorkerUtilization] = {}
+        self.__started: Optional[float] = None
+        self.__finished = 0.0
+        self.__shared: Optional[SharedArrays] = None
+        self.__resolver = resolver
+
+        if start_method is None:
+            methods = multiprocessing.get_all_start_methods()
+            start_method = "fork" if "fork" in methods else methods[0]
+        context = multiprocessing.get_context(start_method)
+
+        # load everything once, in the parent process
+        analyzer = SpamAnalyzer(wordlist,
+                                model,
+                                cascade=cascade,
+                                template_cache=_template_cache(template_cache),
+                                max_bytes=max_bytes,
+                                parser=parser,
+                                resolver=resolver,
+                                networks=networks,
+                                blocklists=blocklists)
+        classifier = analyzer.classifier
+        _ = analyzer.required_keys
+        preload_sentiment()
+
+        if start_method == "fork":
+            # the forked workers inherit the compiled public suffix list
+            default_trie()
+            initargs: tuple = (analyzer, None)
+        else:
+            shared_model: Union[str, Tuple[str, Layout]]
+            if isinstance(classifier.model, CompiledForest):
+                self.__shared = SharedArrays.publish(classifier.model.arrays)
+                shared_model = self.__shared.handle
+            else:
+                # pickled models cannot be shared, every worker loads its copy
+                shared_model = model if model is not None else default_model()
+            initargs = (None,
+                        _SpawnConfig(list(wordlist), shared_model, classifier.features,
+                                     cascade, template_cache, max_bytes, parser,
+                                     resolver, networks, blocklists))
+
+        self.__executor = ProcessPoolExecutor(max_workers=self.jobs,
+                                              mp_context=context,
+                                              initializer=_init_worker,
+                                              initargs=initargs)
+
+    def map(
+        self,
+        paths: Iterable[str],
+        chunksize: Optional[int] = None,
+        classify: bool = True,
+        full: bool = False,
+        on_invalid: Optional[Callable[[str], None]] = None,
+    ) -> Iterator[Tuple[MailAnalysis, Optional[bool]]]:
+        """Analyze and classify mails in the workers.
+
+        The paths are consumed lazily: at most two chunks per worker are submitted
+        ahead of the results, so the memory does not depend on the number of mails.
+
+        Args:
+            paths (Iterable[str]): the paths of the mails, it can be a generator
+            chunksize (int, optional): the number of mails sent to a worker at once,
+            by default a sequence is split in four chunks per worker and an iterable
+            in chunks of 32 mails
+            classify (bool): classify the mails, if `False` the verdicts are `None`
+            full (bool): perform every check, see `SpamAnalyzer.analyze`
+            on_invalid (Callable[[str], None], optional): if given, the mails that
+            cannot be analyzed (see `SpamAnalyzer.is_analyzable`) are skipped and
+            their path is passed to it
+
+        Yields:
+            tuple: the analysis of each mail and its verdict, in the input order
+
+        """
+        if chunksize is None:
+            chunksize = (max(1,
+                             len(paths) //
+                             (self.jobs * 4)) if isinstance(paths, Sized) else 32)
+        iterator = iter(paths)
+        chunks = iter(lambda: list(itertools.islice(iterator, chunksize)), [])
+
+        submitted: Deque[Future] = deque()
+        try:
+            for chunk in chunks:
+                submitted.append(self.__submit(chunk, classify, full, on_invalid))
+                if len(submitted) >= self.jobs * 2:
+                    yield from self.__collect(submitted.popleft(), on_invalid)
+            while submitted:
+                yield from self.__collect(submitted.popleft(), on_invalid)
+        finally:
+            for future in submitted:
+                future.cancel()
+
+    def map_chunks(
+        self,
+        chunks: Iterable[Sequence[str]],
+        classify: bool = True,
+        full: bool = False,
+        on_invalid: Optional[Callable[[str], None]] = None,
+    ) -> Iterator[Tuple[MailAnalysis, Optional[bool]]]:
+        """Analyze and classify chunks of mails in the workers, yielding the
+        results as soon as each chunk is complete.
+
+        Unlike `map` a slow chunk does not hold back the results of the following
+        ones, so the workers are never idle waiting for it: use it with the chunks
+        of `plan_chunks`. At most two chunks per worker are submitted ahead.
+
+        Args:
+            chunks (Iterable[Sequence[str]]): the chunks of paths, consumed lazily
+            classify (bool): classify the mails, if `False` the verdicts are `None`
+            full (bool): perform every check, see `SpamAnalyzer.analyze`
+            on_invalid (Callable[[str], None], optional): see `map`
+
+        Yields:
+            tuple: the analysis of each mail and its verdict, in the order the
+            chunks complete
+
+        """
+        chunks = iter(chunks)
+        pending: Set[Future] = set()
+        try:
+            while True:
+                for chunk in itertools.islice(chunks, self.jobs * 2 - len(pending)):
+                    pending.add(self.__submit(chunk, classify, full, on_invalid))
+                if not pending:
+                    return
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from self.__collect(future, on_invalid)
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def __submit(self, chunk: Sequence[str], classify: bool, full: bool,
+                 on_invalid: Optional[Callable[[str], None]]) -> Future:
+        if self.__started is None:
+            self.__started = time.perf_counter()
+        return self.__executor.submit(_analyze_chunk, chunk, classify, full, on_invalid
+                                      is not None)
+
+    def __collect(
+        self, future: Future, on_invalid: Optional[Callable[[str], None]]
+    ) -> Iterator[Tuple[MailAnalysis, Optional[bool]]]:
+        result: _ChunkResult = future.result()
+        self.__record(result)
+        if on_invalid is not None:
+            for path in result.invalid:
+                on_invalid(path)
+        verdicts = result.verdicts or [None] * len(result.analyses)
+        yield from zip(result.analyses, verdicts)
+
+    def __record(self, result: _ChunkResult) -> None:
+        self.__memory[result.memory.pid] = result.memory
+        self.__finished = time.perf_counter()
+
+        pid = result.memory.pid
+        utilization = self.__utilization.setdefault(pid, WorkerUtilization(pid))
+        utilization.chunks += 1
+        utilization.mails += len(result.analyses) + len(result.invalid)
+        utilization.busy += result.busy
+        self.cascade_stats.header_only += result.cascade.header_only
+        self.cascade_stats.full += result.cascade.full
+        self.template_stats.hits += result.templates.hits
+        self.template_stats.misses += result.templates.misses
+        if self.__resolver is not None:
+            # the lookups of the workers, so that the cache can be saved
+            self.__resolver.merge(result.lookups)
+
+    def memory_report(self) -> List[WorkerMemory]:
+        """Get the memory used by each worker, as measured after its last chunk of
+        mails, and by the parent process (the first element)."""
+        workers = sorted(self.__memory.values(), key=lambda m: m.pid)
+        return [memory_usage()] + workers
+
+    def utilization_report(self) -> List[WorkerUtilization]:
+        """Get how long each worker has been busy, from the submission of the first
+        chunk to the completion of the last one. Workers that never received a
+        chunk are not listed."""
+        elapsed = (self.__finished -
+                   self.__started if self.__started is not None else 0.0)
+        return [
+            replace(worker, elapsed=elapsed)
+            for worker in sorted(self.__utilization.values(), key=lambda u: u.pid)
+        ]
+
+    def close(self) -> None:
+        """Stop the workers and release the shared memory."""
+        self.__executor.shutdown()
+        if self.__shared is not None:
+            self.__shared.close()
+            self.__shared = None
+
+    def __enter__(self) -> "AnalysisPool":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
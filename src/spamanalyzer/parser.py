@@ -0,0 +1,180 @@
+"""A lightweight alternative to mailparser, built on the standard library parser.
+
+mailparser does much more than the analysis needs: it collects the defects of every
+part, parses every `Received` header, builds a dictionary (and a JSON) of the whole
+mail twice. `StdlibMail` parses a mail with `email.parser.BytesParser` and
+`policy.compat32` and exposes only the part of the `MailParser` interface used by
+`spamanalyzer.utils`, with the same values:
+
+- `headers`, decoded as mailparser does;
+- `received`, the first hop only;
+- `timezone`, the offset from UTC of the `Date` header;
+- `text_plain`, `text_html`, `text_not_managed` and `body`;
+- `attachments`, with the keys of the mailparser attachments.
+
+The backend is selected by the `parser` argument of `SpamAnalyzer`, see `PARSERS`.
+"""
+
+import base64
+from email.message import Message
+from email.parser import BytesParser
+from email.policy import compat32
+from functools import cached_property
+from typing import Any, Dict, List, Union
+
+import mailparser
+from mailparser.utils import (
+    convert_mail_date,
+    decode_header_part,
+    ported_string,
+    receiveds_parsing,
+)
+
+PARSERS = ("mailparser", "stdlib")
+"""The parser backends: `mailparser` (`MailParser`) or `stdlib` (`StdlibMail`)."""
+
+ParsedMail = Union[mailparser.MailParser, "StdlibMail"]
+"""A mail parsed by one of the `PARSERS`."""
+
+_PARSER = BytesParser(policy=compat32)
+
+
+class StdlibMail:
+    """A mail parsed by the standard library, see the module documentation.
+
+    Args:
+        message (Message): the parsed message
+
+    """
+
+    message: Message
+    truncated: bool = False
+    """`True` if the mail has been reduced by the large-message mode, see
+    `spamanalyzer.large`."""
+    original_size: int = 0
+    """The size of the mail file of a truncated mail, in bytes."""
+
+    def __init__(self, message: Message) -> None:
+        self.message = message
+        self.text_plain: List[str] = []
+        self.text_html: List[str] = []
+        self.text_not_managed: List[str] = []
+        self.attachments: List[Dict[str, Any]] = []
+        if len(message) == 0:
+            # as mailparser, a message without headers has no parts
+            return
+        for part in message.walk():
+            if not part.is_multipart():
+                self.__add_part(part)
+
+    @classmethod
+    def from_file(cls, email_path: str) -> "StdlibMail":
+        with open(email_path, "rb") as f:
+            return cls(_PARSER.parse(f))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "StdlibMail":
+        return cls(_PARSER.parsebytes(data))
+
+    @cached_property
+    def headers(self) -> Dict[str, str]:
+        """The decoded headers, the last one of the repeated headers."""
+        return {key: decode_header_part(value) for key, value in self.message.items()}
+
+    @cached_property
+    def received(self) -> List[Dict[str, Any]]:
+        """The first hop, i.e. the last `Received` header, parsed as by
+        `MailParser.received`; the list is empty if there is no such header."""
+        receiveds = self.message.get_all("received", [])
+        if not receiveds:
+            return []
+        return receiveds_parsing([decode_header_part(receiveds[-1])])
+
+    @property
+    def timezone(self) -> Union[str, int]:
+        """The offset from UTC of the `Date` header, e.g. `"+1.0"`, `0` if unknown."""
+        try:
+            return convert_mail_date(self.message.get("date"))[1]
+        except Exception:
+            return 0
+
+    @property
+    def body(self) -> str:
+        return "\n--- mail_boundary ---\n".join(self.text_plain + self.text_html +
+                                                self.text_not_managed)
+
+    def __add_part(self, part: Message) -> None:
+        # the same rules of `MailParser.parse`, without the defects
+        charset = part.get_content_charset("utf-8")
+        content_id = ported_string(part.get("content-id"))
+        subtype = ported_string(part.get_content_subtype())
+        filename = decode_header_part(part.get_filename())
+
+        if not filename and content_id and subtype not in ("html", "plain"):
+            filename = content_id
+        elif not filename and subtype == "rtf":
+            filename = "attachment.rtf"
+        if filename:
+            self.attachments.append(_attachment(part, filename, charset))
+            return
+
+        payload = part.get_payload(decode=True)
+        encoding = (part.get("content-transfer-encoding") or "").lower()
+        if not encoding or encoding in ("7bit", "8bit"):
+            # mailparser reads the file as UTF-8 and drops the invalid bytes
+            text = payload.decode("utf-8", errors="ignore")
+        else:
+            text = ported_string(payload, encoding=charset)
+        if not text:
+            return
+        if subtype == "html":
+            self.text_html.append(text)
+        elif subtype == "plain":
+            self.text_plain.append(text)
+        else:
+            self.text_not_managed.append(text)
+
+
+def _attachment(part: Message, filename: str, charset: str) -> Dict[str, Any]:
+    content_type = ported_string(part.get_content_type())
+    encoding = ported_string(part.get("content-transfer-encoding", "")).lower()
+    binary = True
+    # encoded payloads are kept as they are, see `spamanalyzer.attachments`
+    if encoding == "base64" or (encoding == "quoted-printable"
+                                and "application" in content_type):
+        payload = part.get_payload(decode=False)
+    elif "uuencode" in encoding:
+        payload = base64.b64encode(part.get_payload(decode=True)).decode("ascii")
+        encoding = "base64"
+    else:
+        payload = ported_string(part.get_payload(decode=True), encoding=charset)
+        binary = False
+    return {
+        "filename": filename,
+        "payload": payload,
+        "binary": binary,
+        "mail_content_type": content_type,
+        "content-id": ported_string(part.get("content-id")),
+        "content-disposition": ported_string(part.get("content-disposition")),
+        "charset": part.get_content_charset(),
+        "content_transfer_encoding": encoding,
+    }
+
+
+def parse_file(email_path: str, parser: str = "mailparser") -> ParsedMail:
+    """Parse a mail file with a backend of `PARSERS`.
+
+    Returns:
+        MailParser | StdlibMail: the parsed mail
+
+    """
+    if parser == "stdlib":
+        return StdlibMail.from_file(email_path)
+    return mailparser.parse_from_file(email_path)
+
+
+def parse_bytes(data: bytes, parser: str = "mailparser") -> ParsedMail:
+    """Parse a raw mail with a backend of `PARSERS`, see `parse_file`."""
+    if parser == "stdlib":
+        return StdlibMail.from_bytes(data)
+    return mailparser.parse_from_bytes(data)
@@ -0,0 +1,127 @@
+"""Find the organizational domain of a host name with the public suffix list.
+
+`mail.example.co.uk` and `smtp.example.co.uk` belong to the same organization,
+`example.co.uk`, although their names differ: the organizational (or registrable)
+domain of a name is its public suffix (`co.uk`, under which anyone can register a
+domain) plus one label. The public suffixes are listed by the
+[Public Suffix List](https://publicsuffix.org/), a copy of it is bundled with the
+package (`public_suffix_list.dat`) so that no network is needed.
+
+The rules of the list are compiled, once, in a trie of labels read from the top level
+domain down, so that the public suffix of a name is found in as many steps as its
+labels, whatever the number of rules:
+
+```python
+organizational_domain("mail.example.co.uk")  # "example.co.uk"
+```
+"""
+
+from functools import lru_cache
+from importlib import resources
+from typing import Dict, Iterable, List, Optional
+
+_RULE = ""
+"""The key marking the end of a rule in a node of the trie."""
+_EXCEPTION = "!"
+"""The key marking the end of an exception rule (`!www.ck`) in a node of the trie."""
+_WILDCARD = "*"
+
+Trie = Dict[str, "Trie"]
+
+
+def compile_rules(lines: Iterable[str]) -> Trie:
+    """Compile the rules of a public suffix list in a trie of labels.
+
+    Args:
+        lines (Iterable[str]): the lines of the list, comments and blank lines are
+        skipped
+
+    Returns:
+        dict: the root of the trie, each node maps the next label (from the right) to
+        a node
+
+    """
+    root: Trie = {}
+    for line in lines:
+        rule = line.split(None, 1)[0] if line.strip() else ""
+        if not rule or rule.startswith("//"):
+            continue
+        exception = rule.startswith("!")
+        node = root
+        for label in reversed(_ascii(rule.lstrip("!")).split(".")):
+            node = node.setdefault(label, {})
+        node[_EXCEPTION if exception else _RULE] = {}
+    return root
+
+
+@lru_cache(maxsize=1)
+def default_trie() -> Trie:
+    """The trie of the bundled public suffix list, compiled on first use."""
+    path = resources.files("spamanalyzer").joinpath("public_suffix_list.dat")
+    with path.open("r", encoding="utf-8") as f:
+        return compile_rules(f)
+
+
+def public_suffix_length(labels: List[str], trie: Optional[Trie] = None) -> int:
+    """Count the labels of the public suffix of a name.
+
+    Args:
+        labels (list[str]): the labels of the name, in lowercase, from the top level
+        domain down, e.g. `["uk", "co", "example", "mail"]`
+        trie (dict, optional): the compiled rules, by default the bundled list
+
+    Returns:
+        int: the number of labels of the public suffix, at least 1 (a top level
+        domain not in the list is a public suffix)
+
+    """
+    nodes = [default_trie() if trie is None else trie]
+    length = 1
+    for depth, label in enumerate(labels):
+        children = []
+        for node in nodes:
+            child = node.get(label)
+            if child is not None:
+                if _EXCEPTION in child:
+                    # the exception rules win, their suffix has one label less
+                    return depth
+                children.append(child)
+            wildcard = node.get(_WILDCARD)
+            if wildcard is not None:
+                children.append(wildcard)
+        if not children:
+            break
+        if any(_RULE in child for child in children):
+            length = depth + 1
+        nodes = children
+    return length
+
+
+@lru_cache(maxsize=65536)
+def organizational_domain(name: str) -> Optional[str]:
+    """Get the organizational domain of a host name.
+
+    Args:
+        name (str): the host name, e.g. `mail.example.co.uk`
+
+    Returns:
+        str | None: the public suffix of the name plus one label, in lowercase,
+        e.g. `example.co.uk`, `None` if the name is a public suffix
+
+    """
+    labels = name.lower().rstrip(".").split(".")
+    labels.reverse()
+    length = public_suffix_length(labels)
+    if length >= len(labels):
+        return None
+    return ".".join(reversed(labels[:length + 1]))
+
+
+def _ascii(rule: str) -> str:
+    # the list has the internationalized names in Unicode, the DNS names are ASCII
+    if rule.isascii():
+        return rule.lower()
+    try:
+        return rule.encode("idna").decode("ascii").lower()
+    except UnicodeError:
+        return rule.lower()
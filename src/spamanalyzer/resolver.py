@@ -0,0 +1,251 @@
+"""Resolve the addresses of the mail servers once per run.
+
+The only network lookups of the analysis are the reverse DNS lookups of the IP
+addresses whose domain is not written in the headers, mostly of the first
+`Received` hop (see `utils.from_domain_matches_received`). The mails of a run
+usually come from a few relays: without a cache the same address is resolved once
+per mail, one lookup after the other.
+
+A `ResolverCache` resolves each address once, the concurrent analyses of the same
+address wait for the same lookup, and `prefetch` resolves the addresses of a batch of
+mails concurrently before they are analyzed:
+
+```python
+resolver = ResolverCache(concurrency=64, timeout=5)
+analyzer = SpamAnalyzer(wordlist, resolver=resolver)
+await analyzer.prefetch(emails)
+```
+
+A failed or timed out lookup is cached as well, its domain is `unknown`.
+
+The cache can be saved to a SQLite file and loaded by another run: the lookups are
+valid for `ttl` seconds (`negative_ttl` for the failed ones), the expired ones are
+resolved again. A cache warmed on a connected machine can be shipped to hosts without
+DNS, where an `offline` cache never touches the network and answers from the saved
+lookups, even expired ones:
+
+```python
+resolver = ResolverCache.load("dns.sqlite", offline=True)
+```
+"""
+
+import asyncio
+import os
+import socket
+import sqlite3
+import time
+from contextlib import closing
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
+
+from spamanalyzer.stats import CacheStats
+
+DEFAULT_TTL = 7 * 24 * 3600
+"""The seconds a lookup is valid, the system resolver does not tell its TTL."""
+
+NEGATIVE_TTL = 3600
+"""The seconds a failed lookup is valid."""
+
+SCHEMA_VERSION = 1
+"""The version of the SQLite schema, a file of another version is ignored."""
+
+Lookup = Tuple[Optional[str], float]
+"""A host name (`None` if the lookup failed) and the time when it expires."""
+
+
+class ResolverCache:
+    """A cache of the reverse DNS lookups, for the mails analyzed in an event loop
+    at a time.
+
+    Args:
+        concurrency (int): the maximum number of lookups running at once, they run in
+        the default executor of the event loop, which bounds them as well
+        timeout (float, optional): the seconds after which a lookup is given up,
+        `None` waits for the system resolver
+        offline (bool): never resolve an address, the ones not cached are unknown
+        ttl (float): the seconds a lookup is valid
+        negative_ttl (float): the seconds a failed lookup is valid
+
+    """
+
+    concurrency: int
+    timeout: Optional[float]
+    offline: bool
+    ttl: float
+    negative_ttl: float
+
+    def __init__(self,
+                 concurrency: int = 64,
+                 timeout: Optional[float] = 5.0,
+                 offline: bool = False,
+                 ttl: float = DEFAULT_TTL,
+                 negative_ttl: float = NEGATIVE_TTL) -> None:
+        if concurrency <= 0:
+            raise ValueError("concurrency must be positive")
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.offline = offline
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.__lookups: Dict[str, Lookup] = {}
+        self.__resolved: Dict[str, Lookup] = {}
+        self.__pending: Dict[str, "asyncio.Future[Optional[str]]"] = {}
+        self.__slots: Optional[Tuple[Any, asyncio.Semaphore]] = None
+        self.__stats = CacheStats()
+
+    @classmethod
+    def load(cls,
+             path: str,
+             concurrency: int = 64,
+             timeout: Optional[float] = 5.0,
+             offline: bool = False,
+             ttl: float = DEFAULT_TTL,
+             negative_ttl: float = NEGATIVE_TTL) -> "ResolverCache":
+        """Load the lookups saved in a SQLite file, if the file does not exist an
+        empty cache is returned.
+
+        Args:
+            path (str): the path of the file
+            concurrency, timeout, offline, ttl, negative_ttl: see `ResolverCache`
+
+        Returns:
+            ResolverCache: the loaded cache
+
+        """
+        cache = cls(concurrency, timeout, offline, ttl, negative_ttl)
+        if not os.path.exists(path):
+            return cache
+        with closing(_connect(path)) as db, db:
+            if db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                return cache
+            for ip_addr, hostname, expires in db.execute(
+                    "SELECT ip, hostname, expires FROM reverse"):
+                cache.__lookups[ip_addr] = (hostname, expires)
+        return cache
+
+    def save(self, path: str) -> None:
+        """Write the lookups to a SQLite file, they are merged with the ones already
+        there, the latest lookup of an address is kept.
+
+        Args:
+            path (str): the path of the file, it is created if it does not exist
+
+        """
+        with closing(_connect(path)) as db, db:
+            if db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                db.execute("DROP TABLE IF EXISTS reverse")
+                db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            db.execute("CREATE TABLE IF NOT EXISTS reverse "
+                       "(ip TEXT PRIMARY KEY, hostname TEXT, expires REAL NOT NULL)")
+            db.executemany(
+                "INSERT INTO reverse VALUES (?, ?, ?) ON CONFLICT(ip) DO UPDATE "
+                "SET hostname = excluded.hostname, expires = excluded.expires "
+                "WHERE excluded.expires > reverse.expires",
+                [(ip_addr, hostname, expires)
+                 for ip_addr, (hostname, expires) in self.__lookups.items()])
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # the lookups in flight belong to the event loop of this process
+        state = self.__dict__.copy()
+        state["_ResolverCache__pending"] = {}
+        state["_ResolverCache__slots"] = None
+        return state
+
+    def __contains__(self, ip_addr: str) -> bool:
+        return self.__get(ip_addr) is not None
+
+    def __len__(self) -> int:
+        return len(self.__lookups)
+
+    def stats(self) -> CacheStats:
+        """Get the hits and misses counted so far, a lookup joining one in flight is
+        a hit."""
+        return CacheStats(self.__stats.hits, self.__stats.misses)
+
+    def pop_resolved(self) -> Dict[str, Lookup]:
+        """Get the lookups performed since the last call, e.g. to `merge` the ones of
+        a worker process into the cache of the parent process."""
+        resolved, self.__resolved = self.__resolved, {}
+        return resolved
+
+    def merge(self, lookups: Mapping[str, Lookup]) -> None:
+        """Add the lookups of another cache, see `pop_resolved`."""
+        for ip_addr, (hostname, expires) in lookups.items():
+            current = self.__lookups.get(ip_addr)
+            if current is None or current[1] < expires:
+                self.__lookups[ip_addr] = (hostname, expires)
+
+    async def reverse(self, ip_addr: str) -> Optional[str]:
+        """Get the host name of an IP address, resolving it if it is not cached.
+
+        Returns:
+            str | None: the host name, `None` if the lookup failed or if the address
+            is not cached by an `offline` cache
+
+        """
+        lookup = self.__get(ip_addr)
+        if lookup is not None:
+            self.__stats.hits += 1
+            return lookup[0]
+        if self.offline:
+            self.__stats.misses += 1
+            return None
+        loop = asyncio.get_running_loop()
+        future = self.__pending.get(ip_addr)
+        if future is None or future.get_loop() is not loop:
+            self.__stats.misses += 1
+            future = loop.create_task(self.__resolve(ip_addr))
+            self.__pending[ip_addr] = future
+        else:
+            self.__stats.hits += 1
+        # a cancelled analysis must not cancel a lookup awaited by the others
+        return await asyncio.shield(future)
+
+    async def prefetch(self, ip_addrs: Iterable[str]) -> int:
+        """Resolve concurrently the addresses that are not cached yet.
+
+        Args:
+            ip_addrs (Iterable[str]): the addresses, they may be repeated
+
+        Returns:
+            int: the number of addresses resolved, none if the cache is `offline`
+
+        """
+        if self.offline:
+            return 0
+        missing = {ip_addr for ip_addr in ip_addrs if ip_addr not in self}
+        await asyncio.gather(*(self.reverse(ip_addr) for ip_addr in missing))
+        return len(missing)
+
+    def __get(self, ip_addr: str) -> Optional[Lookup]:
+        lookup = self.__lookups.get(ip_addr)
+        if lookup is None or (not self.offline and lookup[1] <= time.time()):
+            return None
+        return lookup
+
+    async def __resolve(self, ip_addr: str) -> Optional[str]:
+        hostname: Optional[str]
+        try:
+            async with self.__semaphore():
+                hostname, _, _ = await asyncio.wait_for(
+                    asyncio.to_thread(socket.gethostbyaddr, ip_addr), self.timeout)
+        except Exception:
+            hostname = None
+        finally:
+            self.__pending.pop(ip_addr, None)
+        ttl = self.ttl if hostname is not None else self.negative_ttl
+        lookup = (hostname, time.time() + ttl)
+        self.__lookups[ip_addr] = self.__resolved[ip_addr] = lookup
+        return hostname
+
+    def __semaphore(self) -> asyncio.Semaphore:
+        # a semaphore belongs to an event loop, e.g. each chunk of `AnalysisPool`
+        # runs in a new one
+        loop = asyncio.get_running_loop()
+        if self.__slots is None or self.__slots[0] is not loop:
+            self.__slots = (loop, asyncio.Semaphore(self.concurrency))
+        return self.__slots[1]
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    # the cache is written by a single process at a time, the others wait for it
+    return sqlite3.connect(path, timeout=30)
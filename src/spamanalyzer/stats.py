@@ -0,0 +1,18 @@
+"""The statistics of the caches of the analysis, e.g. `TemplateCache` and
+`ResolverCache`."""
+
+from dataclasses import dataclass
+
+
+@dataclass
+class CacheStats:
+    """The lookups of a cache."""
+
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """The fraction of the lookups that found an entry."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
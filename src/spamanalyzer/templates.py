@@ -0,0 +1,97 @@
+"""Cache the text analysis of the bodies built from the same template.
+
+Newsletters and notifications are rendered from a few templates and differ only in
+personalized fields, yet the extraction of the text from the HTML and the sentiment
+analysis are the most expensive checks of a body. `TemplateCache` keeps their results
+for the most recently seen bodies, keyed by a hash of the body, so that
+`spamanalyzer.utils.inspect_body` computes them once per template:
+
+```python
+analyzer = SpamAnalyzer(wordlist, template_cache=TemplateCache(4096))
+...
+print(analyzer.template_cache.stats().hit_rate)
+```
+
+The key depends on the body only, never on the headers. `inspect_body` looks the
+body up after lowering it and removing its links, where tracking codes usually are:
+a personalized link does not defeat the cache. The key is the whole text the checks
+are computed on, so a hit gives the values of an analysis without the cache.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from spamanalyzer.stats import CacheStats
+
+
+@dataclass
+class TemplateEntry:
+    """The results of the text checks of a body, `None` until computed."""
+
+    text: str
+    """The text extracted from the body."""
+    polarity: Optional[float] = None
+    subjectivity: Optional[float] = None
+    bad_words: Optional[float] = None
+    """The percentage of words of the wordlist, see `utils.percentage_of_bad_words`."""
+
+
+class TemplateCache:
+    """A bounded least recently used cache of `TemplateEntry`, safe to share among
+    threads.
+
+    The bad words percentage depends on the wordlist: a cache must not be shared by
+    analyzers with different wordlists.
+
+    Args:
+        maxsize (int): the maximum number of entries, the least recently used one is
+        evicted when it is exceeded
+
+    """
+
+    maxsize: int
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self.__entries: "OrderedDict[bytes, TemplateEntry]" = OrderedDict()
+        self.__stats = CacheStats()
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def key(body: str) -> bytes:
+        """Hash a body, e.g. lowered and without its links, see `inspect_body`."""
+        return hashlib.blake2b(body.encode(errors="surrogatepass"),
+                               digest_size=16).digest()
+
+    def get(self, key: bytes) -> Optional[TemplateEntry]:
+        """Get the entry of a key, marking it as the most recently used."""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.__stats.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.__stats.hits += 1
+            return entry
+
+    def put(self, key: bytes, entry: TemplateEntry) -> None:
+        """Add or replace an entry, evicting the least recently used one if the cache
+        is full."""
+        with self.__lock:
+            self.__entries[key] = entry
+            self.__entries.move_to_end(key)
+            if len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+
+    def stats(self) -> CacheStats:
+        """Get the hits and misses counted so far."""
+        with self.__lock:
+            return CacheStats(self.__stats.hits, self.__stats.misses)
+
+    def __len__(self) -> int:
+        return len(self.__entries)
@@ -1,12 +1,34 @@
+import ipaddress
 import re
+import socket
+import time
+from dataclasses import dataclass
 from enum import Enum
-from typing import Any, Iterable, List, Literal, Mapping, Sequence, Union
+from typing import (
+    Any,
+    Callable,
+    Collection,
+    Iterable,
+    List,
+    Literal,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 from bs4 import BeautifulSoup
 from mailparser import MailParser
 
+from spamanalyzer.attachments import inspect_attachment, payload_sha256
+from spamanalyzer.auth import AuthResults, parse_auth_results
+from spamanalyzer.blocklist import Blocklist
 from spamanalyzer.date import Date
 from spamanalyzer.domain import Domain
+from spamanalyzer.networks import NetworkTable
+from spamanalyzer.resolver import ResolverCache
+from spamanalyzer.templates import TemplateCache, TemplateEntry
 
 
 class Regex(Enum):
@@ -26,15 +48,102 @@ class Regex(Enum):
     HTML_TAG = re.compile(r"<[^>]+>")
     HTML_PAIR_TAG = re.compile(r"<\s*(\w+)[^>]*>(.*?)<\s*/\s*\1\s*>", re.DOTALL)
     IMAGE_TAG = re.compile(r"<\s*img", re.DOTALL)
-
-
-async def inspect_headers(email: MailParser, wordlist: Iterable[str]):
+    HOP_FROM = re.compile(r"^\s*from\s(.*?)(?:\bby\b|;|$)", re.DOTALL | re.IGNORECASE)
+    HOP_ADDRESS = re.compile(r"\[(?:IPv6:)?([0-9A-Fa-f:.]+)\]")
+
+
+HEADER_KEYS = (
+    "has_spf",
+    "has_dkim",
+    "has_dmarc",
+    "domain_matches",
+    "auth_warn",
+    "has_suspect_subject",
+    "subject_is_uppercase",
+    "received_date",
+    "send_date",
+)
+"""The keys of the dictionary returned by `inspect_headers`."""
+
+NETWORK_KEYS = ("origin_asn", "origin_network", "received_asns")
+"""The keys read from a `NetworkTable`, they are added to the `HEADER_KEYS` only
+when there is a table."""
+
+BODY_KEYS = (
+    "has_links",
+    "has_mailto",
+    "has_images",
+    "https_only",
+    "text_polarity",
+    "text_subjectivity",
+    "contains_script",
+    "is_uppercase",
+    "forbidden_words_percentage",
+    "contains_form",
+    "contains_html",
+    "has_blocked_links",
+)
+"""The keys of the dictionary returned by `inspect_body`."""
+
+ATTACHMENT_KEYS = ("has_attachments", "attachment_is_executable",
+                   "has_blocked_attachments")
+"""The keys of the dictionary returned by `inspect_attachments`."""
+
+TEXT_KEYS = ("is_uppercase", "text_polarity", "text_subjectivity",
+             "forbidden_words_percentage")
+"""The keys of `BODY_KEYS` computed from the text of the body, the others look for
+HTML elements and links."""
+
+MIN_PLAIN_SHARE = 0.1
+"""The minimum size of the plain text version of a body, relative to the size of its
+HTML version, for its text to be analyzed instead of the text of the HTML."""
+
+_BOUNDARY = "\n--- mail_boundary ---\n"  # the separator of the parts in `email.body`
+
+
+@dataclass
+class BodyPart:
+    """A text part of a mail and how it has been analyzed by `inspect_parts`."""
+
+    content_type: str
+    """`text/plain`, `text/html` or `text/other` for the other text parts."""
+    size: int
+    """The number of characters of the part."""
+    role: str
+    """`all` if every check ran on the part, `text` or `html` if only the text or
+    the HTML checks did, `skipped` for an alternative version not analyzed."""
+    elapsed: float
+    """The seconds spent analyzing the part, the time of parts analyzed together is
+    split by their size."""
+
+
+def _wanted(keys: Optional[Collection[str]], *candidates: str) -> bool:
+    return keys is None or any(key in keys for key in candidates)
+
+
+async def inspect_headers(email: MailParser,
+                          wordlist: Iterable[str],
+                          keys: Optional[Collection[str]] = None,
+                          auth: Optional[AuthResults] = None,
+                          resolver: Optional[ResolverCache] = None,
+                          networks: Optional[NetworkTable] = None,
+                          pattern: Optional["re.Pattern[str]"] = None):
     """A detailed analysis of the email headers.
 
     Args:
         headers (dict): a dictionary containing parsed email headers
         wordlist (Iterable[str]): a list of words to be used as a spam filter in the
         subject field
+        keys (Collection[str], optional): the keys of `HEADER_KEYS` to compute, the
+        others are set to `None` and their checks are skipped (e.g. the DNS lookup of
+        `domain_matches`), by default all the keys are computed
+        auth (AuthResults, optional): the authentication results of the mail, they
+        are parsed if not given
+        resolver (ResolverCache, optional): a cache of the DNS lookups
+        networks (NetworkTable, optional): the table of the IP ranges of the
+        `NETWORK_KEYS`, without it they are not in the result
+        pattern (re.Pattern, optional): the wordlist compiled by `wordlist_pattern`,
+        it is compiled if not given
 
     Returns:
         tuple: a tuple containing all the results of the analysis
@@ -49,26 +158,147 @@ async def inspect_headers(email: MailParser, wordlist: Iterable[str]):
       in the subject
     - send_year (int): the year in which the email was sent (in future versions should
       be a datetime object)
+    - origin_asn (int): the autonomous system of the first public address of the
+      `Received` hops, see `received_networks`
+    - origin_network (str): the name of that autonomous system
+    - received_asns (int): the number of autonomous systems of the hops
+
+    """
+
+    result = inspect_local_headers(email, wordlist, keys, auth, networks, pattern)
+    if _wanted(keys, "domain_matches"):
+        result["domain_matches"] = await from_domain_matches_received(email, resolver)
+
+    return result
+
+
+def inspect_local_headers(
+        email: MailParser,
+        wordlist: Iterable[str],
+        keys: Optional[Collection[str]] = None,
+        auth: Optional[AuthResults] = None,
+        networks: Optional[NetworkTable] = None,
+        pattern: Optional["re.Pattern[str]"] = None) -> dict[str, Any]:
+    """The checks of `inspect_headers` that do not need the network, that is all of
+    them but `domain_matches`, which is left to `None`.
+
+    It is a synchronous, CPU bound function: it can be run in an executor while the
+    DNS lookups of `from_domain_matches_received` are awaited.
+
+    Args:
+        email (MailParser): the parsed email
+        wordlist (Iterable[str]): the spam wordlist, searched in the subject
+        keys (Collection[str], optional): the keys of `HEADER_KEYS` to compute
+        auth (AuthResults, optional): the authentication results of the mail, they
+        are parsed if not given
+        networks (NetworkTable, optional): the table of the IP ranges of the
+        `NETWORK_KEYS`, without it they are not in the result
+        pattern (re.Pattern, optional): see `inspect_headers`
+
+    Returns:
+        dict: the headers analysis, with `domain_matches` set to `None`
 
     """
 
     headers = email.headers
+    result: dict[str, Any] = dict.fromkeys(HEADER_KEYS)
+    if networks is not None:
+        result.update(dict.fromkeys(NETWORK_KEYS))
+
+    if _wanted(keys, "has_spf", "has_dkim", "has_dmarc", "auth_warn"):
+        if auth is None:
+            # every instance of the repeated headers, not only the last one
+            auth = parse_auth_results(email.message)
+        # the features of the model read the last header of each kind, the results
+        # of every hop are kept in `MailAnalysis.auth`
+        if _wanted(keys, "has_spf"):
+            result["has_spf"] = spf_pass(auth.last_values)
+        if _wanted(keys, "has_dkim"):
+            result["has_dkim"] = auth.dkim_signed or dkim_pass(auth.last_values)
+        if _wanted(keys, "has_dmarc"):
+            result["has_dmarc"] = dmarc_pass(auth.last_values)
+        if _wanted(keys, "auth_warn"):
+            result["auth_warn"] = auth.warning
+    if _wanted(keys, "has_suspect_subject", "subject_is_uppercase"):
+        (result["has_suspect_subject"],
+         result["subject_is_uppercase"]) = analyze_subject(headers, wordlist, pattern)
+    if _wanted(keys, "received_date"):
+        result["received_date"] = parse_date(email.received[0], email.timezone)
+    if _wanted(keys, "send_date"):
+        result["send_date"] = parse_date(headers, email.timezone)
+    if networks is not None and _wanted(keys, *NETWORK_KEYS):
+        result.update(received_networks(email, networks))
+
+    return result
+
+
+def received_addresses(email: MailParser) -> List[str]:
+    """The addresses of the servers that relayed a mail, the one in the `from`
+    clause of each `Received` header, from the first hop to the last one.
 
-    has_suspect_subject, subject_is_uppercase = analyze_subject(headers, wordlist)
-    send_date = parse_date(headers, email.timezone)
-    received_date = parse_date(email.received[0], email.timezone)
+    Args:
+        email (MailParser): the parsed email
 
-    return {
-        "has_spf": spf_pass(headers),
-        "has_dkim": dkim_pass(headers),
-        "has_dmarc": dmarc_pass(headers),
-        "domain_matches": await from_domain_matches_received(email),
-        "auth_warn": has_auth_warning(headers),
-        "has_suspect_subject": has_suspect_subject,
-        "subject_is_uppercase": subject_is_uppercase,
-        "received_date": received_date,
-        "send_date": send_date,
-    }
+    Returns:
+        list: the IPv4 and IPv6 addresses, the hops without one are skipped
+
+    """
+    addresses = []
+    # the headers are added on top of the previous ones
+    for header in reversed(email.message.get_all("received", [])):
+        match = Regex.HOP_FROM.value.match(str(header))
+        if match is None:
+            continue
+        clause = match.group(1)
+        # the address of the connection comes after the name given by the sender
+        candidates = (Regex.HOP_ADDRESS.value.findall(clause)
+                      or Regex.IP.value.findall(clause))
+        for candidate in reversed(candidates):
+            if _is_address(candidate):
+                addresses.append(candidate)
+                break
+    return addresses
+
+
+def _is_address(candidate: str) -> bool:
+    # `socket` validates an address several times faster than `ipaddress`
+    try:
+        socket.inet_pton(socket.AF_INET6 if ":" in candidate else socket.AF_INET,
+                         candidate)
+    except OSError:
+        return False
+    return True
+
+
+def received_networks(email: MailParser, networks: NetworkTable) -> dict[str, Any]:
+    """Look up the networks of the `Received` hops of a mail in an offline table.
+
+    Args:
+        email (MailParser): the parsed email
+        networks (NetworkTable): the table of the IP ranges
+
+    Returns:
+        dict: the `NETWORK_KEYS`: the autonomous system (`origin_asn`) and its name
+        (`origin_network`) of the first public address of the hops, the private
+        addresses of the networks of the sender are skipped, and the number of
+        autonomous systems of all the hops in the table (`received_asns`)
+
+    """
+    result: dict[str, Any] = dict.fromkeys(NETWORK_KEYS)
+    asns = set()
+    for address in received_addresses(email):
+        if result["origin_asn"] is None and ipaddress.ip_address(address).is_global:
+            network = networks.lookup(address)
+            if network is not None:
+                result["origin_asn"] = network.asn
+                result["origin_network"] = network.name
+            asn = None if network is None else network.asn
+        else:
+            asn = networks.asn(address)
+        if asn is not None:
+            asns.add(asn)
+    result["received_asns"] = len(asns)
+    return result
 
 
 def spf_pass(headers: Mapping[str, Any]) -> bool:
@@ -109,13 +339,16 @@ def has_auth_warning(headers: Mapping[str, Any]) -> bool:
 
 
 def analyze_subject(headers: Mapping[str, Any],
-                    wordlist: Iterable[str]) -> tuple[bool, bool]:
+                    wordlist: Iterable[str],
+                    pattern: Optional["re.Pattern[str]"] = None) -> tuple[bool, bool]:
     """Checks if the email has gappy words or forbidden words in the subject.
 
     Args:
         headers (dict): a dictionary containing parsed email headers
         wordlist (list[str]): a list of words to be used as a spam filter in the subject
         field
+        pattern (re.Pattern, optional): the wordlist compiled by `wordlist_pattern`,
+        an analyzer compiles it once, it is compiled if not given
 
     """
     subject: str = headers.get("Subject")  # type: ignore
@@ -124,15 +357,42 @@ def analyze_subject(headers: Mapping[str, Any],
         if matches is not None:
             return True, subject.isupper()
 
-        for word in wordlist:
-            if word in subject:
-                return True, subject.isupper()
+        if pattern is None:
+            pattern = wordlist_pattern(wordlist)
+        if pattern.search(subject) is not None:
+            return True, subject.isupper()
 
         return False, subject.isupper()
 
     return False, False
 
 
+def wordlist_pattern(wordlist: Iterable[str]) -> "re.Pattern[str]":
+    """A regular expression matching any word of the wordlist in a text.
+
+    The words are arranged in a trie, so that a text is scanned once instead of once
+    per word. Compiling it costs more than a search: `SpamAnalyzer` compiles its
+    wordlist once, see `SpamAnalyzer.wordlist_pattern`.
+    """
+    trie: dict[str, Any] = {}
+    for word in wordlist:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    return re.compile(_trie_regex(trie) if trie else r"(?!)")
+
+
+def _trie_regex(node: dict[str, Any]) -> str:
+    if "" in node:
+        # a word ends here, the longer ones add nothing to a search
+        return ""
+    branches = [re.escape(char) + _trie_regex(child) for char, child in node.items()]
+    if len(branches) == 1:
+        return branches[0]
+    return "(?:" + "|".join(branches) + ")"
+
+
 def parse_date(headers: Mapping[str, Any], timezone: Union[str, Literal[0]]):
     """Date format should follow RFC 2822, this function expects a date in the format:
     "Wed, 21 Oct 2015 07:28:00 -0700", and returns a tuple where:
@@ -156,22 +416,58 @@ def parse_date(headers: Mapping[str, Any], timezone: Union[str, Literal[0]]):
     return Date(date, tz=int(float(timezone)))
 
 
-async def from_domain_matches_received(email: MailParser) -> bool:
-    email_domain = await get_domain(email.headers.get("From"))  # type: ignore
+async def from_domain_matches_received(email: MailParser,
+                                       resolver: Optional[ResolverCache] = None
+                                       ) -> bool:
+    email_domain = await get_domain(email.headers.get("From"), resolver)  # type: ignore
     try:
-        server_domain = await get_domain(email.received[0].get("from"))
+        server_domain = await get_domain(email.received[0].get("from"), resolver)
     except Exception:
         # server_domain = get_domain(email.received[0].get('by'))
         server_domain = await get_domain("unknown")
 
-    return email_domain == server_domain
+    # `mail.example.co.uk` and `smtp.example.co.uk` belong to the same organization
+    return email_domain.organizational_domain() == server_domain.organizational_domain()
+
 
+def reverse_lookups(email: MailParser) -> List[str]:
+    """The IP addresses that `from_domain_matches_received` resolves to check a mail,
+    the ones of the `From` header and of the first hop without a domain name.
 
-async def get_domain(field: str):
+    Args:
+        email (MailParser): the parsed email
+
+    Returns:
+        list: the addresses, they can be resolved in advance (see
+        `ResolverCache.prefetch`)
+
+    """
+    fields = [email.headers.get("From")]
+    if email.received:
+        fields.append(email.received[0].get("from"))
+    return [
+        ip_address for ip_address in map(_lookup_address, fields)
+        if ip_address is not None
+    ]
+
+
+def _lookup_address(field: Any) -> Optional[str]:
+    # the address `get_domain` resolves, if it resolves one
+    if not isinstance(field, str) or "unknown" in field:
+        return None
+    if Regex.DOMAIN.value.search(field):
+        return None
+    ip_match = Regex.IP.value.search(field)
+    return ip_match.group() if ip_match else None
+
+
+async def get_domain(field: str, resolver: Optional[ResolverCache] = None):
     """Extracts the domain from a field.
 
     Args:
         field (str): a string expected to contain a domain
+        resolver (ResolverCache, optional): a cache of the lookups of the IP
+        addresses
 
     Returns:
         Domain: a Domain object containing the domain name and the TLD
@@ -180,29 +476,42 @@ async def get_domain(field: str):
     # TODO: should take in consideration only the string before 'by word'
 
     if "unknown" in field:
-        return Domain("unknown")
+        return Domain.intern("unknown")
 
     domain_match = Regex.DOMAIN.value.search(field)
 
     if domain_match:
         domain_name = field[domain_match.start():domain_match.end()]
-        return Domain(domain_name)
+        return Domain.intern(domain_name)
 
     ip_match = Regex.IP.value.search(field)
     if ip_match:
         ip_address = field[ip_match.start():ip_match.end()]
-        return await Domain.from_ip(ip_address)
+        return await Domain.from_ip(ip_address, resolver)
 
-    return Domain("unknown")
+    return Domain.intern("unknown")
 
 
-def inspect_body(body: str, wordlist: Iterable[str], domain) -> dict[str, Any]:
+def inspect_body(body: str,
+                 wordlist: Iterable[str],
+                 domain: Optional[Domain] = None,
+                 keys: Optional[Collection[str]] = None,
+                 cache: Optional[TemplateCache] = None,
+                 blocklist: Optional[Blocklist] = None) -> dict[str, Any]:
     """A detailed analysis of the email body.
 
     Args:
         body (str): the body of the email
         wordlist (list[str]): a list of words to be used as a spam filter in the body
-        domain (Domain): the domain of the sender
+        domain (Domain, optional): the domain of the sender, it is not used yet
+        keys (Collection[str], optional): the keys of `BODY_KEYS` to compute, the
+        others are set to `None` and their checks are skipped (e.g. the HTML parsing
+        and the sentiment analysis), by default all the keys are computed
+        cache (TemplateCache, optional): where the extracted text, the sentiment and
+        the bad words percentage of the bodies already seen are kept, it must be used
+        with a single wordlist
+        blocklist (Blocklist, optional): the blocked domains of the links, without
+        it `has_blocked_links` is `None`
 
     Returns:
         dict: a dictionary containing the following information:
@@ -212,42 +521,152 @@ def inspect_body(body: str, wordlist: Iterable[str], domain) -> dict[str, Any]:
     - forbidden_words_percentage (float): the percentage of forbidden words in the body
     - has_form (bool): True if the email has a form
     - contains_html (bool): True if the email contains html tags
+    - has_blocked_links (bool): True if the domain of a link is in the blocklist
 
     """
     from textblob import TextBlob  # FIXME: moved here for testing purposes
 
-    is_uppercase = is_upper(body)
+    result: dict[str, Any] = dict.fromkeys(BODY_KEYS)
+    needs_text = _wanted(keys, "text_polarity", "text_subjectivity",
+                         "forbidden_words_percentage")
+    # images, scripts and text are searched in the body without links
+    needs_stripped_body = needs_text or _wanted(keys, "has_images", "contains_script")
+    needs_blocklist = blocklist is not None and _wanted(keys, "has_blocked_links")
+
+    if _wanted(keys, "is_uppercase"):
+        result["is_uppercase"] = is_upper(body)
     body = body.lower()
-    link_list = get_links_from_str(body)
-    links = check_links(body)
-    has_form = has_html_form(body)
-    contains_html = has_html(body)
-
-    if links["has_links"]:
-        for link in link_list:
-            body = body.replace(link, "")
-
-    if contains_html:
-        parsed_body = parse_html(body)
-        blob = TextBlob(parsed_body)
-        forbidden_words_percentage = percentage_of_bad_words(parsed_body, wordlist)
-    else:
-        blob = TextBlob(body)
-        forbidden_words_percentage = percentage_of_bad_words(body, wordlist)
+    if _wanted(keys, "contains_form"):
+        result["contains_form"] = has_html_form(body)
+    if needs_text or _wanted(keys, "contains_html"):
+        result["contains_html"] = has_html(body)
+
+    if needs_stripped_body or needs_blocklist or _wanted(keys, "has_links",
+                                                         "has_mailto", "https_only"):
+        link_list = get_links_from_str(body)
+        result["has_links"] = link_list != []
+        result["has_mailto"] = has_mailto_links(body)
+        result["https_only"] = https_only(link_list)
+        if needs_blocklist:
+            result["has_blocked_links"] = blocked_links(link_list,
+                                                        blocklist) != []  # type: ignore
+
+        if needs_stripped_body and result["has_links"]:
+            for link in link_list:
+                body = body.replace(link, "")
+
+    if _wanted(keys, "has_images"):
+        result["has_images"] = has_images(body)
+    if _wanted(keys, "contains_script"):
+        result["contains_script"] = has_script_tag(body)
+
+    if needs_text:
+        key = entry = None
+        if cache is not None:
+            key = TemplateCache.key(body)
+            entry = cache.get(key)
+        if entry is None:
+            entry = TemplateEntry(parse_html(body) if result["contains_html"] else body)
+
+        if _wanted(keys, "text_polarity", "text_subjectivity"):
+            if entry.polarity is None:
+                blob = TextBlob(entry.text)
+                entry.polarity = blob.sentiment.polarity  # type: ignore
+                entry.subjectivity = blob.sentiment.subjectivity  # type: ignore
+            result["text_polarity"] = entry.polarity
+            result["text_subjectivity"] = entry.subjectivity
+        if _wanted(keys, "forbidden_words_percentage"):
+            if entry.bad_words is None:
+                entry.bad_words = percentage_of_bad_words(entry.text, wordlist)
+            result["forbidden_words_percentage"] = entry.bad_words
+
+        if cache is not None:
+            cache.put(key, entry)  # type: ignore
+
+    return result
+
+
+def inspect_parts(
+    email: MailParser,
+    wordlist: Iterable[str],
+    keys: Optional[Collection[str]] = None,
+    cache: Optional[TemplateCache] = None,
+    blocklist: Optional[Blocklist] = None,
+) -> Tuple[dict[str, Any], List[BodyPart]]:
+    """Analyze the body of an email part by part, see `inspect_body`.
+
+    A mail with both a plain text and an HTML version (`multipart/alternative`) has
+    the same content twice: the HTML checks and the links run on the HTML parts only,
+    the text checks (`TEXT_KEYS`) on the plain text parts only, so that the HTML is
+    never converted to text. If the plain text is a stub, shorter than
+    `MIN_PLAIN_SHARE` of the HTML, only the HTML is analyzed. A mail with a single
+    version is analyzed as a whole, as by `inspect_body`.
 
-    return {
-        "has_links": links["has_links"],
-        "has_mailto": links["mailto"],
-        "has_images": has_images(body),
-        "https_only": links["https_only"],
-        "text_polarity": blob.sentiment.polarity,  # type: ignore
-        "text_subjectivity": blob.sentiment.subjectivity,  # type: ignore
-        "contains_script": has_script_tag(body),
-        "is_uppercase": is_uppercase,
-        "forbidden_words_percentage": forbidden_words_percentage,
-        "contains_form": has_form,
-        "contains_html": contains_html,
-    }
+    Args:
+        email (MailParser): the parsed email
+        wordlist (list[str]): a list of words to be used as a spam filter in the body
+        keys (Collection[str], optional): the keys of `BODY_KEYS` to compute
+        cache (TemplateCache, optional): see `inspect_body`
+        blocklist (Blocklist, optional): see `inspect_body`
+
+    Returns:
+        tuple: the body analysis, as returned by `inspect_body`, and its parts
+
+    """
+    text_plain = [("text/plain", part) for part in email.text_plain]
+    other = [("text/other", part) for part in email.text_not_managed]
+    html = [("text/html", part) for part in email.text_html]
+    plain = text_plain + other
+
+    if not plain or not html:
+        # the parts in the order of `email.body`
+        return _timed(text_plain + html + other, "all", inspect_body, email.body,
+                      wordlist, None, keys, cache, blocklist)
+
+    plain_size = sum(len(part) for _, part in plain)
+    html_size = sum(len(part) for _, part in html)
+    if plain_size < MIN_PLAIN_SHARE * html_size:
+        body = _BOUNDARY.join(part for _, part in html)
+        result, parts = _timed(html, "all", inspect_body, body, wordlist, None, keys,
+                               cache, blocklist)
+        return result, parts + _skipped(plain)
+
+    result = dict.fromkeys(BODY_KEYS)
+    parts = []
+    html_keys = [
+        key for key in BODY_KEYS if key not in TEXT_KEYS and _wanted(keys, key)
+    ]
+    text_keys = [key for key in TEXT_KEYS if _wanted(keys, key)]
+    groups = ((html, "html", html_keys), (plain, "text", text_keys))
+    for group, role, group_keys in groups:
+        if not group_keys:
+            parts += _skipped(group)
+            continue
+        body = _BOUNDARY.join(part for _, part in group)
+        analysis, analyzed = _timed(group, role, inspect_body, body, wordlist, None,
+                                    group_keys, cache, blocklist)
+        result.update((key, analysis[key]) for key in group_keys)
+        parts += analyzed
+    return result, parts
+
+
+def _timed(group: List[Tuple[str, str]], role: str, func: Callable[..., dict[str, Any]],
+           *args) -> Tuple[dict[str, Any], List[BodyPart]]:
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    total = sum(len(part) for _, part in group) or 1
+    return result, [
+        BodyPart(content_type, len(part), role,
+                 elapsed * len(part) / total) for content_type, part in group
+    ]
+
+
+def _skipped(group: List[Tuple[str, str]]) -> List[BodyPart]:
+    return [
+        BodyPart(content_type, len(part), "skipped", 0.0)
+        for content_type, part in group
+    ]
 
 
 def is_upper(body: str) -> bool:
@@ -347,6 +766,26 @@ def get_links_from_str(body: str) -> List[str]:
     return links
 
 
+def link_host(link: str) -> str:
+    """The host of a link found by `get_links_from_str`, e.g. `www.example.com` for
+    `https://www.example.com:8080/path`."""
+    return re.split(r"[/:?#]", link.split("://", 1)[-1], maxsplit=1)[0]
+
+
+def blocked_links(links: Iterable[str], blocklist: Blocklist) -> List[str]:
+    """The links whose host, or one of its parent domains, is in a blocklist.
+
+    Args:
+        links (Iterable[str]): the links, see `get_links_from_str`
+        blocklist (Blocklist): the blocked domains, see `Blocklist.blocks_domain`
+
+    Returns:
+        list: the blocked links
+
+    """
+    return [link for link in links if blocklist.blocks_domain(link_host(link))]
+
+
 def has_mailto_links(body) -> bool:
     """Checks if the email has mailto links.
 
@@ -397,11 +836,14 @@ def has_script_tag(body: str) -> bool:
     return False
 
 
-def inspect_attachments(attachments: Sequence) -> dict[str, bool]:
+def inspect_attachments(attachments: Sequence,
+                        blocklist: Optional[Blocklist] = None) -> dict[str, Any]:
     """A detailed analysis of the email attachments.
 
     Args:
         attachments (List):  a list of attachments
+        blocklist (Blocklist, optional): the blocked SHA-256 hashes of the
+        attachments, without it `has_blocked_attachments` is `None`
 
     Returns:
         dict: a dictionary containing the following information:
@@ -411,16 +853,38 @@ def inspect_attachments(attachments: Sequence) -> dict[str, bool]:
             "has_attachments": bool,         # True if the email has attachments
             "attachment_is_executable": bool # True if the email has
                                              # an attachment in executable format
+            "has_blocked_attachments": bool  # True if the hash of an attachment
+                                             # is in the blocklist
         }
+        ```
+
+    The payloads are never decoded in full, but to be hashed if there is a blocklist,
+    see `spamanalyzer.attachments`.
 
     """
     has_attachments = len(attachments) > 0
-    is_executable = False
-    for attachment in attachments:
-        a_type = attachment.get("mail_content_type")
-        if a_type == "application/octet-stream":
-            is_executable = True
+    is_executable = any(
+        inspect_attachment(attachment).is_executable for attachment in attachments)
     return {
-        "has_attachments": has_attachments,
-        "attachment_is_executable": is_executable,
+        "has_attachments":
+        has_attachments,
+        "attachment_is_executable":
+        is_executable,
+        "has_blocked_attachments": (None if blocklist is None else blocked_attachments(
+            attachments, blocklist) != []),
     }
+
+
+def blocked_attachments(attachments: Sequence, blocklist: Blocklist) -> List[str]:
+    """The SHA-256 hashes of the attachments that are in a blocklist.
+
+    Args:
+        attachments (List): a list of attachments
+        blocklist (Blocklist): the blocked hashes, in hexadecimal
+
+    Returns:
+        list: the hashes of the blocked attachments
+
+    """
+    digests = (payload_sha256(attachment) for attachment in attachments)
+    return [digest for digest in digests if digest in blocklist]
@@ -0,0 +1,108 @@
+import json
+import os
+import shutil
+import signal
+
+import pytest
+from click.testing import CliRunner
+
+from app import __main__
+from app.__analyzer import analyze
+from app.checkpoint import Checkpoint
+from app.files import get_files_from_dir
+from app.io import JsonWriter
+
+
+def record(path: str) -> dict:
+    return {"filename": path, "is_spam": "false"}
+
+
+class TestCheckpoint:
+
+    def test_resume(self, tmp_path):
+        path = str(tmp_path / "journal.ndjson")
+        checkpoint = Checkpoint(path)
+        checkpoint.append(record("a"))
+        checkpoint.append(record("b"))
+        checkpoint.close()
+
+        with pytest.raises(FileExistsError):
+            Checkpoint(path)
+
+        checkpoint = Checkpoint(path, resume=True)
+        assert checkpoint.completed == 2
+        assert "a" in checkpoint and "c" not in checkpoint
+        checkpoint.append(record("c"))
+        assert [r["filename"] for r in checkpoint.replay()] == ["a", "b"]
+        checkpoint.close()
+
+    def test_truncated_record(self, tmp_path):
+        path = tmp_path / "journal.ndjson"
+        path.write_text(json.dumps(record("a")) + "\n" + '{"filename": "b", "is_')
+
+        checkpoint = Checkpoint(str(path), resume=True)
+        assert checkpoint.completed == 1
+        assert "b" not in checkpoint
+        checkpoint.append(record("c"))
+        checkpoint.close()
+
+        lines = path.read_text().splitlines()
+        assert [json.loads(line)["filename"] for line in lines] == ["a", "c"]
+
+
+class TestInterruptAndResume:
+    runner = CliRunner()
+    cli = __main__.cli
+    cli.add_command(analyze)
+
+    @pytest.fixture
+    def spool(self, tmp_path) -> str:
+        directory = tmp_path / "spool"
+        directory.mkdir()
+        for sample in get_files_from_dir("tests/samples")[:10]:
+            shutil.copy(sample, directory)
+        return str(directory)
+
+    def run(self, spool, output, *args):
+        return self.runner.invoke(self.cli, [
+            "analyze", "-l", "src/app/conf/word_blacklist.txt", "-fmt", "json", "-o",
+            output, *args, spool
+        ])
+
+    @pytest.mark.parametrize("jobs", ["1", "2"])
+    def test_interrupted_run(self, spool, tmp_path, monkeypatch, jobs):
+        expected = tmp_path / "expected.json"
+        assert self.run(spool, str(expected), "-j", jobs).exit_code == 0
+
+        write_record = JsonWriter.write_record
+        written = 0
+
+        def interrupting(self, record):
+            nonlocal written
+            write_record(self, record)
+            written += 1
+            if written == 3:
+                os.kill(os.getpid(), signal.SIGINT)
+
+        journal = str(tmp_path / "journal.ndjson")
+        partial = tmp_path / "partial.json"
+        with monkeypatch.context() as m:
+            m.setattr(JsonWriter, "write_record", interrupting)
+            result = self.run(spool, str(partial), "-j", jobs, "--window", "2",
+                              "--checkpoint", journal)
+        assert result.exit_code == 130
+
+        # the partial output is a valid prefix of the complete one
+        partial_items = json.loads(partial.read_text())
+        assert 3 <= len(partial_items) < 10
+        assert partial_items == json.loads(expected.read_text())[:len(partial_items)]
+
+        result = self.run(spool, str(tmp_path / "again.json"), "-j", jobs,
+                          "--checkpoint", journal)
+        assert result.exit_code != 0
+
+        resumed = tmp_path / "resumed.json"
+        result = self.run(spool, str(resumed), "-j", jobs, "--checkpoint", journal,
+                          "--resume")
+        assert result.exit_code == 0
+        assert resumed.read_text() == expected.read_text()
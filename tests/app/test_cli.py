@@ -1,14 +1,38 @@
+import json
+import os
+import shutil
+import socket
+
+import numpy as np
 import tomli
 from click.testing import CliRunner
 
 from app import __main__
 from app.__analyzer import analyze
+from app.__blocklist import blocklist
+from app.__merge import merge
+from app.__networks import networks
+from app.__trainer import compile_command, train
+from spamanalyzer.data_structures import default_model
+from spamanalyzer.ml import (
+    FEATURES,
+    HEADER_FEATURES,
+    CompiledForest,
+    SpamClassifier,
+    load_features,
+)
+from spamanalyzer.resolver import ResolverCache
 
 
 class TestCLI:
     runner = CliRunner()
     cli = __main__.cli
     cli.add_command(analyze)
+    cli.add_command(train)
+    cli.add_command(compile_command)
+    cli.add_command(merge)
+    cli.add_command(networks)
+    cli.add_command(blocklist)
 
     def test_help(self):
         result = self.runner.invoke(self.cli, ["--help"])
@@ -63,3 +87,262 @@ class TestCLI:
             ],
         )
         assert 0 == result.exit_code
+
+    def test_parallel_folder(self):
+        args = ["analyze", "-l", "src/app/conf/word_blacklist.txt", "tests/samples"]
+        serial = self.runner.invoke(self.cli, args + ["-fmt", "json"])
+        result = self.runner.invoke(self.cli, args + ["-fmt", "json", "-j", "2"])
+        assert result.exit_code == 0
+        assert result.output == serial.output
+
+        result = self.runner.invoke(self.cli, args + ["-j", "2", "--memory-report"])
+        assert result.exit_code == 0
+        assert "worker" in result.output
+
+        result = self.runner.invoke(
+            self.cli, args + ["-fmt", "json", "-j", "2", "--schedule", "size"])
+        assert result.exit_code == 0
+        # the results are written as they complete, the largest emails first
+        items = json.loads(result.output[:result.output.index("\n]") + 2])
+        expected = json.loads(serial.output)
+        key = lambda item: item["filename"]  # noqa: E731
+        assert sorted(items, key=key) == sorted(expected, key=key)
+        assert "Utilization" in result.output
+
+    def test_campaign_index(self, tmp_path):
+        index = str(tmp_path / "campaigns.npz")
+        args = [
+            "analyze", "-l", "src/app/conf/word_blacklist.txt", "--campaign-index",
+            index, "tests/samples"
+        ]
+        result = self.runner.invoke(self.cli, args)
+        assert result.exit_code == 0
+        assert "Campaigns" in result.output
+        assert os.path.exists(index)
+        with np.load(index) as data:
+            fingerprint = str(data["fingerprint"])
+
+        # another parser, the index is rebuilt
+        result = self.runner.invoke(self.cli, args + ["--parser", "stdlib"])
+        assert result.exit_code == 0
+        with np.load(index) as data:
+            assert str(data["fingerprint"]) != fingerprint
+
+        result = self.runner.invoke(self.cli, args + ["-j", "2"])
+        assert result.exit_code == 2
+
+    def test_template_cache(self):
+        args = [
+            "analyze", "-l", "src/app/conf/word_blacklist.txt", "--template-cache",
+            "16", "tests/samples"
+        ]
+        for jobs in ("1", "2"):
+            result = self.runner.invoke(self.cli, args + ["-j", jobs])
+            assert result.exit_code == 0
+            assert "Template cache" in result.output
+            assert "Hit rate" in result.output
+
+    def test_output_order(self):
+        args = ["analyze", "-l", "src/app/conf/word_blacklist.txt", "-fmt", "ndjson"]
+        # `--schedule size` writes the results as the chunks complete
+        for options in ([], ["-j", "2"]):
+            result = self.runner.invoke(self.cli, args + options + ["tests/samples"])
+            assert result.exit_code == 0
+            names = [
+                json.loads(line)["filename"] for line in result.output.splitlines()
+            ]
+            assert names == sorted(names)
+
+    def test_max_message_size(self):
+        args = [
+            "analyze", "-l", "src/app/conf/word_blacklist.txt", "--max-message-size",
+            "4096", "-fmt", "ndjson", "tests/samples"
+        ]
+        for jobs in ("1", "2"):
+            result = self.runner.invoke(self.cli, args + ["-j", jobs])
+            assert result.exit_code == 0
+            records = [json.loads(line) for line in result.output.splitlines()]
+            sizes = {
+                record["filename"]: os.path.getsize(record["filename"])
+                for record in records
+            }
+            assert any(size > 4096 for size in sizes.values())
+            for record in records:
+                assert record.get("truncated", False) is (sizes[record["filename"]]
+                                                          > 4096)
+
+    def test_stdlib_parser(self):
+        args = [
+            "analyze", "-l", "src/app/conf/word_blacklist.txt", "-fmt", "ndjson",
+            "tests/samples"
+        ]
+        expected = self.runner.invoke(self.cli, args)
+        result = self.runner.invoke(self.cli, args + ["--parser", "stdlib"])
+        assert result.exit_code == 0
+        assert sorted(result.output.splitlines()) == sorted(
+            expected.output.splitlines())
+
+    def test_dns_prefetch(self):
+        args = [
+            "analyze", "-l", "src/app/conf/word_blacklist.txt", "-fmt", "ndjson",
+            "--full-analysis", "tests/samples"
+        ]
+        expected = self.runner.invoke(self.cli, args)
+        result = self.runner.invoke(
+            self.cli, args + ["--dns-prefetch", "16", "--dns-timeout", "2"])
+        assert result.exit_code == 0
+        assert sorted(result.output.splitlines()) == sorted(
+            expected.output.splitlines())
+
+    def test_offline(self, tmp_path, monkeypatch):
+        lookups = []
+
+        def gethostbyaddr(ip_addr):
+            lookups.append(ip_addr)
+            return f"relay-{len(lookups)}.example.com", [], [ip_addr]
+
+        monkeypatch.setattr(socket, "gethostbyaddr", gethostbyaddr)
+        cache = str(tmp_path / "dns.sqlite")
+        args = [
+            "analyze", "-l", "src/app/conf/word_blacklist.txt", "-fmt", "ndjson",
+            "--full-analysis", "--dns-cache", cache, "tests/samples"
+        ]
+        for jobs in ("1", "2"):
+            # the lookups of the worker processes are saved too
+            if os.path.exists(cache):
+                os.remove(cache)
+            warm = self.runner.invoke(self.cli, args + ["-j", jobs])
+            assert warm.exit_code == 0
+            assert len(ResolverCache.load(cache)) > 0
+
+        lookups.clear()
+        result = self.runner.invoke(self.cli, args + ["--offline"])
+        assert result.exit_code == 0
+        assert lookups == []
+        assert sorted(result.output.splitlines()) == sorted(warm.output.splitlines())
+
+    def test_networks(self, tmp_path):
+        table = tmp_path / "ranges.csv"
+        table.write_text("network,asn,name\n0.0.0.0/1,64500,LOW\n"
+                         "128.0.0.0/1,64501,HIGH\n")
+        compiled = self.runner.invoke(self.cli, ["networks", str(table)])
+        assert compiled.exit_code == 0
+        assert "2 ranges" in compiled.output
+
+        args = ["analyze", "-l", "src/app/conf/word_blacklist.txt", "-fmt", "ndjson"]
+        samples = ["--networks", str(tmp_path / "ranges.bin"), "tests/samples"]
+        for jobs in ("1", "2"):
+            result = self.runner.invoke(self.cli, args + samples + ["-j", jobs])
+            assert result.exit_code == 0
+            records = [json.loads(line) for line in result.output.splitlines()]
+            names = {record["headers"]["origin_network"] for record in records}
+            assert {"LOW", "HIGH"} <= names
+
+        # the network columns are only written with a table
+        csv_args = args[:-1] + ["csv"]
+        with_table = self.runner.invoke(self.cli, csv_args + samples)
+        assert "headers.origin_network" in with_table.output.splitlines()[0]
+        without = self.runner.invoke(self.cli, csv_args + ["tests/samples"])
+        assert "origin_network" not in without.output
+        without = self.runner.invoke(self.cli, args + ["tests/samples"])
+        assert "origin_network" not in without.output
+
+        # the csv table must be compiled first
+        not_compiled = ["--networks", str(table), "tests/samples"]
+        assert self.runner.invoke(self.cli, args + not_compiled).exit_code != 0
+
+    def test_blocklist(self, tmp_path):
+        entries = tmp_path / "domains.txt"
+        entries.write_text("# link domains\nipogea.com\n")
+        built = self.runner.invoke(self.cli, ["blocklist", str(entries)])
+        assert built.exit_code == 0
+        assert "1 entries" in built.output
+
+        args = ["analyze", "-l", "src/app/conf/word_blacklist.txt", "-fmt", "ndjson"]
+        sample = ("tests/samples/10.9b68fb361d07cc30d9923b2134cb4471fd9f21fa35eebd30093"
+                  "dc296fdd0f7eb.email")
+        blocked = ["--domain-blocklist", str(tmp_path / "domains.bin"), sample]
+        result = self.runner.invoke(self.cli, args + blocked)
+        assert result.exit_code == 0
+        record = json.loads(result.output)
+        assert record["body"]["has_blocked_links"] is True
+        assert record["attachments"]["has_blocked_attachments"] is None
+
+        # the text file must be built first
+        not_built = ["--hash-blocklist", str(entries), sample]
+        assert self.runner.invoke(self.cli, args + not_built).exit_code != 0
+
+    def test_cascade_report(self, tmp_path):
+        import pickle
+
+        import pandas as pd
+        from sklearn.dummy import DummyClassifier
+
+        from spamanalyzer.ml import HEADER_FEATURES
+
+        X = pd.DataFrame([[0] * len(HEADER_FEATURES)] * 2, columns=HEADER_FEATURES)
+        model_path = tmp_path / "headers.pkl"
+        with open(model_path, "wb") as f:
+            pickle.dump(DummyClassifier(strategy="most_frequent").fit(X, [0, 1]), f)
+
+        result = self.runner.invoke(
+            self.cli,
+            [
+                "analyze",
+                "-l",
+                "src/app/conf/word_blacklist.txt",
+                "--cascade-model",
+                str(model_path),
+                "tests/samples",
+            ],
+        )
+        assert result.exit_code == 0
+        assert "Cascade" in result.output
+        assert "Headers only" in result.output
+
+    def test_train(self, tmp_path):
+        ham_dir, spam_dir = tmp_path / "ham", tmp_path / "spam"
+        ham_dir.mkdir()
+        spam_dir.mkdir()
+        for i, sample in enumerate(sorted(os.listdir("tests/samples"))[:8]):
+            target = ham_dir if i % 2 == 0 else spam_dir
+            shutil.copy(os.path.join("tests/samples", sample), target)
+        (ham_dir / "notes.txt").write_text("not an email")
+
+        args = [
+            "train",
+            "--ham",
+            str(ham_dir),
+            "--spam",
+            str(spam_dir),
+            "-l",
+            "src/app/conf/word_blacklist.txt",
+            "-s",
+            str(tmp_path / "features.npz"),
+            "-o",
+            str(tmp_path / "model.pkl"),
+            "--header-model",
+            str(tmp_path / "headers.pkl"),
+            "-j",
+            "2",
+            "--n-estimators",
+            "5",
+        ]
+        result = self.runner.invoke(self.cli, args)
+        assert result.exit_code == 0
+        assert "9 to analyze" in result.output
+        assert "1 invalid emails skipped" in result.output
+        assert load_features(str(tmp_path / "model.pkl")) == FEATURES
+        assert load_features(str(tmp_path / "headers.pkl")) == HEADER_FEATURES
+
+        result = self.runner.invoke(self.cli, args)
+        assert result.exit_code == 0
+        assert "8 emails found in the store, 1 to analyze" in result.output
+
+    def test_compile(self, tmp_path):
+        model = tmp_path / "model.pkl"
+        shutil.copy(default_model(), model)
+        result = self.runner.invoke(self.cli, ["compile", str(model)])
+        assert result.exit_code == 0
+        assert isinstance(
+            SpamClassifier(str(tmp_path / "model.npz")).model, CompiledForest)
@@ -1,6 +1,6 @@
 import os
 
-from app.files import file_is_valid_email, get_files_from_dir
+from app.files import file_is_valid_email, filter_shard, get_files_from_dir, shard_of
 
 
 def test_get_files_from_directory():
@@ -17,3 +17,23 @@ def test_invalid_email_file():
         "tests/samples/00.1d30d499c969369915f69e7cf1f5f5e3fdd567d41e8721bf8207fa52a78aff9a.email"
     ) is True)
     assert file_is_valid_email("tests/samples/invalid_file.txt") is False
+
+
+def test_shards():
+    paths = get_files_from_dir("tests/samples")
+    shards = [list(filter_shard(paths, "tests/samples", k, 3)) for k in range(1, 4)]
+    assert sorted(sum(shards, [])) == sorted(paths)
+    assert all(shards)
+    # the assignment depends on the path relative to the root, not on the root
+    moved = [
+        os.path.join("elsewhere", os.path.relpath(p, "tests/samples")) for p in paths
+    ]
+    assert [os.path.basename(p) for p in filter_shard(moved, "elsewhere", 2, 3)
+            ] == [os.path.basename(p) for p in shards[1]]
+    assert shard_of(b"key", 4) == shard_of(b"key", 4)
+
+    by_content = [
+        list(filter_shard(paths, "tests/samples", k, 3, by="content"))
+        for k in range(1, 4)
+    ]
+    assert sorted(sum(by_content, [])) == sorted(paths)
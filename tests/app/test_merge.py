@@ -0,0 +1,80 @@
+import json
+import shutil
+
+import pytest
+from click.testing import CliRunner
+
+from app import __main__
+from app.__analyzer import analyze
+from app.__merge import merge
+from app.files import get_files_from_dir
+from app.io import read_records
+
+
+class TestShardAndMerge:
+    runner = CliRunner()
+    cli = __main__.cli
+    cli.add_command(analyze)
+    cli.add_command(merge)
+
+    @pytest.fixture
+    def spool(self, tmp_path) -> str:
+        directory = tmp_path / "spool"
+        directory.mkdir()
+        for sample in get_files_from_dir("tests/samples")[:10]:
+            shutil.copy(sample, directory)
+        return str(directory)
+
+    def run(self, *args):
+        result = self.runner.invoke(self.cli, list(args))
+        assert result.exit_code == 0, result.output
+        return result
+
+    def analyze(self, spool, output, fmt, *args):
+        return self.run("analyze", "-l", "src/app/conf/word_blacklist.txt", "-fmt", fmt,
+                        "-o", output, *args, spool)
+
+    @pytest.mark.parametrize("fmt", ["json", "ndjson", "csv"])
+    @pytest.mark.parametrize("by", ["path", "content"])
+    def test_merge_shards(self, spool, tmp_path, fmt, by):
+        expected = str(tmp_path / "expected")
+        self.analyze(spool, expected, fmt)
+
+        shards = [str(tmp_path / f"shard-{k}") for k in (1, 2, 3)]
+        for k, shard in enumerate(shards, start=1):
+            self.analyze(spool, shard, fmt, "--shard", f"{k}/3", "--shard-by", by)
+
+        merged = str(tmp_path / "merged")
+        result = self.run("merge", "-o", merged, *shards)
+
+        records = list(read_records(expected, fmt))
+        assert list(read_records(merged, fmt)) == sorted(records,
+                                                         key=lambda r: r["filename"])
+        spam = sum(record["is_spam"] == "true" for record in records)
+        assert "Summary" in result.output
+        spam_row = result.output.split("SPAM")[1].splitlines()[0]
+        assert spam_row.replace("│", "").strip() == str(spam)
+
+    def test_convert(self, spool, tmp_path):
+        shard = str(tmp_path / "shard.ndjson")
+        self.analyze(spool, shard, "ndjson", "--shard", "1/1")
+
+        merged = tmp_path / "merged.json"
+        self.run("merge", "-fmt", "json", "-o", str(merged), shard)
+        assert json.loads(merged.read_text()) == sorted(read_records(shard, "ndjson"),
+                                                        key=lambda r: r["filename"])
+
+        csv = str(tmp_path / "shard.csv")
+        self.analyze(spool, csv, "csv")
+        result = self.runner.invoke(self.cli, ["merge", "-fmt", "json", csv])
+        assert result.exit_code != 0
+        result = self.runner.invoke(self.cli, ["merge", csv, shard])
+        assert result.exit_code != 0
+
+    def test_invalid_shard(self, spool, tmp_path):
+        for shard in ("0/2", "3/2", "1", "a/b"):
+            result = self.runner.invoke(self.cli, [
+                "analyze", "-l", "src/app/conf/word_blacklist.txt", "--shard", shard,
+                spool
+            ])
+            assert result.exit_code == 2
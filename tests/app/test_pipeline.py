@@ -0,0 +1,111 @@
+import asyncio
+import os
+import socket
+from typing import List, Tuple
+
+import pytest
+
+from app.files import get_files_from_dir, iter_files_from_dir
+from app.io import ResultWriter
+from app.pipeline import PipelineConfig, run_pipeline
+from spamanalyzer import SpamAnalyzer
+from spamanalyzer.resolver import ResolverCache
+
+with open("src/app/conf/word_blacklist.txt", "r", encoding="utf-8") as f:
+    wordlist = f.read().splitlines()
+
+samples = get_files_from_dir("tests/samples")[:12]
+
+
+class ListWriter(ResultWriter):
+
+    def __init__(self) -> None:
+        self.results: List[Tuple[str, bool]] = []
+
+    def write(self, analysis, is_spam) -> None:
+        self.results.append((analysis.file_path, is_spam))
+
+
+def test_iter_files_from_dir():
+    # sorted, whatever the order of the file system
+    assert list(iter_files_from_dir("tests/samples")) == sorted(
+        os.path.join("tests/samples", name) for name in os.listdir("tests/samples"))
+
+
+@pytest.mark.asyncio
+async def test_same_results_in_order():
+    analyzer = SpamAnalyzer(wordlist)
+    analyses = [await analyzer.analyze(path) for path in samples]
+    expected = list(zip(samples, analyzer.classify_multiple_input(analyses)))
+
+    paths = samples[:6] + ["tests/samples/invalid_file.txt"] + samples[6:]
+    invalid: List[str] = []
+    writer = ListWriter()
+    config = PipelineConfig(parse_workers=2, extract_workers=3, chunk_size=2, window=4)
+    written = await run_pipeline(paths,
+                                 analyzer,
+                                 writer,
+                                 config,
+                                 on_invalid=invalid.append)
+
+    assert written == len(samples)
+    assert writer.results == expected
+    assert invalid == ["tests/samples/invalid_file.txt"]
+
+
+@pytest.mark.asyncio
+async def test_dns_prefetch(monkeypatch):
+    lookups: List[str] = []
+
+    def gethostbyaddr(ip_addr):
+        lookups.append(ip_addr)
+        raise socket.herror("host not found")
+
+    monkeypatch.setattr(socket, "gethostbyaddr", gethostbyaddr)
+    expected = ListWriter()
+    await run_pipeline(samples, SpamAnalyzer(wordlist), expected, full=True)
+    without_cache = len(lookups)
+    lookups.clear()
+
+    writer = ListWriter()
+    analyzer = SpamAnalyzer(wordlist, resolver=ResolverCache())
+    config = PipelineConfig(parse_workers=2, extract_workers=3, chunk_size=4, window=6)
+    await run_pipeline(samples + samples, analyzer, writer, config, full=True)
+    assert writer.results == expected.results * 2
+    assert 0 < len(lookups) == len(set(lookups)) <= without_cache
+
+
+@pytest.mark.asyncio
+async def test_bounded_window():
+    pulled = 0
+
+    def paths():
+        nonlocal pulled
+        for path in samples:
+            pulled += 1
+            yield path
+
+    class WindowWriter(ListWriter):
+
+        def write(self, analysis, is_spam) -> None:
+            super().write(analysis, is_spam)
+            # the emails discovered but not written yet never exceed the window
+            assert pulled - len(self.results) <= 3
+
+    writer = WindowWriter()
+    config = PipelineConfig(window=3)
+    await run_pipeline(paths(), SpamAnalyzer(wordlist), writer, config)
+    assert len(writer.results) == len(samples)
+
+
+@pytest.mark.asyncio
+async def test_error_stops_the_pipeline():
+    with pytest.raises(FileNotFoundError):
+        await asyncio.wait_for(
+            run_pipeline(samples[:3] + ["missing.email"] + samples[3:],
+                         SpamAnalyzer(wordlist), ListWriter()), 60)
+
+
+def test_invalid_config():
+    with pytest.raises(ValueError):
+        PipelineConfig(window=0)
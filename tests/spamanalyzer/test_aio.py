@@ -0,0 +1,113 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from spamanalyzer import utils
+from spamanalyzer.aio import AsyncSpamAnalyzer
+from spamanalyzer.data_structures import SpamAnalyzer
+from spamanalyzer.errors import AnalysisError
+
+SAMPLES_FOLDER = "tests/samples"
+
+ham = os.path.join(
+    SAMPLES_FOLDER,
+    "97.47949e45691dd7a024dcfaacef4831461bf5d5f09c85a6e44ee478a5bcaf8539.email",
+)
+spam = os.path.join(
+    SAMPLES_FOLDER,
+    "00.1d30d499c969369915f69e7cf1f5f5e3fdd567d41e8721bf8207fa52a78aff9a.email",
+)
+
+with open("src/app/conf/word_blacklist.txt", "r", encoding="utf-8") as f:
+    wordlist = f.read().splitlines()
+
+
+@pytest.fixture
+def slow_body(monkeypatch):
+    inspect_body = utils.inspect_body
+
+    def slow(*args, **kwargs):
+        time.sleep(0.3)
+        return inspect_body(*args, **kwargs)
+
+    monkeypatch.setattr(utils, "inspect_body", slow)
+
+
+class TestAsyncSpamAnalyzer:
+
+    @pytest.mark.asyncio
+    async def test_same_analysis(self):
+        analyzer = AsyncSpamAnalyzer(wordlist)
+        expected = await SpamAnalyzer(wordlist).analyze(ham, full=True)
+        analysis = await analyzer.analyze(ham, full=True)
+        assert analysis.to_list() == expected.to_list()
+        assert analyzer.is_spam(analysis) is False
+
+    @pytest.mark.asyncio
+    async def test_thread_pool(self):
+        expected = await SpamAnalyzer(wordlist).analyze(spam, full=True)
+        with ThreadPoolExecutor(2) as executor:
+            analyzer = AsyncSpamAnalyzer(wordlist, executor=executor)
+            analysis = await analyzer.analyze(spam, full=True)
+        assert analysis.to_list() == expected.to_list()
+
+    def test_process_pool_rejected(self):
+        with ProcessPoolExecutor(1) as executor:
+            with pytest.raises(ValueError):
+                AsyncSpamAnalyzer(wordlist, executor=executor)
+
+    @pytest.mark.asyncio
+    async def test_event_loop_not_blocked(self, slow_body):
+        analyzer = AsyncSpamAnalyzer(wordlist, executor=ThreadPoolExecutor(2))
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.ensure_future(ticker())
+        await analyzer.analyze(spam)
+        task.cancel()
+        assert ticks >= 10
+
+    @pytest.mark.asyncio
+    async def test_timeout(self, slow_body):
+        analyzer = AsyncSpamAnalyzer(wordlist, timeout=0.05)
+        with pytest.raises(asyncio.TimeoutError):
+            await analyzer.analyze(spam)
+
+    @pytest.mark.asyncio
+    async def test_analyze_many(self):
+        analyzer = AsyncSpamAnalyzer(wordlist, max_in_flight=2)
+        paths = [ham, spam] * 3
+        analyses = [analysis async for analysis in analyzer.analyze_many(iter(paths))]
+        assert sorted(analysis.file_path for analysis in analyses) == sorted(paths)
+
+        verdicts = analyzer.classify_multiple_input(analyses)
+        for analysis, is_spam in zip(analyses, verdicts):
+            assert is_spam == (analysis.file_path == spam)
+
+    @pytest.mark.asyncio
+    async def test_analyze_many_errors(self):
+        analyzer = AsyncSpamAnalyzer(wordlist)
+        paths = [ham, "missing.email"]
+        results = [
+            result
+            async for result in analyzer.analyze_many(paths, return_exceptions=True)
+        ]
+        errors = [result for result in results if isinstance(result, AnalysisError)]
+        assert len(results) == 2
+        assert [error.email_path for error in errors] == ["missing.email"]
+
+        with pytest.raises(AnalysisError):
+            async for _ in analyzer.analyze_many(paths):
+                pass
+
+    def test_invalid_max_in_flight(self):
+        with pytest.raises(ValueError):
+            AsyncSpamAnalyzer(wordlist, max_in_flight=0)
@@ -0,0 +1,115 @@
+import base64
+import os
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import mailparser
+import pytest
+
+from spamanalyzer import utils
+from spamanalyzer.attachments import (
+    SNIFF_SIZE,
+    inspect_attachment,
+    payload_prefix,
+    sniff,
+)
+
+SAMPLES_FOLDER = "tests/samples"
+
+# a DOS header pointing to a PE signature
+PE = b"MZ" + b"\0" * 0x3a + (0x40).to_bytes(4, "little") + b"PE\0\0" + b"\0" * 64
+ELF = b"\x7fELF\x02\x01\x01" + b"\0" * 64
+
+
+def attachment(content: bytes, filename: str, content_type: str) -> dict:
+    message = MIMEMultipart()
+    message.attach(MIMEText("see the attachment"))
+    part = MIMEApplication(content, content_type.split("/")[1])
+    part.add_header("Content-Disposition", "attachment", filename=filename)
+    message.attach(part)
+    return mailparser.parse_from_string(message.as_string()).attachments[0]
+
+
+class TestSniff:
+
+    @pytest.mark.parametrize(
+        "data, kind",
+        [
+            (PE, "pe"),
+            (ELF, "elf"),
+            (b"\xcf\xfa\xed\xfe\x07\0\0\x01", "mach-o"),
+            (b"#!/bin/sh\nrm -rf ~\n", "script"),
+            (b"%PDF-1.7\n", "pdf"),
+            (b"PK\x03\x04\x14\0", "zip"),
+            (b"\xff\xd8\xff\xe0\0\x10JFIF", "jpeg"),
+            (b"MZ is not always an executable, " * 4, None),
+            (b"", None),
+        ],
+    )
+    def test_formats(self, data, kind):
+        assert sniff(data) == kind
+
+
+class TestInspectAttachment:
+
+    def test_executables(self):
+        # the content is recognized whatever the declared type and name
+        assert inspect_attachment(attachment(PE, "invoice.pdf",
+                                             "application/pdf")).kind == "pe"
+        info = inspect_attachment(attachment(ELF, "update", "application/octet-stream"))
+        assert info.kind == "elf"
+        assert info.is_executable is True
+
+    def test_declared_executables(self):
+        script = attachment(b"WScript.Echo 1", "run.vbs", "application/x-vbscript")
+        assert inspect_attachment(script).is_executable is True
+
+    def test_data(self):
+        info = inspect_attachment(
+            attachment(b"%PDF-1.4\n" + b"0" * 100, "report.pdf",
+                       "application/octet-stream"))
+        assert info.kind == "pdf"
+        assert info.is_executable is False
+
+    def test_prefix_only(self):
+        content = PE + os.urandom(100_000)
+        parsed = attachment(content, "setup.exe", "application/octet-stream")
+        assert parsed["binary"] is True
+        assert payload_prefix(parsed) == content[:SNIFF_SIZE]
+        assert inspect_attachment(parsed).size == len(content)
+
+    def test_malformed_base64(self):
+        parsed = {
+            "filename": "x.bin",
+            "payload": "not base64!",
+            "binary": True,
+            "mail_content_type": "application/octet-stream",
+            "content_transfer_encoding": "base64",
+        }
+        assert inspect_attachment(parsed).kind is None
+
+    def test_samples(self):
+        email = mailparser.parse_from_file(
+            os.path.join(
+                SAMPLES_FOLDER,
+                "10.9b68fb361d07cc30d9923b2134cb4471fd9f21fa35eebd30093dc296fdd0f7eb.email",
+            ))
+        kinds = {inspect_attachment(a).kind for a in email.attachments}
+        assert kinds == {"jpeg", "gif"}
+        result = utils.inspect_attachments(email.attachments)
+        assert result["has_attachments"] is True
+        assert result["attachment_is_executable"] is False
+
+
+def test_large_base64_lines():
+    # a payload without line breaks, as some mailers write them
+    content = ELF + b"\0" * 10_000
+    parsed = {
+        "filename": "a",
+        "payload": base64.b64encode(content).decode(),
+        "binary": True,
+        "mail_content_type": "application/octet-stream",
+        "content_transfer_encoding": "base64",
+    }
+    assert payload_prefix(parsed, 10) == content[:10]
@@ -0,0 +1,90 @@
+from email.message import Message
+
+import mailparser
+
+from spamanalyzer import utils
+from spamanalyzer.auth import parse_auth_results
+
+trustable_mail = mailparser.parse_from_file(
+    "tests/samples/97.47949e45691dd7a024dcfaacef4831461bf5d5f09c85a6e44ee478a5bcaf8539.email"
+)
+
+
+def message(*headers) -> Message:
+    result = Message()
+    for name, value in headers:
+        result[name] = value
+    return result
+
+
+def test_every_hop():
+    auth = parse_auth_results(
+        message(
+            ("Authentication-Results", "mx.example.com; spf=fail smtp.mailfrom=a.com;"
+             " dkim=pass (2048-bit key) header.d=a.com header.s=s1; dmarc=none"),
+            ("Authentication-Results",
+             "relay.example.net; spf=pass (sender SPF authorized) smtp.mailfrom=a.com"),
+        ))
+    spf = auth.get("spf")
+    assert [(r.result, r.hop, r.authserv_id) for r in spf] == [
+        ("fail", 0, "mx.example.com"),
+        ("pass", 1, "relay.example.net"),
+    ]
+    assert spf[0].properties == {"smtp.mailfrom": "a.com"}
+    assert auth.get("dkim")[0].properties == {"header.d": "a.com", "header.s": "s1"}
+    # a pass at any hop counts
+    assert auth.passed("spf") is True
+    assert auth.passed("dkim") is True
+    assert auth.passed("dmarc") is False
+    assert auth.passed("arc") is False
+
+
+def test_features():
+    # the features of the model read the last header of each kind only
+    auth = parse_auth_results(
+        message(
+            ("Authentication-Results", "mx.example.com; spf=pass; dmarc=pass"),
+            ("Authentication-Results", "relay.example.net; spf=none; dkim=fail"),
+        ))
+    assert auth.passed("spf") and auth.passed("dmarc")
+    assert auth.last_values["Authentication-Results"].startswith("relay.example.net")
+    assert utils.spf_pass(auth.last_values) is False
+    assert utils.dkim_pass(auth.last_values) is False
+    assert utils.dmarc_pass(auth.last_values) is False
+
+    # Received-SPF wins over Authentication-Results
+    auth = parse_auth_results(
+        message(("Authentication-Results", "mx.example.com; spf=pass"),
+                ("Received-SPF", "softfail (example.com: transitioning a.com)")))
+    assert auth.passed("spf") and utils.spf_pass(auth.last_values) is False
+
+
+def test_arc_and_received_spf():
+    auth = parse_auth_results(
+        message(
+            ("ARC-Authentication-Results", "i=2; mx.example.com; arc=pass; dmarc=pass"),
+            ("ARC-Authentication-Results", "i=1; relay.example.net; dkim=pass"),
+            ("Received-SPF", "Softfail (example.com: domain of transitioning a.com)"),
+            ("DKIM-Signature", "v=1; a=rsa-sha256; d=a.com"),
+            ("X-Authentication-Warning", "host: user set sender"),
+        ))
+    assert [(r.instance, r.authserv_id)
+            for r in auth.get("arc")] == [(2, "mx.example.com")]
+    assert auth.get("dkim")[0].instance == 1
+    assert auth.get("spf")[0].result == "softfail"
+    assert auth.get("spf")[0].header == "Received-SPF"
+    assert auth.dkim_signed is True
+    assert auth.warning is True
+
+
+def test_without_authserv_id():
+    auth = parse_auth_results({"Authentication-Results": "spf=pass; dkim=none"})
+    assert auth.get("spf")[0].authserv_id is None
+    assert auth.passed("spf") is True
+    assert auth.passed("dkim") is False
+
+
+def test_sample():
+    auth = parse_auth_results(trustable_mail.message)
+    assert auth.passed("spf") and auth.passed("dkim") and auth.passed("dmarc")
+    assert parse_auth_results(message(("Subject", "hello"))).by_method == {}
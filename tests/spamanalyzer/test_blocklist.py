@@ -0,0 +1,117 @@
+import base64
+import hashlib
+import pickle
+
+import numpy as np
+import pytest
+
+from spamanalyzer import SpamAnalyzer, attachments, utils
+from spamanalyzer.aio import AsyncSpamAnalyzer
+from spamanalyzer.blocklist import Blocklist, Blocklists, build_blocklist
+from spamanalyzer.campaigns import CampaignIndex
+
+with open("src/app/conf/word_blacklist.txt", "r", encoding="utf-8") as f:
+    wordlist = f.read().splitlines()
+
+# a link to www.ipogea.com and five attachments
+sample = "tests/samples/10.9b68fb361d07cc30d9923b2134cb4471fd9f21fa35eebd30093dc296fdd0f7eb.email"
+
+
+def build(tmp_path, name, entries) -> Blocklist:
+    path = str(tmp_path / name)
+    assert build_blocklist(entries, path) == len(entries)
+    return Blocklist.load(path)
+
+
+def test_contains(tmp_path):
+    entries = [f"domain-{i}.example" for i in range(10000)]
+    blocklist = build(tmp_path, "domains.bin", entries)
+    assert len(blocklist) == 10000
+    assert all(entry in blocklist for entry in entries)
+    assert " Domain-1.Example. " in blocklist
+    # about 1 in 10000 by default
+    false_positives = sum(f"other-{i}.example" in blocklist for i in range(10000))
+    assert false_positives < 10
+
+    unpickled = pickle.loads(pickle.dumps(blocklist))
+    assert "domain-9999.example" in unpickled and len(unpickled) == 10000
+
+    empty = build(tmp_path, "empty.bin", [])
+    assert "domain-1.example" not in empty and len(empty) == 0
+
+    with pytest.raises(ValueError):
+        build_blocklist(entries, str(tmp_path / "invalid.bin"), error_rate=1)
+
+
+def test_blocks_domain(tmp_path):
+    blocklist = build(tmp_path, "domains.bin", ["example.co.uk", "co.jp"])
+    assert blocklist.blocks_domain("example.co.uk")
+    assert blocklist.blocks_domain("mail.smtp.example.co.uk")
+    assert not blocklist.blocks_domain("other.co.uk")
+    # a public suffix in the list does not block its domains
+    assert not blocklist.blocks_domain("example.co.jp")
+
+    links = ["https://www.example.co.uk:8080/path", "example.co.uk?q=1", "http://a.org"]
+    assert [utils.link_host(link)
+            for link in links] == ["www.example.co.uk", "example.co.uk", "a.org"]
+    assert utils.blocked_links(links, blocklist) == links[:2]
+
+
+@pytest.mark.parametrize("parser", ["mailparser", "stdlib"])
+def test_payload_sha256(parser, monkeypatch):
+    email = SpamAnalyzer.parse(sample, parser=parser)
+    expected = []
+    for attachment in email.attachments:
+        payload = attachment["payload"]
+        if attachment["binary"]:
+            payload = base64.b64decode(payload)
+        else:
+            payload = payload.encode("utf-8")
+        expected.append(hashlib.sha256(payload).hexdigest())
+    # the remainders of the base64 chunks are carried to the next one
+    monkeypatch.setattr(attachments, "HASH_CHUNK", 1001)
+    assert [attachments.payload_sha256(a) for a in email.attachments] == expected
+
+
+@pytest.mark.asyncio
+async def test_analysis(tmp_path):
+    email = SpamAnalyzer.parse(sample)
+    digest = attachments.payload_sha256(email.attachments[-1])
+    blocklists = Blocklists(build(tmp_path, "domains.bin", ["ipogea.com"]),
+                            build(tmp_path, "hashes.bin", [digest.upper()]))
+
+    for analyzer in (SpamAnalyzer(wordlist, blocklists=blocklists),
+                     AsyncSpamAnalyzer(wordlist, blocklists=blocklists)):
+        analysis = await analyzer.analyze(sample)
+        assert analysis.body["has_blocked_links"] is True
+        assert analysis.attachments["has_blocked_attachments"] is True
+
+    unrelated = Blocklists(build(tmp_path, "other.bin", ["example.com"]),
+                           build(tmp_path, "none.bin", ["0" * 64]))
+    analysis = await SpamAnalyzer(wordlist, blocklists=unrelated).analyze(sample)
+    assert analysis.body["has_blocked_links"] is False
+    assert analysis.attachments["has_blocked_attachments"] is False
+
+    # the attachments of a truncated mail are not checked
+    truncated = SpamAnalyzer(wordlist, max_bytes=4096, blocklists=blocklists)
+    analysis = await truncated.analyze(sample)
+    assert analysis.truncated
+    assert analysis.attachments["has_blocked_attachments"] is None
+
+    without = await SpamAnalyzer(wordlist).analyze(sample, full=True)
+    assert without.body["has_blocked_links"] is None
+    assert without.attachments["has_blocked_attachments"] is None
+
+
+def test_campaign_index_keys(tmp_path):
+    path = str(tmp_path / "campaigns.npz")
+    index = CampaignIndex()
+    index.save(path)
+    with np.load(path) as data:
+        arrays = dict(data)
+    # an index saved before a body key was added
+    arrays["bodies"] = np.zeros((1, len(utils.BODY_KEYS) - 1))
+    arrays["signatures"] = np.zeros((1, arrays["signatures"].shape[1]), np.uint64)
+    arrays["verdicts"], arrays["members"] = np.array([-1]), np.array([1])
+    np.savez(path, **arrays)
+    assert len(CampaignIndex.load(path)) == 0
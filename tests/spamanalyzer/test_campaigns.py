@@ -0,0 +1,168 @@
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+from spamanalyzer.blocklist import Blocklist, Blocklists, build_blocklist
+from spamanalyzer.campaigns import NUM_PERM, CampaignIndex, CampaignStats, signature
+from spamanalyzer.data_structures import SpamAnalyzer
+
+SAMPLES_FOLDER = "tests/samples"
+
+spam = os.path.join(
+    SAMPLES_FOLDER,
+    "00.1d30d499c969369915f69e7cf1f5f5e3fdd567d41e8721bf8207fa52a78aff9a.email",
+)
+ham = os.path.join(
+    SAMPLES_FOLDER,
+    "97.47949e45691dd7a024dcfaacef4831461bf5d5f09c85a6e44ee478a5bcaf8539.email",
+)
+
+with open("src/app/conf/word_blacklist.txt", "r", encoding="utf-8") as f:
+    wordlist = f.read().splitlines()
+
+text = " ".join(f"word{i}" for i in range(200))
+
+
+@pytest.fixture
+def variant(tmp_path) -> str:
+    # the same mail with a different word in the body, as in a campaign
+    with open(spam, "r", encoding="latin-1") as f:
+        content = f.read()
+    i = content.rfind(" the ")
+    path = str(tmp_path / "variant.email")
+    with open(path, "w", encoding="latin-1") as f:
+        f.write(content[:i] + " someone " + content[i + 5:])
+    return path
+
+
+def test_signature():
+    sig = signature(text)
+    assert sig is not None and sig.shape == (NUM_PERM, )
+    assert np.array_equal(sig, signature(text.upper()))
+    assert np.mean(sig == signature(text.replace("word100", "other"))) > 0.8
+    assert np.mean(sig == signature(" ".join(f"other{i}" for i in range(200)))) < 0.1
+    assert signature("  ") is None
+
+
+class TestCampaignIndex:
+
+    def test_lookup(self):
+        index = CampaignIndex(0.8)
+        sig = signature(text)
+        assert index.lookup("a", sig, None) == (None, None)
+
+        body = {"has_links": True, "text_polarity": 0.5}
+        index.add("a", sig, body)
+        found, verdict = index.lookup("b", signature(text.replace("word150", "x")),
+                                      {"has_links"})
+        assert found == body and verdict is None
+
+        index.set_verdict("a", True)
+        assert index.lookup("c", sig, {"has_links"}) == (body, True)
+        assert index.lookup("d", signature("something else entirely"),
+                            None) == (None, None)
+        assert index.stats() == CampaignStats(lookups=4,
+                                              reused=2,
+                                              clusters=1,
+                                              campaigns=1,
+                                              largest=3)
+
+    def test_missing_keys(self):
+        index = CampaignIndex()
+        sig = signature(text)
+        index.add("a", sig, {"has_links": True, "text_polarity": None})
+        assert index.lookup("b", sig, {"text_polarity"}) == (None, None)
+        assert index.lookup("c", sig, {"has_links"})[0] is not None
+
+    def test_save_and_load(self, tmp_path):
+        path = str(tmp_path / "campaigns.npz")
+        assert len(CampaignIndex.load(path)) == 0
+
+        index = CampaignIndex()
+        body = {"has_links": True, "text_polarity": 0.25, "has_images": None}
+        index.add("a", signature(text), body)
+        index.set_verdict("a", False)
+        index.save(path)
+
+        loaded = CampaignIndex.load(path, threshold=0.8)
+        found, verdict = loaded.lookup("b", signature(text), {"has_links"})
+        assert verdict is False
+        assert found is not None
+        assert found["has_links"] is True and found["text_polarity"] == 0.25
+        assert found["has_images"] is None
+        assert loaded.stats().largest == 2
+
+    def test_fingerprint(self, tmp_path):
+        path = str(tmp_path / "campaigns.npz")
+        index = CampaignIndex(fingerprint="first")
+        index.add("a", signature(text), {"has_links": True})
+        index.set_verdict("a", True)
+        index.save(path)
+
+        assert len(CampaignIndex.load(path, fingerprint="first")) == 1
+        # another wordlist, parser or model
+        loaded = CampaignIndex.load(path, fingerprint="second")
+        assert len(loaded) == 0 and loaded.fingerprint == "second"
+
+    def test_invalid_threshold(self):
+        with pytest.raises(ValueError):
+            CampaignIndex(0)
+
+
+class TestAnalyzer:
+
+    @pytest.mark.asyncio
+    async def test_reuse(self, variant):
+        index = CampaignIndex()
+        analyzer = SpamAnalyzer(wordlist, campaigns=index)
+        first = await analyzer.analyze(spam, full=True)
+        other = await analyzer.analyze(ham, full=True)
+        assert analyzer.classify_multiple_input([first, other]) == [True, False]
+
+        again = await analyzer.analyze(variant, full=True)
+        assert again.body == first.body
+        assert again.verdict is True
+        assert analyzer.classify_multiple_input([again]) == [True]
+        assert again.to_array().tolist() == pytest.approx(first.to_array().tolist())
+        assert index.stats() == CampaignStats(lookups=3,
+                                              reused=1,
+                                              clusters=2,
+                                              campaigns=1,
+                                              largest=2)
+
+    @pytest.mark.asyncio
+    async def test_blocked_links(self, tmp_path):
+        # the same mail, the second one links to a blocked domain
+        with open(spam, "r", encoding="latin-1") as f:
+            content = f.read()
+        blocked = str(tmp_path / "blocked.email")
+        with open(blocked, "w", encoding="latin-1") as f:
+            f.write(content.replace("http://thinkgeek.com/sf",
+                                    "http://evil.example/sf"))
+        build_blocklist(["evil.example"], str(tmp_path / "domains.bin"))
+        domains = Blocklist.load(str(tmp_path / "domains.bin"))
+
+        index = CampaignIndex()
+        analyzer = SpamAnalyzer(wordlist,
+                                campaigns=index,
+                                blocklists=Blocklists(domains=domains))
+        first = await analyzer.analyze(spam)
+        analyzer.classify_multiple_input([first])
+        second = await analyzer.analyze(blocked)
+        assert index.stats().reused == 1
+        assert first.body["has_blocked_links"] is False
+        assert second.body["has_blocked_links"] is True
+        # the verdict of the first mail is not reused
+        assert second.verdict is None
+        # unlike the one of a member without blocked links
+        again = await analyzer.analyze(spam)
+        assert again.verdict is True and again.body["has_blocked_links"] is False
+
+    def test_unclassified_cluster(self, variant):
+        analyzer = SpamAnalyzer(wordlist, campaigns=CampaignIndex())
+        analyses = [asyncio.run(analyzer.analyze(path)) for path in (spam, variant)]
+        # the first mail is not classified yet, the second one is classified too
+        assert [analysis.verdict for analysis in analyses] == [None, None]
+        assert analyzer.classify_multiple_input(analyses) == [True, True]
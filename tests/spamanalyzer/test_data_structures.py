@@ -2,10 +2,19 @@ import asyncio
 import os
 from typing import Tuple
 
+import numpy as np
 import pytest
 
-from spamanalyzer.data_structures import MailAnalysis, SpamAnalyzer
+from spamanalyzer.data_structures import (
+    Cascade,
+    CascadeStats,
+    CompactMailAnalysis,
+    MailAnalysis,
+    SpamAnalyzer,
+    analysis_keys,
+)
 from spamanalyzer.domain import Domain
+from spamanalyzer.ml import FEATURE_DTYPE, FEATURES
 
 SAMPLES_FOLDER = "tests/samples"
 
@@ -49,6 +58,23 @@ class TestSpamAnalyzer:
             True,
         ]
 
+    @pytest.mark.asyncio
+    async def test_classify_in_chunks(self, analysis):
+        ham, spam = analysis
+        mails = [ham, spam, spam, ham, spam]
+        expected = [False, True, True, False, True]
+        assert list(self.analyzer.iter_classify(iter(mails), chunk_size=2)) == expected
+        assert self.analyzer.classify_multiple_input([]) == []
+
+    @pytest.mark.asyncio
+    async def test_wordlist_pattern(self):
+        # the analyzers of a process search their own wordlist
+        neovim, other = SpamAnalyzer(["neovim"]), SpamAnalyzer(["emacs"])
+        assert neovim.wordlist_pattern is neovim.wordlist_pattern
+        for analyzer, expected in ((neovim, True), (other, False), (neovim, True)):
+            headers = (await analyzer.analyze(ham, full=True)).headers
+            assert headers["has_suspect_subject"] is expected
+
 
 class TestMailAnalysis:
 
@@ -69,3 +95,206 @@ class TestMailAnalysis:
         with pytest.raises(KeyError):
             assert dict_mail["is_spam"] is None
             assert dict_mail["not_existing_key"] is None
+
+    @pytest.mark.asyncio
+    async def test_parts(self, analysis):
+        for mail in analysis:
+            assert mail.parts
+            assert "parts" not in mail.to_dict()
+
+
+class TestCompactMailAnalysis:
+
+    @pytest.mark.asyncio
+    async def test_to_array(self, analysis):
+        row = analysis[0].to_array()
+        assert row.shape == (len(FEATURES), )
+        assert row.dtype == FEATURE_DTYPE
+        assert row.tolist() == pytest.approx(
+            np.array(analysis[0].to_list(), dtype=FEATURE_DTYPE).tolist())
+
+    @pytest.mark.asyncio
+    async def test_views(self, analysis):
+        ham, _ = analysis
+        compact = ham.compact()
+        assert compact.file_path == ham.file_path
+        assert compact.to_list() == pytest.approx(ham.to_list())
+        assert compact.body["has_links"] is ham.body["has_links"]
+        assert compact.body["text_polarity"] == pytest.approx(ham.body["text_polarity"])
+        # the compact view has the keys used by the models only
+        used = {key: ham.attachments[key] for key in compact.attachments}
+        assert compact.attachments == used
+        assert compact.headers["has_spf"] is ham.headers["has_spf"]
+        assert compact.headers["send_date_is_RFC2822_compliant"] is (
+            ham.headers["send_date"].is_RFC2822_formatted())
+
+    @pytest.mark.asyncio
+    async def test_skipped_checks(self, analysis):
+        ham, _ = analysis
+        # the checks skipped by the analysis are `None`, they are not true
+        partial = MailAnalysis(file_path=ham.file_path,
+                               headers=dict(ham.headers, has_spf=None),
+                               body=dict(ham.body, has_links=None, text_polarity=None),
+                               attachments=dict.fromkeys(ham.attachments))
+        compact = partial.compact()
+        assert np.isnan(compact.features).sum() == 5
+        assert compact.headers["has_spf"] is None
+        assert compact.body["has_links"] is None
+        assert compact.body["text_polarity"] is None
+        assert compact.attachments == {
+            "has_attachments": None,
+            "attachment_is_executable": None
+        }
+        skipped = [value is None for value in partial.to_list()]
+        assert [value is None for value in compact.to_list()] == skipped
+        assert compact.to_dict()["headers"]["has_dkim"] is ham.headers["has_dkim"]
+        assert not hasattr(compact, "__dict__")
+
+    @pytest.mark.asyncio
+    async def test_shared_matrix(self, analysis):
+        matrix = np.zeros((2, len(FEATURES)), dtype=FEATURE_DTYPE)
+        compacts = [mail.compact(row) for mail, row in zip(analysis, matrix)]
+        assert all(np.shares_memory(c.features, matrix) for c in compacts)
+
+        analyzer = SpamAnalyzer(wordlist)
+        assert analyzer.classify_features(matrix) == [False, True]
+        assert analyzer.classify_multiple_input(compacts) == [False, True]
+
+    def test_invalid_shape(self):
+        with pytest.raises(ValueError):
+            CompactMailAnalysis("mail", np.zeros(3))
+
+
+def header_model(path, strategy: str) -> str:
+    import pandas as pd
+    from sklearn.dummy import DummyClassifier
+
+    from spamanalyzer.ml import HEADER_FEATURES, save_model
+
+    X = pd.DataFrame([[0] * len(HEADER_FEATURES)] * 2, columns=HEADER_FEATURES)
+    model = DummyClassifier(strategy=strategy).fit(X, [0, 1])
+    save_model(model, str(path))  # type: ignore
+    return str(path)
+
+
+class TestCascade:
+
+    @pytest.mark.asyncio
+    async def test_confident_header_model(self, tmp_path):
+        model = header_model(tmp_path / "headers.pkl", "most_frequent")
+        analyzer = SpamAnalyzer(wordlist, cascade=Cascade(model, 0.1, 0.9))
+
+        analysis = await analyzer.analyze(spam)
+        assert analysis.verdict is False
+        assert analysis.body == {}
+        assert analyzer.is_spam(analysis) is False
+        assert analyzer.cascade_stats == CascadeStats(header_only=1, full=0)
+
+    @pytest.mark.asyncio
+    async def test_uncertain_header_model(self, tmp_path):
+        model = header_model(tmp_path / "headers.pkl", "prior")
+        analyzer = SpamAnalyzer(wordlist, cascade=Cascade(model, 0.1, 0.9))
+
+        ham_analysis, spam_analysis = await asyncio.gather(analyzer.analyze(ham),
+                                                           analyzer.analyze(spam))
+        assert ham_analysis.verdict is None
+        assert analyzer.classify_multiple_input([ham_analysis,
+                                                 spam_analysis]) == [False, True]
+        assert analyzer.cascade_stats == CascadeStats(header_only=0, full=2)
+
+    def test_merge_verdicts(self):
+        analyzer = SpamAnalyzer(wordlist)
+        header_only = MailAnalysis("mail", {}, {}, {}, verdict=True)
+        assert list(analyzer.iter_classify([header_only, header_only])) == [True, True]
+
+    def test_invalid_band(self):
+        with pytest.raises(ValueError):
+            Cascade("model", 0.9, 0.1)
+
+
+class TestRequiredFeatures:
+
+    @pytest.fixture
+    def analyzer(self, tmp_path) -> SpamAnalyzer:
+        import pandas as pd
+        from sklearn.tree import DecisionTreeClassifier
+
+        from spamanalyzer.ml import save_model
+
+        features = ["has_spf", "send_date_tz_is_valid", "links"]
+        X = pd.DataFrame([[0, 0, 0], [1, 1, 1]], columns=features)
+        path = str(tmp_path / "model.pkl")
+        save_model(DecisionTreeClassifier().fit(X.values, [0, 1]), path, features)
+        return SpamAnalyzer(wordlist, model=path)
+
+    def test_analysis_keys(self):
+        keys = analysis_keys(["has_spf", "has_received_date", "polarity"])
+        assert keys == {
+            "headers": {"has_spf", "received_date"},
+            "body": {"text_polarity"},
+            "attachments": set(),
+        }
+
+    @pytest.mark.asyncio
+    async def test_skip_unused_checks(self, analyzer):
+        analysis = await analyzer.analyze(ham)
+        assert analysis.headers["has_spf"] is True
+        assert analysis.headers["send_date"] is not None
+        assert analysis.headers["domain_matches"] is None
+        assert analysis.body["has_links"] is True
+        assert analysis.body["text_polarity"] is None
+        assert analysis.attachments["has_attachments"] is None
+        assert analyzer.is_spam(analysis) is True
+
+    @pytest.mark.asyncio
+    async def test_full_analysis(self, analyzer):
+        full = await analyzer.analyze(ham, full=True)
+        # there is no blocklist to check the links against
+        assert full.body.pop("has_blocked_links") is None
+        assert None not in full.body.values()
+        assert full.headers["domain_matches"] is False
+        assert analyzer.is_spam(full) is analyzer.is_spam(await analyzer.analyze(ham))
+
+
+class TestSilent:
+    noisy = os.path.join(
+        SAMPLES_FOLDER,
+        "48.a63991ad9e759c57337c2cb9c3e5c6a155a24ab187d3c06334752c5b16f1c7e5.email",
+    )
+
+    def test_parse_is_silent(self, caplog):
+        SpamAnalyzer.parse(self.noisy)
+        assert "not handled" not in caplog.text
+
+    def test_concurrent_parse(self, caplog, capsys):
+        import logging
+        import sys
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        stdout = sys.stdout
+        logger = logging.getLogger("mailparser.mailparser")
+        stop = threading.Event()
+
+        def chatter():
+            # a thread that prints and logs while the others parse
+            count = 0
+            while not stop.is_set() or count == 0:
+                print(f"chatter {count}")
+                logger.warning("chatter %d", count)
+                count += 1
+            return count
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            chatting = executor.submit(chatter)
+            parsed = list(executor.map(SpamAnalyzer.parse,
+                                       [self.noisy, ham, spam] * 20))
+            stop.set()
+            count = chatting.result()
+
+        assert len(parsed) == 60
+        assert sys.stdout is stdout
+        out = capsys.readouterr().out
+        assert all(f"chatter {i}\n" in out for i in range(count))
+        assert [r.getMessage()
+                for r in caplog.records] == [f"chatter {i}" for i in range(count)]
@@ -47,3 +47,15 @@ class TestDomain:
             Domain.from_string("inventato")) == DomainRelation.DIFFERENT)
         assert (Domain.from_string("it.localhost").relation(
             self.domain) == DomainRelation.SUBDOMAIN)
+
+    def test_intern(self):
+        assert Domain.intern("example.com") is Domain.intern("example.com")
+        assert Domain.intern("example.com") == Domain("example.com")
+
+    def test_organizational_domain(self):
+        mail = Domain.from_string("mail.example.co.uk")
+        smtp = Domain.from_string("SMTP.Example.co.uk.")
+        assert mail.organizational_domain() is smtp.organizational_domain()
+        assert mail.organizational_domain() == Domain("example.co.uk")
+        assert Domain("co.uk").organizational_domain() == Domain("co.uk")
+        assert self.domain.organizational_domain() == self.domain
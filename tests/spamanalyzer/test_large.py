@@ -0,0 +1,86 @@
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import mailparser
+import pytest
+
+from app.io import to_csv_row, to_json_dict
+from spamanalyzer.attachments import inspect_attachment
+from spamanalyzer.data_structures import SpamAnalyzer
+from spamanalyzer.large import TruncatedMail, parse_large, reduce_message
+
+with open("src/app/conf/word_blacklist.txt", "r", encoding="utf-8") as f:
+    wordlist = f.read().splitlines()
+
+PE = b"MZ" + b"\0" * 0x3a + (0x40).to_bytes(4, "little") + b"PE\0\0"
+
+
+@pytest.fixture
+def large_mail(tmp_path):
+    message = MIMEMultipart("mixed")
+    message["From"] = "sender@example.com"
+    message["To"] = "recipient@example.org"
+    message["Subject"] = "A very large message"
+    message["Received"] = "from mail.example.com (mail.example.com [192.0.2.1])"
+    alternative = MIMEMultipart("alternative")
+    text = "first line\n" + "filler text line\n" * 20_000 + "last line\n"
+    alternative.attach(MIMEText(text, "plain"))
+    alternative.attach(MIMEText(f"<html><body><p>{text}</p></body></html>", "html"))
+    message.attach(alternative)
+    attachment = MIMEApplication(PE + bytes(500_000), "octet-stream")
+    attachment.add_header("Content-Disposition", "attachment", filename="setup.exe")
+    message.attach(attachment)
+
+    path = tmp_path / "large.email"
+    path.write_bytes(message.as_bytes())
+    return str(path)
+
+
+def test_small_mail_is_not_reduced(large_mail):
+    email = parse_large(large_mail, max_bytes=2**30)
+    assert not isinstance(email, TruncatedMail)
+
+
+def test_reduced_structure(large_mail):
+    full = mailparser.parse_from_file(large_mail)
+    email = parse_large(large_mail, max_bytes=16_384)
+    assert isinstance(email, TruncatedMail)
+    assert email.original_size > 16_384
+    assert email.headers == full.headers
+
+    # the beginning and the end of each text part are kept
+    for part in email.text_plain + email.text_html:
+        assert len(part) < 16_384
+        assert "first line" in part
+        assert "last line" in part
+
+    assert len(email.attachments) == 1
+    info = inspect_attachment(email.attachments[0])
+    assert info.filename == "setup.exe"
+    assert info.kind == "pe"
+
+
+def test_reduce_is_faithful_within_budget(large_mail):
+    with open(large_mail, "rb") as f:
+        data = f.read()
+    full = mailparser.parse_from_bytes(data)
+    email = mailparser.parse_from_bytes(reduce_message(data, len(data)))
+    assert email.text_plain == full.text_plain
+    assert email.text_html == full.text_html
+
+
+@pytest.mark.asyncio
+async def test_truncated_analysis(large_mail):
+    analyzer = SpamAnalyzer(wordlist, max_bytes=16_384)
+    analysis = await analyzer.analyze(large_mail, full=True)
+    assert analysis.truncated is True
+    assert analysis.attachments["attachment_is_executable"] is True
+
+    record = to_json_dict(analysis, analyzer.is_spam(analysis))
+    assert record["truncated"] is True
+    assert to_csv_row(record)["truncated"] is True
+
+    complete = await SpamAnalyzer(wordlist).analyze(large_mail, full=True)
+    assert complete.truncated is False
+    assert "truncated" not in to_json_dict(complete, False)
@@ -0,0 +1,203 @@
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import ExtraTreesClassifier, RandomForestClassifier
+from sklearn.tree import DecisionTreeClassifier
+
+from spamanalyzer.ml import (
+    FEATURE_DTYPE,
+    FEATURES,
+    HEADER_FEATURES,
+    CompiledForest,
+    FeatureMatrix,
+    FeatureStore,
+    SpamClassifier,
+    compile_model,
+    content_hash,
+    extraction_fingerprint,
+    load_features,
+    metadata_path,
+    save_model,
+)
+
+
+class Row:
+
+    def __init__(self, value: float) -> None:
+        self.value = value
+
+    def to_array(self, out: np.ndarray) -> np.ndarray:
+        out[:] = self.value
+        return out
+
+
+class TestFeatureMatrix:
+
+    def test_append_in_place(self):
+        matrix = FeatureMatrix(capacity=3)
+        row = matrix.append(Row(1))
+        assert len(matrix) == 1
+        assert matrix.features.shape == (1, len(FEATURES))
+        assert matrix.features.dtype == FEATURE_DTYPE
+        assert np.shares_memory(row, matrix.features)
+
+    def test_full_and_clear(self):
+        matrix = FeatureMatrix(capacity=2)
+        matrix.append(Row(1))
+        matrix.append(Row(2))
+        assert matrix.full
+        with pytest.raises(OverflowError):
+            matrix.append(Row(3))
+
+        matrix.clear()
+        assert len(matrix) == 0
+        matrix.append(Row(3))
+        assert matrix.features[0, 0] == 3
+
+    def test_invalid_capacity(self):
+        with pytest.raises(ValueError):
+            FeatureMatrix(capacity=0)
+
+
+def fit(features, path) -> str:
+    X = pd.DataFrame([[0] * len(features), [1] * len(features)], columns=features)
+    save_model(DecisionTreeClassifier().fit(X, [0, 1]), str(path))
+    return str(path)
+
+
+class TestSpamClassifier:
+
+    def test_feature_names(self, tmp_path):
+        classifier = SpamClassifier(fit(["has_spf", "links"], tmp_path / "model.pkl"))
+        assert classifier.features == ("has_spf", "links")
+
+    def test_metadata(self, tmp_path):
+        path = fit(["has_spf", "links"], tmp_path / "model.pkl")
+        save_model(SpamClassifier(path).model, path, features=["has_spf", "links"])
+        assert metadata_path(path) == str(tmp_path / "model.json")
+        assert load_features(path) == ["has_spf", "links"]
+
+        assert load_features(str(tmp_path / "missing.pkl")) is None
+
+    def test_unknown_features(self, tmp_path):
+        path = fit(["has_spf", "links"], tmp_path / "model.pkl")
+        with pytest.raises(ValueError):
+            SpamClassifier(path, features=["not_a_feature"])
+
+    def test_select_columns(self, tmp_path):
+        classifier = SpamClassifier(fit(["links", "has_spf"], tmp_path / "model.pkl"))
+        X = np.zeros((2, len(FEATURES)), dtype=FEATURE_DTYPE)
+        X[1, FEATURES.index("links")] = 1
+        X[1, FEATURES.index("has_spf")] = 1
+        assert classifier.predict(X).tolist() == [0, 1]
+        assert classifier.predict_proba(X).tolist() == [0.0, 1.0]
+        with pytest.raises(ValueError):
+            classifier.predict(X[:, :10], columns=HEADER_FEATURES)
+
+
+class TestFeatureStore:
+
+    def test_content_hash(self, tmp_path):
+        first, second = tmp_path / "first", tmp_path / "second"
+        first.write_bytes(b"same content")
+        second.write_bytes(b"same content")
+        assert content_hash(str(first)) == content_hash(str(second))
+        second.write_bytes(b"new content")
+        assert content_hash(str(first)) != content_hash(str(second))
+
+    def test_roundtrip(self, tmp_path):
+        store = FeatureStore()
+        row = np.arange(len(FEATURES), dtype=FEATURE_DTYPE)
+        store.add(b"a" * 32, row, 1)
+        store.add(b"b" * 32, row * 2, 0)
+        store.add(b"a" * 32, row * 3, 0)
+        assert len(store) == 2
+
+        path = str(tmp_path / "features.npz")
+        store.save(path)
+        loaded = FeatureStore.load(path)
+        assert b"a" * 32 in loaded
+        assert b"c" * 32 not in loaded
+
+        X, y = loaded.dataset([b"b" * 32, b"a" * 32])
+        assert X.tolist() == [(row * 2).tolist(), (row * 3).tolist()]
+        assert y.tolist() == [0, 0]
+
+    def test_empty_and_invalid(self, tmp_path):
+        path = str(tmp_path / "features.npz")
+        assert len(FeatureStore.load(path)) == 0
+        FeatureStore().save(path)
+        assert len(FeatureStore.load(path)) == 0
+        with pytest.raises(ValueError):
+            FeatureStore().add(b"short", np.zeros(len(FEATURES)), 0)
+
+    def test_fingerprint(self, tmp_path):
+        wordlist = ["viagra", "lottery"]
+        fingerprint = extraction_fingerprint(wordlist, offline=False)
+        assert fingerprint == extraction_fingerprint(wordlist, offline=False)
+        assert fingerprint != extraction_fingerprint(wordlist, offline=True)
+        assert fingerprint != extraction_fingerprint(wordlist[:1], offline=False)
+
+        path = str(tmp_path / "features.npz")
+        store = FeatureStore(fingerprint)
+        store.add(b"a" * 32, np.zeros(len(FEATURES)), 1)
+        store.save(path)
+        assert len(FeatureStore.load(path, fingerprint)) == 1
+        other = extraction_fingerprint(wordlist, offline=True)
+        assert len(FeatureStore.load(path, other)) == 0
+
+        # a store without fingerprint was extracted from unknown inputs
+        np.savez(path, columns=np.array(FEATURES))
+        assert len(FeatureStore.load(path, fingerprint)) == 0
+
+
+class TestCompiledForest:
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.integers(0, 2,
+                                  size=(400, len(FEATURES))).astype(FEATURE_DTYPE),
+                     columns=FEATURES)
+    X["polarity"] = rng.uniform(-1, 1, size=400).astype(FEATURE_DTYPE)
+    y = (X["has_spf"] + X["polarity"] + rng.normal(0, 0.5, size=400) < 0.7).astype(int)
+
+    @pytest.mark.parametrize(
+        "model",
+        [
+            DecisionTreeClassifier(random_state=0),
+            RandomForestClassifier(n_estimators=15, random_state=0),
+            ExtraTreesClassifier(n_estimators=5, max_depth=4, random_state=0),
+        ],
+    )
+    def test_same_predictions(self, model, tmp_path):
+        model.fit(self.X, self.y)
+        path = str(tmp_path / "model.npz")
+        compile_model(model, path, FEATURES)
+
+        compiled = CompiledForest.load(path)
+        assert compiled.feature_names_in_ == FEATURES
+        assert np.array_equal(compiled.predict_proba(self.X.values),
+                              model.predict_proba(self.X))
+        assert np.array_equal(compiled.predict(self.X.values), model.predict(self.X))
+
+        classifier = SpamClassifier(path)
+        assert isinstance(classifier.model, CompiledForest)
+        assert classifier.features == tuple(FEATURES)
+        assert np.array_equal(classifier.predict(self.X.values), model.predict(self.X))
+
+    def test_unsupported_model(self, tmp_path):
+        from sklearn.dummy import DummyClassifier
+
+        model = DummyClassifier().fit(self.X, self.y)
+        with pytest.raises(TypeError):
+            compile_model(model, str(tmp_path / "model.npz"), FEATURES)
+
+    def test_no_sklearn_import(self, tmp_path):
+        path = str(tmp_path / "model.npz")
+        compile_model(DecisionTreeClassifier().fit(self.X, self.y), path, FEATURES)
+        code = ("import sys, numpy as np\n"
+                "from spamanalyzer.ml import SpamClassifier, FEATURES\n"
+                f"SpamClassifier({path!r}).predict(np.zeros((1, len(FEATURES))))\n"
+                "assert 'sklearn' not in sys.modules and 'pandas' not in sys.modules\n")
+        subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,124 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from spamanalyzer import SpamAnalyzer, utils
+from spamanalyzer.domain import Domain
+from spamanalyzer.mapped import map_arrays, save_arrays
+from spamanalyzer.networks import Network, NetworkTable, compile_networks
+
+with open("src/app/conf/word_blacklist.txt", "r", encoding="utf-8") as f:
+    wordlist = f.read().splitlines()
+
+# sent from 63.21.73.124, then relayed by the servers of the recipient
+sample = "tests/samples/43.169cc8b3a7674100e717a906f0e351fe5a7de3ab8814e7a9565933544ebc1756.email"
+
+RANGES = """range_start\trange_end\tAS_number\tcountry_code\tAS_description
+# the first half of the IPv4 addresses
+0.0.0.0\t127.255.255.255\t64500\tZZ\tLOW-AS
+128.0.0.0\t191.255.255.255\t64501\tZZ\tHIGH-AS, with a comma
+192.0.0.0\t255.255.255.255\t0\tNone\tNot routed
+2001:db8::\t2001:db8:ffff:ffff:ffff:ffff:ffff:ffff\t64502\tZZ\tDOC-AS
+"""
+
+
+@pytest.fixture
+def table(tmp_path) -> NetworkTable:
+    source = tmp_path / "ranges.tsv"
+    source.write_text(RANGES)
+    path = str(tmp_path / "networks.bin")
+    assert compile_networks(str(source), path) == 3
+    return NetworkTable.load(path)
+
+
+def test_lookup(table):
+    assert table.lookup("10.1.2.3") == Network(64500, "LOW-AS", "0.0.0.0",
+                                               "127.255.255.255")
+    assert table.lookup("172.190.254.199").name == "HIGH-AS, with a comma"
+    assert table.asn("2001:db8::1") == 64502
+    # not routed, out of the table or invalid
+    assert table.lookup("203.0.113.1") is None
+    assert table.asn("2001:db9::1") is None
+    assert table.asn("not an address") is None
+    assert len(pickle.loads(pickle.dumps(table))) == len(table) == 3
+
+
+def test_cidr_and_overlaps(tmp_path):
+    source = tmp_path / "blocks.csv"
+    source.write_text(
+        "network,autonomous_system_number,autonomous_system_organization\n"
+        '10.0.0.0/8,64510,"TEN"\n'
+        "10.1.0.0/16,64511,\n")
+    path = str(tmp_path / "blocks.bin")
+    compile_networks(str(source), path)
+    table = NetworkTable.load(path)
+    assert table.lookup("10.0.0.1").last == "10.0.255.255"
+    assert table.lookup("10.1.0.1") == Network(64511, None, "10.1.0.0", "10.1.255.255")
+    # the tail of the /8 after the /16 is kept
+    assert table.lookup("10.2.0.1") == Network(64510, "TEN", "10.2.0.0",
+                                               "10.255.255.255")
+
+    source.write_text("10.0.0.0,10.0.0.255,64510\nnot,an,address\n")
+    with pytest.raises(ValueError):
+        compile_networks(str(source), path)
+
+
+def test_nested_ranges(tmp_path):
+    source = tmp_path / "ranges.csv"
+    source.write_text("10.0.0.0,10.255.255.255,1\n"
+                      "10.1.0.0,10.1.255.255,2\n"
+                      "10.1.2.0,10.1.2.255,3\n"
+                      "10.1.200.0,10.2.0.255,4\n"
+                      "10.3.0.0,10.3.0.255,5\n")
+    path = str(tmp_path / "ranges.bin")
+    compile_networks(str(source), path)
+    table = NetworkTable.load(path)
+    expected = {
+        "10.0.0.1": 1,
+        "10.1.0.1": 2,
+        "10.1.2.1": 3,
+        "10.1.3.1": 2,
+        "10.1.200.1": 4,
+        "10.2.0.1": 4,
+        "10.2.1.1": 1,
+        "10.3.0.1": 5,
+        "10.200.0.1": 1,
+        "10.255.255.255": 1,
+        "11.0.0.0": None,
+    }
+    assert {address: table.asn(address) for address in expected} == expected
+
+
+def test_mapped_arrays(tmp_path):
+    path = str(tmp_path / "arrays.bin")
+    arrays = {"keys": np.arange(5, dtype=np.uint64), "empty": np.empty(0, np.int32)}
+    save_arrays(path, "test", 1, arrays)
+    mapped = map_arrays(path, "test", 1)
+    assert mapped["keys"].tolist() == [0, 1, 2, 3, 4]
+    assert mapped["empty"].dtype == np.int32 and len(mapped["empty"]) == 0
+    with pytest.raises(ValueError):
+        map_arrays(path, "test", 2)
+    with pytest.raises(ValueError):
+        map_arrays(sample, "test", 1)
+
+
+@pytest.mark.asyncio
+async def test_received_networks(table):
+    email = SpamAnalyzer.parse(sample)
+    addresses = utils.received_addresses(email)
+    assert addresses[0] == "63.21.73.124"
+
+    analyzer = SpamAnalyzer(wordlist, networks=table)
+    headers = (await analyzer.analyze(sample)).headers
+    assert headers["origin_asn"] == 64500
+    assert headers["origin_network"] == "LOW-AS"
+    assert headers["received_asns"] == len({table.asn(ip) for ip in addresses} - {None})
+
+    without = (await SpamAnalyzer(wordlist).analyze(sample, full=True)).headers
+    assert not set(utils.NETWORK_KEYS) & set(without)
+
+
+def test_domain_network(table):
+    assert Domain("unknown", "10.0.0.1").network(table).asn == 64500
+    assert Domain("example.com").network(table) is None
@@ -0,0 +1,113 @@
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+from spamanalyzer.data_structures import SpamAnalyzer, default_model
+from spamanalyzer.ml import SpamClassifier, compile_model
+from spamanalyzer.parallel import (
+    AnalysisPool,
+    SharedArrays,
+    WorkerMemory,
+    memory_usage,
+    plan_chunks,
+)
+
+SAMPLES_FOLDER = "tests/samples"
+
+samples = [
+    os.path.join(SAMPLES_FOLDER, name) for name in (
+        "97.47949e45691dd7a024dcfaacef4831461bf5d5f09c85a6e44ee478a5bcaf8539.email",
+        "00.1d30d499c969369915f69e7cf1f5f5e3fdd567d41e8721bf8207fa52a78aff9a.email",
+    )
+] * 3
+
+with open("src/app/conf/word_blacklist.txt", "r", encoding="utf-8") as f:
+    wordlist = f.read().splitlines()
+
+
+@pytest.fixture(scope="module")
+def compiled(tmp_path_factory) -> str:
+    classifier = SpamClassifier(default_model())
+    path = str(tmp_path_factory.mktemp("model") / "classifier.npz")
+    compile_model(classifier.model, path, classifier.features)
+    return path
+
+
+class TestSharedArrays:
+
+    def test_publish_and_attach(self):
+        arrays = {
+            "a": np.arange(5, dtype=np.int8),
+            "b": np.linspace(0, 1, 6).reshape(2, 3),
+        }
+        shared = SharedArrays.publish(arrays)
+        reader = SharedArrays.attach(shared.handle)
+        try:
+            for name, array in reader.arrays().items():
+                np.testing.assert_array_equal(array, arrays[name])
+                assert array.dtype == arrays[name].dtype
+                assert not array.flags.writeable
+        finally:
+            reader.close()
+            shared.close()
+
+
+class TestAnalysisPool:
+
+    @pytest.mark.parametrize("start_method", ["fork", "spawn"])
+    @pytest.mark.parametrize("compiled_model", [False, True])
+    def test_same_verdicts(self, start_method, compiled_model, compiled):
+        model = compiled if compiled_model else None
+        analyzer = SpamAnalyzer(wordlist, model)
+        expected = analyzer.classify_multiple_input(
+            [asyncio.run(analyzer.analyze(path)) for path in samples])
+
+        with AnalysisPool(wordlist, model, jobs=2, start_method=start_method) as pool:
+            results = list(pool.map(samples, chunksize=2))
+            report = pool.memory_report()
+
+        assert [analysis.file_path for analysis, _ in results] == samples
+        assert [is_spam for _, is_spam in results] == expected
+        assert 2 <= len(report) <= 3
+        assert report[0].pid == os.getpid()
+
+    def test_features_only(self):
+        with AnalysisPool(wordlist, jobs=2) as pool:
+            results = list(pool.map(samples[:2], classify=False, full=True))
+        assert [is_spam for _, is_spam in results] == [None, None]
+        body = results[0][0].body
+        assert None not in [body[key] for key in body if key != "has_blocked_links"]
+
+    def test_map_chunks(self):
+        sized = [(path, os.path.getsize(path)) for path in samples]
+        with AnalysisPool(wordlist, jobs=2) as pool:
+            expected = dict((analysis.file_path, is_spam)
+                            for analysis, is_spam in pool.map(samples))
+            results = list(pool.map_chunks(plan_chunks(sized, pool.jobs)))
+            report = pool.utilization_report()
+
+        assert sorted(analysis.file_path for analysis, _ in results) == sorted(samples)
+        assert all(expected[analysis.file_path] == is_spam
+                   for analysis, is_spam in results)
+        assert sum(worker.mails for worker in report) == 2 * len(samples)
+        assert all(0 < worker.utilization <= 1 for worker in report)
+
+
+def test_plan_chunks():
+    sized = [("huge", 1000), ("big", 300)] + [(f"small-{i:02}", 10) for i in range(30)]
+    chunks = list(plan_chunks(reversed(sized), jobs=2, max_chunk=8))
+
+    assert [path for chunk in chunks for path in chunk] == [path for path, _ in sized]
+    assert chunks[:2] == [["huge"], ["big"]]
+    assert all(len(chunk) <= 8 for chunk in chunks)
+    # the chunks get smaller towards the end, to balance the load
+    assert len(chunks[-1]) < len(chunks[2])
+
+
+def test_memory_usage():
+    memory = memory_usage()
+    assert isinstance(memory, WorkerMemory)
+    assert memory.pid == os.getpid()
+    assert memory.rss > 0
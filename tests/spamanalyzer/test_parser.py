@@ -0,0 +1,99 @@
+import os
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import pytest
+
+from spamanalyzer import utils
+from spamanalyzer.data_structures import SpamAnalyzer
+from spamanalyzer.large import is_truncated, parse_large
+from spamanalyzer.parser import StdlibMail
+
+SAMPLES_FOLDER = "tests/samples"
+SAMPLES = sorted(os.listdir(SAMPLES_FOLDER))
+
+with open("src/app/conf/word_blacklist.txt", "r", encoding="utf-8") as f:
+    wordlist = f.read().splitlines()
+
+
+def parse_both(sample):
+    path = os.path.join(SAMPLES_FOLDER, sample)
+    return SpamAnalyzer.parse(path), SpamAnalyzer.parse(path, parser="stdlib")
+
+
+@pytest.mark.parametrize("sample", SAMPLES)
+def test_parity(sample):
+    expected, email = parse_both(sample)
+    assert isinstance(email, StdlibMail)
+    assert email.headers == expected.headers
+    assert email.timezone == expected.timezone
+    assert email.received == expected.received[:1]
+    assert SpamAnalyzer.is_analyzable(email) == SpamAnalyzer.is_analyzable(expected)
+    if not expected.headers:
+        # mailparser leaves a mail without headers unparsed
+        assert not email.body and not expected.body
+        return
+    assert email.text_plain == expected.text_plain
+    assert email.text_html == expected.text_html
+    assert email.text_not_managed == expected.text_not_managed
+    assert email.body == expected.body
+    assert email.attachments == expected.attachments
+
+
+@pytest.mark.parametrize("sample", SAMPLES)
+def test_analysis_parity(sample):
+    expected, email = parse_both(sample)
+    if not SpamAnalyzer.is_analyzable(expected):
+        return
+    headers = utils.inspect_local_headers(email, wordlist)
+    assert headers == utils.inspect_local_headers(expected, wordlist)
+    body, _ = utils.inspect_parts(email, wordlist)
+    assert body == utils.inspect_parts(expected, wordlist)[0]
+    attachments = utils.inspect_attachments(email.attachments)
+    assert attachments == utils.inspect_attachments(expected.attachments)
+
+
+def test_invalid_parser():
+    with pytest.raises(ValueError):
+        SpamAnalyzer(wordlist, parser="unknown")
+
+
+def test_eight_bit_text():
+    # the invalid UTF-8 bytes are dropped, as mailparser does
+    message = MIMEText("")
+    message["Received"] = "from mail.example.com"
+    del message["Content-Transfer-Encoding"]
+    message["Content-Transfer-Encoding"] = "8bit"
+    raw = message.as_bytes() + "caffè ☕".encode() + b" \xb7dot"
+    email = StdlibMail.from_bytes(raw)
+    assert email.text_plain == ["caffè ☕ dot"]
+
+
+def test_truncated(tmp_path):
+    message = MIMEMultipart()
+    message["From"] = "sender@example.com"
+    message["Received"] = "from mail.example.com (mail.example.com [192.0.2.1])"
+    message.attach(MIMEText("some text\n" * 10_000))
+    attachment = MIMEApplication(bytes(200_000), "octet-stream")
+    attachment.add_header("Content-Disposition", "attachment", filename="data.bin")
+    message.attach(attachment)
+    path = tmp_path / "large.email"
+    path.write_bytes(message.as_bytes())
+
+    email = parse_large(str(path), 4096, parser="stdlib")
+    assert isinstance(email, StdlibMail)
+    assert is_truncated(email)
+    assert email.original_size == os.path.getsize(path)
+    assert len(email.attachments) == 1
+    assert not is_truncated(parse_large(str(path), 2**30, parser="stdlib"))
+
+
+@pytest.mark.asyncio
+async def test_analyze():
+    path = os.path.join(SAMPLES_FOLDER, SAMPLES[0])
+    expected = await SpamAnalyzer(wordlist).analyze(path, full=True)
+    analysis = await SpamAnalyzer(wordlist, parser="stdlib").analyze(path, full=True)
+    assert analysis.headers.pop("domain_matches") == expected.headers.pop(
+        "domain_matches")
+    assert analysis.to_dict() == expected.to_dict()
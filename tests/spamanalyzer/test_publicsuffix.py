@@ -0,0 +1,43 @@
+from spamanalyzer.publicsuffix import (
+    compile_rules,
+    organizational_domain,
+    public_suffix_length,
+)
+
+RULES = compile_rules([
+    "// comment",
+    "",
+    "com",
+    "uk",
+    "co.uk",
+    "*.ck",
+    "!www.ck",
+    "*.kawasaki.jp",
+    "!city.kawasaki.jp",
+    "公司.cn",
+])
+
+
+def suffix(name: str) -> int:
+    return public_suffix_length(list(reversed(name.split("."))), RULES)
+
+
+def test_rules():
+    assert suffix("example.com") == 1
+    assert suffix("mail.example.co.uk") == 2
+    # a top level domain not in the list is a public suffix
+    assert suffix("example.localhost") == 1
+    assert suffix("shop.example.ck") == 2
+    assert suffix("www.ck") == 1
+    assert suffix("x.y.kawasaki.jp") == 3
+    assert suffix("x.city.kawasaki.jp") == 2
+    assert suffix("example.xn--55qx5d.cn") == 2
+
+
+def test_organizational_domain():
+    assert organizational_domain("mail.example.co.uk") == "example.co.uk"
+    assert organizational_domain("MX05.Hotmail.COM.") == "hotmail.com"
+    assert organizational_domain("smtp0221.mail.yahoo.com") == "yahoo.com"
+    assert organizational_domain("x.city.kawasaki.jp") == "city.kawasaki.jp"
+    assert organizational_domain("co.uk") is None
+    assert organizational_domain("unknown") is None
@@ -0,0 +1,164 @@
+import asyncio
+import pickle
+import socket
+import threading
+import time
+
+import pytest
+
+from spamanalyzer import SpamAnalyzer, utils
+from spamanalyzer.domain import Domain
+from spamanalyzer.resolver import ResolverCache
+
+with open("src/app/conf/word_blacklist.txt", "r", encoding="utf-8") as f:
+    wordlist = f.read().splitlines()
+
+# their first hop has an address but no domain name
+SAMPLES = [
+    "tests/samples/43.169cc8b3a7674100e717a906f0e351fe5a7de3ab8814e7a9565933544ebc1756.email",
+    "tests/samples/68.118a57e01f2541ab92ec7540022063ac2899c1eb51def2dd103d2c2bd9055f1f.email",
+    "tests/samples/11.3615317d269104afb6ca29aa7d17e5a61f879e815c6079b9e152af423635b6c8.email",
+]
+
+
+class FakeDNS:
+    """A `socket.gethostbyaddr` counting its lookups and the ones running at once."""
+
+    def __init__(self, delay: float = 0.01) -> None:
+        self.delay = delay
+        self.lookups: list = []
+        self.running = self.max_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, ip_addr: str):
+        with self.lock:
+            self.lookups.append(ip_addr)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+        if ip_addr.startswith("10."):
+            raise socket.herror("host not found")
+        return f"host-{ip_addr.replace('.', '-')}.example.com", [], [ip_addr]
+
+
+@pytest.fixture
+def dns(monkeypatch):
+    fake = FakeDNS()
+    monkeypatch.setattr(socket, "gethostbyaddr", fake)
+    return fake
+
+
+@pytest.mark.asyncio
+async def test_each_address_once(dns):
+    resolver = ResolverCache(concurrency=2)
+    addresses = ["192.0.2.1", "192.0.2.2", "192.0.2.3", "192.0.2.1", "10.0.0.1"] * 3
+    assert await resolver.prefetch(addresses) == 4
+    assert sorted(dns.lookups) == sorted(set(addresses))
+    assert dns.max_running <= 2
+
+    assert await resolver.reverse("192.0.2.1") == "host-192-0-2-1.example.com"
+    # a failure is cached too
+    assert await resolver.reverse("10.0.0.1") is None
+    assert len(dns.lookups) == 4
+    assert resolver.stats().misses == 4
+
+
+@pytest.mark.asyncio
+async def test_lookups_in_flight_are_shared(dns):
+    resolver = ResolverCache()
+    names = await asyncio.gather(*(resolver.reverse("192.0.2.1") for _ in range(5)))
+    assert set(names) == {"host-192-0-2-1.example.com"}
+    assert dns.lookups == ["192.0.2.1"]
+    assert resolver.stats().hits == 4
+
+
+@pytest.mark.asyncio
+async def test_timeout(dns):
+    dns.delay = 0.5
+    resolver = ResolverCache(timeout=0.01)
+    assert await resolver.reverse("192.0.2.1") is None
+    assert "192.0.2.1" in resolver
+
+
+def test_event_loops(dns):
+    # `AnalysisPool` runs each chunk in a new event loop
+    resolver = ResolverCache()
+    asyncio.run(resolver.prefetch(["192.0.2.1"]))
+    asyncio.run(resolver.prefetch(["192.0.2.1", "192.0.2.2"]))
+    assert dns.lookups == ["192.0.2.1", "192.0.2.2"]
+    assert len(pickle.loads(pickle.dumps(resolver))) == 2
+
+
+@pytest.mark.asyncio
+async def test_from_ip(dns):
+    resolver = ResolverCache()
+    domain = await Domain.from_ip("192.0.2.1", resolver)
+    assert domain == Domain("host-192-0-2-1.example.com")
+    assert await Domain.from_ip("10.0.0.1", resolver) == Domain("unknown")
+
+
+@pytest.mark.asyncio
+async def test_prefetch_samples(dns):
+    resolver = ResolverCache()
+    analyzer = SpamAnalyzer(wordlist, resolver=resolver)
+    emails = [SpamAnalyzer.parse(path) for path in SAMPLES]
+    resolved = await analyzer.prefetch(emails, full=True)
+    addresses = {ip for email in emails for ip in utils.reverse_lookups(email)}
+    assert resolved == len(addresses) > 0
+
+    headers = [(await analyzer.analyze(path, full=True)).headers for path in SAMPLES]
+    assert len(dns.lookups) == resolved
+    expected = SpamAnalyzer(wordlist)
+    for path, analysis in zip(SAMPLES, headers):
+        assert analysis == (await expected.analyze(path, full=True)).headers
+
+
+@pytest.mark.asyncio
+async def test_save_and_load(dns, tmp_path):
+    path = str(tmp_path / "dns.sqlite")
+    resolver = ResolverCache(negative_ttl=-1)
+    await resolver.prefetch(["192.0.2.1", "10.0.0.1"])
+    resolver.save(path)
+
+    loaded = ResolverCache.load(path)
+    assert len(loaded) == 2
+    assert await loaded.reverse("192.0.2.1") == "host-192-0-2-1.example.com"
+    # the failed lookup has expired, it is resolved again
+    assert "10.0.0.1" not in loaded
+    await loaded.reverse("10.0.0.1")
+    assert dns.lookups.count("10.0.0.1") == 2
+
+    # saving merges with the lookups already in the file
+    other = ResolverCache()
+    await other.reverse("192.0.2.2")
+    other.save(path)
+    assert len(ResolverCache.load(path)) == 3
+
+
+@pytest.mark.asyncio
+async def test_offline(dns, tmp_path):
+    path = str(tmp_path / "dns.sqlite")
+    warm = ResolverCache(ttl=-1)
+    await warm.reverse("192.0.2.1")
+    warm.save(path)
+    dns.lookups.clear()
+
+    resolver = ResolverCache.load(path, offline=True)
+    # the expired lookups are still used
+    assert await resolver.reverse("192.0.2.1") == "host-192-0-2-1.example.com"
+    assert await resolver.reverse("192.0.2.2") is None
+    assert await resolver.prefetch(["192.0.2.3"]) == 0
+    assert await Domain.from_ip("192.0.2.4",
+                                ResolverCache(offline=True)) == Domain("unknown")
+    assert dns.lookups == []
+
+
+def test_merge():
+    resolver = ResolverCache()
+    resolver.merge({"192.0.2.1": ("old.example.com", time.time() + 10)})
+    resolver.merge({"192.0.2.1": ("new.example.com", time.time() + 20)})
+    resolver.merge({"192.0.2.1": ("stale.example.com", time.time() + 5)})
+    assert asyncio.run(resolver.reverse("192.0.2.1")) == "new.example.com"
+    assert resolver.pop_resolved() == {}
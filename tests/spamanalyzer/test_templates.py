@@ -0,0 +1,94 @@
+import asyncio
+import os
+
+import pytest
+
+from spamanalyzer import utils
+from spamanalyzer.data_structures import SpamAnalyzer
+from spamanalyzer.stats import CacheStats
+from spamanalyzer.templates import TemplateCache, TemplateEntry
+
+SAMPLES_FOLDER = "tests/samples"
+
+spam = os.path.join(
+    SAMPLES_FOLDER,
+    "00.1d30d499c969369915f69e7cf1f5f5e3fdd567d41e8721bf8207fa52a78aff9a.email",
+)
+
+with open("src/app/conf/word_blacklist.txt", "r", encoding="utf-8") as f:
+    wordlist = f.read().splitlines()
+
+template = ("<html><body><p>Dear {}, your order is a great deal! Act now and get "
+            "100% free shipping.</p></body></html>")
+
+
+class TestTemplateCache:
+
+    def test_lru(self):
+        cache = TemplateCache(2)
+        for name in ("a", "b"):
+            cache.put(TemplateCache.key(name), TemplateEntry(name))
+        assert cache.get(TemplateCache.key("a")) is not None
+        cache.put(TemplateCache.key("c"), TemplateEntry("c"))
+
+        # "b" is the least recently used entry
+        assert cache.get(TemplateCache.key("b")) is None
+        assert cache.get(TemplateCache.key("a")) is not None
+        assert len(cache) == 2
+        assert cache.stats() == CacheStats(hits=2, misses=1)
+        assert cache.stats().hit_rate == pytest.approx(2 / 3)
+
+    def test_key(self):
+        alice = TemplateCache.key(template.format("alice"))
+        assert alice == TemplateCache.key(template.format("alice"))
+        assert alice != TemplateCache.key(template.format("bob"))
+
+    def test_invalid_size(self):
+        with pytest.raises(ValueError):
+            TemplateCache(0)
+
+
+def test_inspect_body():
+    cache = TemplateCache()
+    body = template.format("alice").replace("now", "now https://example.com/?id=1")
+    expected = utils.inspect_body(body, wordlist)
+    assert utils.inspect_body(body, wordlist, cache=cache) == expected
+
+    # the links are removed before the lookup
+    other_link = body.replace("id=1", "id=2")
+    assert utils.inspect_body(other_link, wordlist, cache=cache) == expected
+    assert cache.stats() == CacheStats(hits=1, misses=1)
+
+    # the values missing from an entry are computed and added to it
+    other = template.format("carol")
+    partial = utils.inspect_body(other, wordlist, keys={"text_polarity"}, cache=cache)
+    assert partial["forbidden_words_percentage"] is None
+    assert utils.inspect_body(other, wordlist,
+                              cache=cache) == utils.inspect_body(other, wordlist)
+    assert cache.stats() == CacheStats(hits=2, misses=2)
+
+
+def test_exact_hits():
+    # the bodies that differ in an address have their own values
+    cache = TemplateCache()
+    utils.inspect_body(template.format("bob@example.com"), wordlist, cache=cache)
+    spammy = template.format("viagra@example.com")
+    cached = utils.inspect_body(spammy, wordlist, cache=cache)
+    assert cached == utils.inspect_body(spammy, wordlist)
+    assert cache.stats() == CacheStats(hits=0, misses=2)
+
+
+def test_analyzer(tmp_path):
+    # the same body with different headers
+    with open(spam, "r", encoding="latin-1") as f:
+        content = f.read()
+    copy = str(tmp_path / "copy.email")
+    with open(copy, "w", encoding="latin-1") as f:
+        f.write(content.replace("Subject:", "Subject: Re:", 1))
+
+    analyzer = SpamAnalyzer(wordlist, template_cache=TemplateCache())
+    first, second = (asyncio.run(analyzer.analyze(path, full=True))
+                     for path in (spam, copy))
+    assert first.body == second.body
+    assert analyzer.template_cache is not None
+    assert analyzer.template_cache.stats() == CacheStats(hits=1, misses=1)
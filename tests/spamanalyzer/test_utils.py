@@ -130,6 +130,16 @@ async def test_get_domain():
     assert await utils.get_domain(ip_address) == Domain("localhost")
 
 
+@pytest.mark.asyncio
+async def test_domain_matches_organization():
+    mail = mailparser.parse_from_string(
+        "Received: from smtp.example.co.uk (smtp.example.co.uk [192.0.2.1])\n"
+        "  by mx.example.net; Mon, 1 Jan 2024 00:00:00 +0000\n"
+        "From: Alice <alice@mail.example.co.uk>\n"
+        "Subject: hello\n\nhello\n")
+    assert await utils.from_domain_matches_received(mail) is True
+
+
 class TestStringAnalysis:
     html_text = "<html><body><p>some text</p></body></html>"
     html_form = '<form action="https://github.com" method="post"><input type="text" name="username" /></form>'
@@ -205,6 +215,16 @@ class TestLinks:
         assert links["https_only"] is True
 
 
+def test_wordlist_pattern():
+    pattern = utils.wordlist_pattern(wordlist)
+    subjects = ["Act now!", "a cactus", "FREE money", "hello", "(1+1)? [x]", ""]
+    for subject in subjects + wordlist:
+        expected = any(word in subject for word in wordlist)
+        assert (pattern.search(subject) is not None) == expected
+    assert utils.wordlist_pattern([]).search("anything") is None
+    assert utils.wordlist_pattern(["a.b", "a"]).search("xay") is not None
+
+
 def test_forbidden_words():
     forbidden_words = ["egg", "spam"]
     body = "a string of trustable words"
@@ -222,3 +242,42 @@ def test_inspect_attachments():
     assert utils.inspect_attachments(spam.attachments)["has_attachments"] is False
     assert (utils.inspect_attachments(spam.attachments)["attachment_is_executable"]
             is False)
+
+
+def test_inspect_body_keys():
+    full = utils.inspect_body(spam.body, wordlist)
+    keys = {"has_images", "forbidden_words_percentage"}
+    partial = utils.inspect_body(spam.body, wordlist, keys=keys)
+    assert list(partial) == list(utils.BODY_KEYS)
+    for key in keys:
+        assert partial[key] == full[key]
+    assert partial["text_polarity"] is None
+    assert partial["is_uppercase"] is None
+
+
+def test_inspect_parts():
+    # a single version of the body is analyzed as a whole
+    body, parts = utils.inspect_parts(spam, wordlist)
+    assert body == utils.inspect_body(spam.body, wordlist)
+    assert all(part.role == "all" for part in parts)
+
+    alternative = mailparser.parse_from_file(
+        "tests/samples/10.9b68fb361d07cc30d9923b2134cb4471fd9f21fa35eebd30093dc296fdd0f7eb.email"
+    )
+    body, parts = utils.inspect_parts(alternative, wordlist)
+    html = utils.inspect_body("\n".join(alternative.text_html), wordlist)
+    text = utils.inspect_body("\n".join(alternative.text_plain), wordlist)
+    assert {part.role for part in parts} == {"html", "text"}
+    assert sum(part.size for part in parts if part.role == "html") == sum(
+        len(part) for part in alternative.text_html)
+    for key in utils.BODY_KEYS:
+        assert body[key] == (text[key] if key in utils.TEXT_KEYS else html[key])
+
+    # a plain version much shorter than the html one is only a stub
+    stub = mailparser.parse_from_file(
+        "tests/samples/46.6c6bcc077981f604bc562aa227b854ce99d3c2a104c7b4bfbf3beb3a69ecfca7.email"
+    )
+    body, parts = utils.inspect_parts(stub, wordlist)
+    assert [part.role for part in parts
+            if part.content_type == "text/plain"] == ["skipped"]
+    assert body == utils.inspect_body("\n".join(stub.text_html), wordlist)